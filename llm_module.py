@@ -1,47 +1,41 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer
-import subprocess
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "rag"))
+from model_registry import get_causal_lm
+from generation_engine import get_generation_engine
+from cli_worker_pool import get_worker_pool
 
 class LLM:
-    def __init__(self, model_type="ollama", model_name="distilgpt2"):
+    def __init__(self, model_type="ollama", model_name="distilgpt2", draft_model=None, draft_tokens=4):
         self.model_type = model_type
         self.model_name = model_name
         
         if self.model_type == "ollama":
-            self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-            self.model = AutoModelForCausalLM.from_pretrained(model_name)
-            # Ensure the padding token is set if not already defined
-            if self.tokenizer.pad_token is None:
-                self.tokenizer.pad_token = self.tokenizer.eos_token
-
-            # Set the model to evaluation mode
-            self.model.eval()
+            # Shared with every other LLM instance in the process; the registry
+            # sets the padding token and puts the model in evaluation mode
+            self.tokenizer, self.model = get_causal_lm(model_name)
+            # Concurrent generate_text calls are decoded together in one batch;
+            # a draft model (e.g. distilgpt2 for gpt2) speeds up lone requests
+            drafting = {'draft_model': draft_model, 'draft_tokens': draft_tokens} if draft_model else {}
+            self.engine = get_generation_engine(model_name, **drafting)
         elif self.model_type == "gemini":
             self.model = None  # Placeholder for Gemini model
             self.tokenizer = None  # Placeholder for Gemini tokenizer
-            # Initialize Gemini model here if needed
+            # Long-lived backend processes shared by every LLM instance for this model;
+            # RAG_CLI_BACKEND=stub swaps in a model-free worker for testing
+            self.workers = get_worker_pool(model_name)
         else:
             raise ValueError("Unsupported model type. Choose 'ollama' or 'gemini'.")
 
     def generate_text(self, prompt, max_length=100):
         if self.model_type == "ollama":
-            # Encode the prompt with padding
-            inputs = self.tokenizer(prompt, return_tensors="pt", padding=True)
-
-            # Generate text with the specified max_length
-            outputs = self.model.generate(
-                inputs.input_ids,
-                attention_mask=inputs.attention_mask,
-                max_length=max_length,
-                pad_token_id=self.tokenizer.pad_token_id
-            )
-
-            # Decode and return the generated text, skipping special tokens
-            generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            return generated_text
+            # max_length counts the prompt, as with model.generate; the engine
+            # returns only the continuation, which is appended to the prompt
+            prompt_tokens = len(self.tokenizer.encode(prompt))
+            return prompt + self.engine.generate(prompt, max_new_tokens=max(1, max_length - prompt_tokens))
         elif self.model_type == "gemini":
-            # Call the Gemini model using subprocess or appropriate API
-            command = f"ollama run {self.model_name} '{prompt}' --max-length {max_length}"
-            result = subprocess.run(command, shell=True, capture_output=True, text=True)
-            return result.stdout.strip()
+            # One framed request to a warm worker; the prompt never touches a shell
+            return self.workers.generate(prompt, max_length=max_length).strip()
         else:
             raise ValueError("Unsupported model type. Choose 'ollama' or 'gemini'.")
\ No newline at end of file
@@ -1,13 +1,32 @@
 import grpc
 import raft.service_pb2 as service_pb2
 import raft.service_pb2_grpc as service_pb2_grpc
+from raft.raft_storage import RaftStorage
+import json
+import os
 import random
+import shutil
+import tempfile
 import time
 from concurrent import futures
-from threading import Lock, Thread
+from threading import Condition, Event, Lock, Thread
+
+HEARTBEAT_INTERVAL = 0.3
+MAX_ENTRIES_PER_APPEND = 64
+# Index updates carry embeddings (~350 KB each), so batches are capped by size
+MAX_APPEND_BYTES = 2 * 2**20
+# Above the largest single entry; gRPC's default limit is 4 MB
+MAX_MESSAGE_BYTES = 64 * 2**20
+SNAPSHOT_CHUNK_BYTES = 4 * 2**20
+SNAPSHOT_TIMEOUT = 600.0
+SNAPSHOT_RETRY_INTERVAL = 5.0
+GRPC_OPTIONS = [
+    ('grpc.max_send_message_length', MAX_MESSAGE_BYTES),
+    ('grpc.max_receive_message_length', MAX_MESSAGE_BYTES),
+]
 
 class RaftNode(service_pb2_grpc.RaftServicer):
-    def __init__(self, node_id, peers):
+    def __init__(self, node_id, peers, state_dir=None):
         self.node_id = node_id
         self.peers = peers  # List of other Raft nodes
         self.current_term = 0
@@ -18,17 +37,176 @@ class RaftNode(service_pb2_grpc.RaftServicer):
         self.leader_id = None
         self.election_timeout = random.uniform(1, 3)
         self.reset_election_timer()
+        # Entries up to snapshot_index were compacted away once the state
+        # machine persisted them; log[i - snapshot_index - 1] holds the entry
+        # at index i, as {"term": int, "command": str}
         self.log = []
+        self.snapshot_index = 0
+        self.snapshot_term = 0
         self.commit_index = 0
         self.last_applied = 0
+        # Term, vote and log survive restarts when a state directory is given
+        self.storage = RaftStorage(state_dir) if state_dir else None
+        if self.storage is not None:
+            self.current_term, self.voted_for, self.log = self.storage.load()
+            self.snapshot_index, self.snapshot_term = self.storage.snapshot_index, self.storage.snapshot_term
+            self.commit_index = self.last_applied = self.snapshot_index
+            print(f"Node {node_id} restored term {self.current_term} and {len(self.log)} log entries "
+                  f"after index {self.snapshot_index}")
+
+        # Leader-only replication state, reset on every election win
+        self.next_index = {}
+        self.match_index = {}
+        self._replicate_now = Event()
+        self._stubs = {}
+
+        # Committed entries are handed to these callbacks in log order
+        self._apply_callbacks = []
+        self._apply_cond = Condition(self.lock)
+        # Held while entries are applied or a snapshot is installed
+        self._apply_mutex = Lock()
+        # (export, install) from the state machine; see register_snapshot_handlers()
+        self._snapshot_handlers = None
+        self._sending_snapshot = set()
+        # Nothing is applied until the state machine says where it stands; see start_applying()
+        self._applying = False
+        # Set when an entry fails to apply; the node then stops applying and stays a follower
+        self.apply_error = None
+        self._pending = {}  # log index -> (term, Future) for local proposals
+        self._proposed_at = {}  # log index -> perf_counter() at proposal, for commit latency
+
+        # Observability: on_timing(stage, seconds) is called for "raft_commit"
+        # (proposal to majority commit) and "raft_apply" (apply callbacks)
+        self.on_timing = None
+        self.term_changes = 0
+        self.elections_started = 0
+        Thread(target=self._apply_loop, daemon=True).start()
 
     def is_leader(self):
         return self.state == "leader"
 
+    def register_apply_callback(self, callback):
+        """Register callback(index, command) to run for every committed entry."""
+        self._apply_callbacks.append(callback)
+
+    def register_snapshot_handlers(self, export, install):
+        """Let the log be compacted; see compact_log().
+
+        export(directory) writes the state machine into an empty directory
+        and returns the log index it reflects. install(directory, index)
+        replaces the state machine with such a copy. Followers that need
+        compacted entries are sent an exported copy instead.
+        """
+        self._snapshot_handlers = (export, install)
+
+    def compact_log(self, applied_index):
+        """Drop the entries up to applied_index, which the state machine has persisted."""
+        with self.lock:
+            upto = min(applied_index, self.last_applied)
+            if self._snapshot_handlers is None or upto <= self.snapshot_index:
+                return
+            self.snapshot_term = self._term_at(upto)
+            del self.log[:upto - self.snapshot_index]
+            self.snapshot_index = upto
+            if self.storage is not None:
+                self.storage.compact(self.snapshot_index, self.snapshot_term, self.log)
+
+    def _last_index(self):
+        """Caller must hold the lock."""
+        return self.snapshot_index + len(self.log)
+
+    def _term_at(self, index):
+        """Term of the entry at index, or None if it was compacted; caller must hold the lock."""
+        if index == self.snapshot_index:
+            return self.snapshot_term
+        if index < self.snapshot_index:
+            return None
+        return self.log[index - self.snapshot_index - 1]["term"]
+
+    def _entry(self, index):
+        return self.log[index - self.snapshot_index - 1]
+
+    def start_applying(self, applied_index=0):
+        """Begin applying committed entries after applied_index.
+
+        applied_index is the last entry the state machine already reflects,
+        e.g. from its persisted snapshot; those entries are not applied
+        again. Returns False, and starts nothing, if applied_index is past
+        the end of the log (the state machine is ahead of a log that was
+        lost) or inside its compacted prefix; either way the state machine
+        must be rebuilt from 0. From 0, a compacted log is discarded, and the
+        leader sends a snapshot as it would to a new node.
+        """
+        with self.lock:
+            if applied_index > self._last_index() or 0 < applied_index < self.snapshot_index:
+                return False
+            if applied_index < self.snapshot_index:
+                print(f"Node {self.node_id} has no state for its compacted log; waiting for a snapshot from the leader")
+                self.log, self.snapshot_index, self.snapshot_term = [], 0, 0
+                self.commit_index = self.last_applied = 0
+                if self.storage is not None:
+                    self.storage.compact(0, 0, self.log)
+            self.last_applied = max(self.last_applied, applied_index)
+            # Anything the state machine applied was committed
+            self.commit_index = max(self.commit_index, applied_index)
+            self._applying = True
+            self._apply_cond.notify_all()
+            return True
+
+    def propose(self, command):
+        """Append a command to the leader's log and return a Future for its apply result.
+
+        The Future resolves once the entry is committed by a majority and applied
+        locally, or fails if leadership is lost before that happens.
+        """
+        if not isinstance(command, str):
+            command = json.dumps(command)
+        future = futures.Future()
+        with self.lock:
+            if self.state != "leader":
+                raise Exception("Not the leader")
+            self.log.append({"term": self.current_term, "command": command})
+            self._persist_entries(self.log[-1:])
+            index = self._last_index()
+            self._pending[index] = (self.current_term, future)
+            self._proposed_at[index] = time.perf_counter()
+            if not self.peers:
+                self._advance_commit_index()
+        self._replicate_now.set()
+        return future
+
+    def apply_log(self, command, wait=True, timeout=10.0):
+        """Propose a command and optionally block until it has been applied."""
+        future = self.propose(command)
+        return future.result(timeout=timeout) if wait else future
+
     def reset_election_timer(self):
         """Restart the election timeout"""
         self.election_deadline = time.time() + self.election_timeout
 
+    def _last_log_index_and_term(self):
+        last_index = self._last_index()
+        return last_index, self._term_at(last_index)
+
+    def _become_follower(self, term):
+        """Step down; caller must hold the lock"""
+        was_leader = self.state == "leader"
+        if term > self.current_term:
+            self.current_term = term
+            self.term_changes += 1
+            self.voted_for = None
+            self._persist_state()
+        self.state = "follower"
+        if was_leader:
+            self._fail_pending("Leadership lost before entry was committed")
+
+    def _get_stub(self, peer):
+        stub = self._stubs.get(peer)
+        if stub is None:
+            stub = service_pb2_grpc.RaftStub(grpc.insecure_channel(peer, options=GRPC_OPTIONS))
+            self._stubs[peer] = stub
+        return stub
+
     def start_election(self):
         """Trigger an election when timeout occurs"""
         with self.lock:
@@ -37,56 +215,345 @@ class RaftNode(service_pb2_grpc.RaftServicer):
 
             self.state = "candidate"
             self.current_term += 1
+            self.term_changes += 1
+            self.elections_started += 1
             self.voted_for = self.node_id
+            self._persist_state()
             self.votes_received = 1  # Vote for self
+            term = self.current_term
+            last_index, last_term = self._last_log_index_and_term()
 
             print(f"Node {self.node_id} is starting an election for term {self.current_term}")
 
+            if not self.peers:
+                self.become_leader()
+                return
+
         threads = []
         for peer in self.peers:
-            t = Thread(target=self.request_vote_from_peer, args=(peer,))
+            t = Thread(target=self.request_vote_from_peer, args=(peer, term, last_index, last_term))
             t.start()
             threads.append(t)
 
         for t in threads:
             t.join()
 
-    def request_vote_from_peer(self, peer):
+    def request_vote_from_peer(self, peer, term, last_index, last_term):
         """Send a vote request to another peer"""
         try:
-            with grpc.insecure_channel(peer) as channel:
-                stub = service_pb2_grpc.RaftStub(channel)
-                request = service_pb2.RequestVoteArgs(
-                    term=self.current_term, candidateId=self.node_id, lastLogIndex=0, lastLogTerm=0
-                )
-                response = stub.RequestVote(request)
+            stub = self._get_stub(peer)
+            request = service_pb2.RequestVoteArgs(
+                term=term, candidateId=self.node_id, lastLogIndex=last_index, lastLogTerm=last_term
+            )
+            response = stub.RequestVote(request, timeout=1.0)
 
-                with self.lock:
-                    if response.voteGranted:
-                        self.votes_received += 1
-                        if self.votes_received > (len(self.peers) + 1) // 2:
-                            self.become_leader()
+            with self.lock:
+                if response.term > self.current_term:
+                    self._become_follower(response.term)
+                    return
+                # Ignore replies to an election we are no longer running
+                if self.state != "candidate" or self.current_term != term:
+                    return
+                if response.voteGranted:
+                    self.votes_received += 1
+                    if self.votes_received > (len(self.peers) + 1) // 2:
+                        self.become_leader()
         except Exception as e:
             print(f"Error contacting peer {peer}: {e}")
 
     def become_leader(self):
-        """Convert to leader if election is won"""
+        """Convert to leader if election is won; caller must hold the lock"""
         self.state = "leader"
         self.leader_id = self.node_id
+        last_index, _ = self._last_log_index_and_term()
+        self.next_index = {peer: last_index + 1 for peer in self.peers}
+        self.match_index = {peer: 0 for peer in self.peers}
         print(f"Node {self.node_id} is now the LEADER for term {self.current_term}")
+        Thread(target=self._leader_loop, args=(self.current_term,), daemon=True).start()
+
+    def _leader_loop(self, term):
+        """Send heartbeats and replicate new entries while leader for this term"""
+        while True:
+            with self.lock:
+                if self.state != "leader" or self.current_term != term:
+                    return
+            threads = [Thread(target=self._replicate_to_peer, args=(peer, term)) for peer in self.peers]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self._replicate_now.wait(HEARTBEAT_INTERVAL)
+            self._replicate_now.clear()
+
+    def _replicate_to_peer(self, peer, term):
+        """Send one AppendEntries round to a peer, catching it up in batches"""
+        while True:
+            with self.lock:
+                if self.state != "leader" or self.current_term != term:
+                    return
+                next_index = self.next_index[peer]
+                snapshot_needed = next_index <= self.snapshot_index
+                if snapshot_needed:
+                    # The entries it needs are compacted away; send the state
+                    # machine instead, and meanwhile only an empty append at
+                    # the snapshot, which keeps the follower from an election
+                    if peer not in self._sending_snapshot:
+                        self._sending_snapshot.add(peer)
+                        Thread(target=self._send_snapshot, args=(peer, term), daemon=True).start()
+                    next_index = self.snapshot_index + 1
+                prev_index = next_index - 1
+                prev_term = self._term_at(prev_index)
+                start = prev_index - self.snapshot_index
+                end = start if snapshot_needed else start + MAX_ENTRIES_PER_APPEND
+                batch, batch_bytes = [], 0
+                for entry in self.log[start:end]:
+                    # Always send at least one entry, however large
+                    if batch and batch_bytes + len(entry["command"]) > MAX_APPEND_BYTES:
+                        break
+                    batch.append(entry)
+                    batch_bytes += len(entry["command"])
+                request = service_pb2.AppendEntriesArgs(
+                    term=term,
+                    leaderId=self.node_id,
+                    prevLogIndex=prev_index,
+                    prevLogTerm=prev_term,
+                    leaderCommit=self.commit_index,
+                    entries=[service_pb2.LogEntry(term=e["term"], command=e["command"]) for e in batch],
+                )
+
+            try:
+                response = self._get_stub(peer).AppendEntries(request, timeout=2.0)
+            except Exception as e:
+                print(f"Error replicating to peer {peer}: {e}")
+                return
+
+            with self.lock:
+                if response.term > self.current_term:
+                    self._become_follower(response.term)
+                    return
+                if self.state != "leader" or self.current_term != term:
+                    return
+                if response.success:
+                    self.match_index[peer] = max(self.match_index[peer], prev_index + len(batch))
+                    self.next_index[peer] = self.match_index[peer] + 1
+                    self._advance_commit_index()
+                    caught_up = self.next_index[peer] > self._last_index()
+                elif snapshot_needed:
+                    caught_up = True
+                else:
+                    # Jump straight back to the follower's log end instead of one entry at a time
+                    self.next_index[peer] = max(1, min(next_index - 1, response.lastLogIndex + 1))
+                    caught_up = False
+            if caught_up:
+                return
+
+    def _advance_commit_index(self):
+        """Commit the highest index replicated on a majority; caller must hold the lock"""
+        for index in range(self._last_index(), self.commit_index, -1):
+            if self._term_at(index) != self.current_term:
+                break
+            replicas = 1 + sum(1 for m in self.match_index.values() if m >= index)
+            if replicas > (len(self.peers) + 1) // 2:
+                now = time.perf_counter()
+                for committed in range(self.commit_index + 1, index + 1):
+                    proposed_at = self._proposed_at.pop(committed, None)
+                    if proposed_at is not None:
+                        self._observe("raft_commit", now - proposed_at)
+                self.commit_index = index
+                self._apply_cond.notify_all()
+                break
+
+    def _apply_loop(self):
+        """Apply committed entries in order on every node"""
+        while True:
+            with self.lock:
+                while not self._applying or self.last_applied >= self.commit_index:
+                    self._apply_cond.wait()
+            with self._apply_mutex:
+                with self.lock:
+                    # An installed snapshot may have moved last_applied meanwhile
+                    if not self._applying or self.last_applied >= self.commit_index:
+                        continue
+                    self.last_applied += 1
+                    index = self.last_applied
+                    entry = self._entry(index)
+                    pending = self._pending.pop(index, None)
+
+                result = None
+                start = time.perf_counter()
+                try:
+                    for callback in self._apply_callbacks:
+                        value = callback(index, json.loads(entry["command"]))
+                        if value is not None:
+                            result = value
+                except Exception as e:
+                    self._halt_applying(index, e, pending)
+                    continue
+                self._observe("raft_apply", time.perf_counter() - start)
+
+            if pending:
+                term, future = pending
+                if term != entry["term"]:
+                    future.set_exception(Exception("Entry was overwritten by a new leader"))
+                else:
+                    future.set_result(result)
+
+    def _halt_applying(self, index, error, pending):
+        """Stop applying after entry index failed.
+
+        Skipping the entry would leave this node's state machine different
+        from every other replica's. The node stops applying, steps down and
+        does not stand for election again, so it never serves that state as
+        leader; it keeps replicating the log, and a restart retries the entry.
+        """
+        print(f"Error applying log entry {index}, halting apply on node {self.node_id}: {error}")
+        with self.lock:
+            self.apply_error = f"Log entry {index} failed to apply: {error}"
+            self._applying = False
+            self.last_applied = index - 1
+            if self.state == "leader":
+                self._become_follower(self.current_term)
+        if pending:
+            pending[1].set_exception(error)
+
+    def _send_snapshot(self, peer, term):
+        """Stream an exported copy of the state machine to peer, then resume AppendEntries after it."""
+        directory = tempfile.mkdtemp(prefix=f"raft-snapshot-{self.node_id}-")
+        try:
+            index = self._snapshot_handlers[0](directory)
+            with self.lock:
+                last_term = self._term_at(index)
+            if last_term is None:
+                # Compacted past the export meanwhile; the next round exports again
+                return
+            print(f"Node {self.node_id} sending snapshot at index {index} to {peer}")
+
+            def chunks():
+                for name in sorted(os.listdir(directory)):
+                    with open(os.path.join(directory, name), 'rb') as f:
+                        while True:
+                            data = f.read(SNAPSHOT_CHUNK_BYTES)
+                            yield service_pb2.SnapshotChunk(term=term, leaderId=self.node_id, lastIncludedIndex=index,
+                                                            lastIncludedTerm=last_term, name=name, data=data)
+                            if len(data) < SNAPSHOT_CHUNK_BYTES:
+                                break
+
+            response = self._get_stub(peer).InstallSnapshot(chunks(), timeout=SNAPSHOT_TIMEOUT)
+            with self.lock:
+                if response.term > self.current_term:
+                    self._become_follower(response.term)
+                elif response.success and self.state == "leader" and self.current_term == term:
+                    self.match_index[peer] = max(self.match_index[peer], index)
+                    self.next_index[peer] = self.match_index[peer] + 1
+                    self._advance_commit_index()
+        except Exception as e:
+            print(f"Error sending snapshot to peer {peer}: {e}")
+            # Each attempt exports the whole state machine; don't retry every heartbeat
+            time.sleep(SNAPSHOT_RETRY_INTERVAL)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+            with self.lock:
+                self._sending_snapshot.discard(peer)
+        self._replicate_now.set()
+
+    def InstallSnapshot(self, request_iterator, context):
+        """Replace this node's state machine and log prefix with the leader's snapshot"""
+        directory = None
+        try:
+            header, files = None, {}
+            for chunk in request_iterator:
+                if header is None:
+                    header = chunk
+                    with self.lock:
+                        if chunk.term < self.current_term:
+                            return service_pb2.InstallSnapshotReply(term=self.current_term, success=False)
+                        if chunk.term > self.current_term or self.state != "follower":
+                            self._become_follower(chunk.term)
+                        self.leader_id = chunk.leaderId
+                    directory = tempfile.mkdtemp(prefix=f"raft-install-{self.node_id}-")
+                # Transfers can outlast the election timeout
+                self.reset_election_timer()
+                name = os.path.basename(chunk.name)
+                if name not in files:
+                    files[name] = open(os.path.join(directory, name), 'wb')
+                files[name].write(chunk.data)
+            for f in files.values():
+                f.close()
+            if header is None or self._snapshot_handlers is None:
+                return service_pb2.InstallSnapshotReply(term=self.current_term, success=False)
+            index, last_term = header.lastIncludedIndex, header.lastIncludedTerm
+
+            with self._apply_mutex:
+                with self.lock:
+                    if index <= self.last_applied:
+                        return service_pb2.InstallSnapshotReply(term=self.current_term, success=True)
+                self._snapshot_handlers[1](directory, index)
+                with self.lock:
+                    if self.snapshot_index <= index <= self._last_index() and self._term_at(index) == last_term:
+                        # Keep the entries that follow the snapshot
+                        del self.log[:index - self.snapshot_index]
+                    else:
+                        self.log = []
+                    self.snapshot_index, self.snapshot_term = index, last_term
+                    self.commit_index = max(self.commit_index, index)
+                    self.last_applied = index
+                    for pending_index in [i for i in self._pending if i <= index]:
+                        # Committed and reflected in the installed state
+                        self._pending.pop(pending_index)[1].set_result(None)
+                    if self.storage is not None:
+                        self.storage.compact(self.snapshot_index, self.snapshot_term, self.log)
+                    self._apply_cond.notify_all()
+            print(f"Node {self.node_id} installed snapshot at index {index} from leader {header.leaderId}")
+            return service_pb2.InstallSnapshotReply(term=self.current_term, success=True)
+        finally:
+            if directory is not None:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def _fail_pending(self, reason):
+        """Fail uncommitted local proposals; caller must hold the lock"""
+        for index in [i for i in self._pending if i > self.commit_index]:
+            _, future = self._pending.pop(index)
+            self._proposed_at.pop(index, None)
+            future.set_exception(Exception(reason))
+
+    def _persist_state(self):
+        """Caller must hold the lock."""
+        if self.storage is not None:
+            self.storage.save_state(self.current_term, self.voted_for)
+
+    def _persist_entries(self, entries):
+        """Caller must hold the lock."""
+        if self.storage is not None:
+            self.storage.append(entries)
+
+    def _observe(self, stage, seconds):
+        if self.on_timing is not None:
+            try:
+                self.on_timing(stage, seconds)
+            except Exception as e:
+                print(f"Error recording {stage} timing: {e}")
 
     def RequestVote(self, request, context):
         """Handles incoming vote requests"""
         response = service_pb2.RequestVoteReply(term=self.current_term, voteGranted=False)
 
         with self.lock:
+            if request.term < self.current_term:
+                response.term = self.current_term
+                return response
+
             if request.term > self.current_term:
-                self.current_term = request.term
-                self.voted_for = None
-                self.state = "follower"
+                self._become_follower(request.term)
+
+            # Only vote for candidates whose log is at least as up to date as ours
+            last_index, last_term = self._last_log_index_and_term()
+            log_ok = (request.lastLogTerm > last_term or
+                      (request.lastLogTerm == last_term and request.lastLogIndex >= last_index))
 
-            if self.voted_for is None or self.voted_for == request.candidateId:
+            if log_ok and (self.voted_for is None or self.voted_for == request.candidateId):
                 self.voted_for = request.candidateId
+                self._persist_state()
+                self.reset_election_timer()
                 response.voteGranted = True
                 print(f"Node {self.node_id} voted for {request.candidateId} in term {request.term}")
 
@@ -94,36 +561,80 @@ class RaftNode(service_pb2_grpc.RaftServicer):
         return response
 
     def AppendEntries(self, request, context):
-        """Handles AppendEntries (heartbeat from leader)"""
+        """Handles AppendEntries (heartbeat and log replication from leader)"""
         response = service_pb2.AppendEntriesReply(term=self.current_term, success=False)
 
         with self.lock:
             if request.term < self.current_term:
+                response.lastLogIndex = self._last_index()
                 return response
 
-            self.current_term = request.term
+            if request.term > self.current_term or self.state != "follower":
+                self._become_follower(request.term)
             self.leader_id = request.leaderId
-            self.state = "follower"
             self.reset_election_timer()
+            response.term = self.current_term
+
+            # Reject unless our log contains the leader's previous entry; the
+            # compacted prefix was committed, so it always matches
+            last_index = self._last_index()
+            if request.prevLogIndex > last_index or (
+                    request.prevLogIndex > self.snapshot_index and
+                    self._term_at(request.prevLogIndex) != request.prevLogTerm):
+                response.lastLogIndex = min(last_index, request.prevLogIndex - 1)
+                return response
+
+            index = request.prevLogIndex
+            first_new, truncated = None, False
+            for entry in request.entries:
+                index += 1
+                if index <= self.snapshot_index:
+                    continue
+                if index <= self._last_index():
+                    if self._term_at(index) == entry.term:
+                        continue
+                    # Conflicting suffix from an old term; drop it
+                    del self.log[index - self.snapshot_index - 1:]
+                    truncated = True
+                self.log.append({"term": entry.term, "command": entry.command})
+                first_new = first_new or index
+            # Durable before the leader counts this node towards a majority
+            if truncated and self.storage is not None:
+                self.storage.rewrite(self.log)
+            elif first_new is not None:
+                self._persist_entries(self.log[first_new - self.snapshot_index - 1:])
+
+            if request.leaderCommit > self.commit_index:
+                self.commit_index = min(request.leaderCommit, index)
+                self._apply_cond.notify_all()
+
             response.success = True
+            response.lastLogIndex = self._last_index()
 
-        print(f"Node {self.node_id} received heartbeat from leader {request.leaderId}")
+        if request.entries:
+            print(f"Node {self.node_id} appended {len(request.entries)} entries from leader {request.leaderId}")
         return response
 
     def election_timer(self):
         """Runs a loop to check for election timeouts"""
         while True:
-            time.sleep(1)
-            if self.state != "leader" and time.time() > self.election_deadline:
-                self.start_election()
+            time.sleep(0.1)
+            if self.state != "leader" and self.apply_error is None and time.time() > self.election_deadline:
+                self.election_timeout = random.uniform(1, 3)
                 self.reset_election_timer()
+                self.start_election()
+
+def start_server(node_id, port, peers, raft_node, services=()):
+    """Start a Raft node server
 
-def start_server(node_id, port, peers, raft_node):
-    """Start a Raft node server"""
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    services are extra callables, each registering a servicer on the server.
+    """
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), options=GRPC_OPTIONS)
     #raft_node = RaftNode(node_id, peers)
     print(f'Attempting to create raft server on port {port}')
     service_pb2_grpc.add_RaftServicer_to_server(raft_node, server)
+    for register in services:
+        register(server)
     server.add_insecure_port(f"[::]:{port}")
 
     # Start election timer in a separate thread
@@ -0,0 +1,85 @@
+import json
+import os
+
+
+class RaftStorage:
+    """Durable Raft state: current term, vote and log, kept in one directory.
+
+    The term and vote are rewritten atomically whenever they change. The
+    log is an append-only JSON-lines file that is fsynced before the node
+    acknowledges anything. It is only rewritten when a conflicting suffix
+    is dropped, or when compaction drops the prefix the state machine has
+    persisted. A compacted log starts with a header line giving the index
+    and term of the last entry dropped. A torn last line from a crash is
+    ignored on load.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._state_path = os.path.join(directory, 'state.json')
+        self._log_path = os.path.join(directory, 'log.jsonl')
+        self._log_file = None
+        # Index and term of the last entry compacted out of the log
+        self.snapshot_index = 0
+        self.snapshot_term = 0
+
+    def load(self):
+        """Return (term, voted_for, log) as last persisted; log follows snapshot_index."""
+        term, voted_for = 0, None
+        if os.path.exists(self._state_path):
+            with open(self._state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            term, voted_for = state.get('term', 0), state.get('voted_for')
+        log = []
+        if os.path.exists(self._log_path):
+            with open(self._log_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        print(f"Ignoring torn entry at the end of {self._log_path}")
+                        break
+                    if 'snapshot_index' in entry:
+                        self.snapshot_index, self.snapshot_term = entry['snapshot_index'], entry['snapshot_term']
+                        continue
+                    log.append({"term": entry["term"], "command": entry["command"]})
+            # Drop a torn tail so later appends start on a clean line
+            self.rewrite(log)
+        return term, voted_for, log
+
+    def save_state(self, term, voted_for):
+        tmp_path = self._state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'term': term, 'voted_for': voted_for}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._state_path)
+
+    def append(self, entries):
+        if not entries:
+            return
+        if self._log_file is None:
+            self._log_file = open(self._log_path, 'a', encoding='utf-8')
+        self._log_file.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+        self._log_file.flush()
+        os.fsync(self._log_file.fileno())
+
+    def compact(self, snapshot_index, snapshot_term, log):
+        """Replace the log with the entries after snapshot_index."""
+        self.snapshot_index, self.snapshot_term = snapshot_index, snapshot_term
+        self.rewrite(log)
+
+    def rewrite(self, log):
+        """Replace the whole log, after a conflicting suffix was dropped."""
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+        tmp_path = self._log_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            if self.snapshot_index:
+                f.write(json.dumps({'snapshot_index': self.snapshot_index, 'snapshot_term': self.snapshot_term}) + '\n')
+            f.write(''.join(json.dumps(entry) + '\n' for entry in log))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._log_path)
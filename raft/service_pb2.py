@@ -24,7 +24,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x12raft/service.proto\x12\x04raft\"_\n\x0fRequestVoteArgs\x12\x0c\n\x04term\x18\x01 \x01(\x05\x12\x13\n\x0b\x63\x61ndidateId\x18\x02 \x01(\x05\x12\x14\n\x0clastLogIndex\x18\x03 \x01(\x05\x12\x13\n\x0blastLogTerm\x18\x04 \x01(\x05\"5\n\x10RequestVoteReply\x12\x0c\n\x04term\x18\x01 \x01(\x05\x12\x13\n\x0bvoteGranted\x18\x02 \x01(\x08\"D\n\x11\x41ppendEntriesArgs\x12\x0c\n\x04term\x18\x01 \x01(\x05\x12\x10\n\x08leaderId\x18\x02 \x01(\x05\x12\x0f\n\x07\x65ntries\x18\x03 \x03(\t\"3\n\x12\x41ppendEntriesReply\x12\x0c\n\x04term\x18\x01 \x01(\x05\x12\x0f\n\x07success\x18\x02 \x01(\x08\"4\n\x0fResponseMessage\x12\x10\n\x08senderId\x18\x01 \x01(\x05\x12\x0f\n\x07message\x18\x02 \x01(\t\"\x1e\n\x0bResponseAck\x12\x0f\n\x07success\x18\x01 \x01(\x08\x32\xc2\x01\n\x04Raft\x12<\n\x0bRequestVote\x12\x15.raft.RequestVoteArgs\x1a\x16.raft.RequestVoteReply\x12\x42\n\rAppendEntries\x12\x17.raft.AppendEntriesArgs\x1a\x18.raft.AppendEntriesReply\x12\x38\n\x0cSendResponse\x12\x15.raft.ResponseMessage\x1a\x11.raft.ResponseAckb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x12raft/service.proto\x12\x04raft\"_\n\x0fRequestVoteArgs\x12\x0c\n\x04term\x18\x01 \x01(\x05\x12\x13\n\x0b\x63\x61ndidateId\x18\x02 \x01(\x05\x12\x14\n\x0clastLogIndex\x18\x03 \x01(\x05\x12\x13\n\x0blastLogTerm\x18\x04 \x01(\x05\"5\n\x10RequestVoteReply\x12\x0c\n\x04term\x18\x01 \x01(\x05\x12\x13\n\x0bvoteGranted\x18\x02 \x01(\x08\")\n\x08LogEntry\x12\x0c\n\x04term\x18\x01 \x01(\x05\x12\x0f\n\x07\x63ommand\x18\x02 \x01(\t\"\x95\x01\n\x11\x41ppendEntriesArgs\x12\x0c\n\x04term\x18\x01 \x01(\x05\x12\x10\n\x08leaderId\x18\x02 \x01(\x05\x12\x1f\n\x07\x65ntries\x18\x03 \x03(\x0b\x32\x0e.raft.LogEntry\x12\x14\n\x0cprevLogIndex\x18\x04 \x01(\x05\x12\x13\n\x0bprevLogTerm\x18\x05 \x01(\x05\x12\x14\n\x0cleaderCommit\x18\x06 \x01(\x05\"I\n\x12\x41ppendEntriesReply\x12\x0c\n\x04term\x18\x01 \x01(\x05\x12\x0f\n\x07success\x18\x02 \x01(\x08\x12\x14\n\x0clastLogIndex\x18\x03 \x01(\x05\"\x80\x01\n\rSnapshotChunk\x12\x0c\n\x04term\x18\x01 \x01(\x05\x12\x10\n\x08leaderId\x18\x02 \x01(\x05\x12\x19\n\x11lastIncludedIndex\x18\x03 \x01(\x05\x12\x18\n\x10lastIncludedTerm\x18\x04 \x01(\x05\x12\x0c\n\x04name\x18\x05 \x01(\t\x12\x0c\n\x04\x64\x61ta\x18\x06 \x01(\x0c\"5\n\x14InstallSnapshotReply\x12\x0c\n\x04term\x18\x01 \x01(\x05\x12\x0f\n\x07success\x18\x02 \x01(\x08\"4\n\x0fResponseMessage\x12\x10\n\x08senderId\x18\x01 \x01(\x05\x12\x0f\n\x07message\x18\x02 \x01(\t\"\x1e\n\x0bResponseAck\x12\x0f\n\x07success\x18\x01 \x01(\x08\"=\n\x0cQueryRequest\x12\r\n\x05query\x18\x01 \x01(\t\x12\x0f\n\x07\x66ilters\x18\x02 \x01(\t\x12\r\n\x05route\x18\x03 \x01(\t\"!\n\rQueryResponse\x12\x10\n\x08response\x18\x01 \x01(\t\"8\n\x11QueryBatchRequest\x12#\n\x07queries\x18\x01 \x03(\x0b\x32\x12.raft.QueryRequest\"3\n\x10QueryBatchResult\x12\r\n\x05index\x18\x01 \x01(\x05\x12\x10\n\x08response\x18\x02 \x01(\t2\x88\x02\n\x04Raft\x12<\n\x0bRequestVote\x12\x15.raft.RequestVoteArgs\x1a\x16.raft.RequestVoteReply\x12\x42\n\rAppendEntries\x12\x17.raft.AppendEntriesArgs\x1a\x18.raft.AppendEntriesReply\x12\x38\n\x0cSendResponse\x12\x15.raft.ResponseMessage\x1a\x11.raft.ResponseAck\x12\x44\n\x0fInstallSnapshot\x12\x13.raft.SnapshotChunk\x1a\x1a.raft.InstallSnapshotReply(\x01\x32\x81\x01\n\x0cQueryService\x12\x30\n\x05Query\x12\x12.raft.QueryRequest\x1a\x13.raft.QueryResponse\x12?\n\nQueryBatch\x12\x17.raft.QueryBatchRequest\x1a\x16.raft.QueryBatchResult0\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
@@ -35,14 +35,30 @@ if not _descriptor._USE_C_DESCRIPTORS:
   _globals['_REQUESTVOTEARGS']._serialized_end=123
   _globals['_REQUESTVOTEREPLY']._serialized_start=125
   _globals['_REQUESTVOTEREPLY']._serialized_end=178
-  _globals['_APPENDENTRIESARGS']._serialized_start=180
-  _globals['_APPENDENTRIESARGS']._serialized_end=248
-  _globals['_APPENDENTRIESREPLY']._serialized_start=250
-  _globals['_APPENDENTRIESREPLY']._serialized_end=301
-  _globals['_RESPONSEMESSAGE']._serialized_start=303
-  _globals['_RESPONSEMESSAGE']._serialized_end=355
-  _globals['_RESPONSEACK']._serialized_start=357
-  _globals['_RESPONSEACK']._serialized_end=387
-  _globals['_RAFT']._serialized_start=390
-  _globals['_RAFT']._serialized_end=584
+  _globals['_LOGENTRY']._serialized_start=180
+  _globals['_LOGENTRY']._serialized_end=221
+  _globals['_APPENDENTRIESARGS']._serialized_start=224
+  _globals['_APPENDENTRIESARGS']._serialized_end=373
+  _globals['_APPENDENTRIESREPLY']._serialized_start=375
+  _globals['_APPENDENTRIESREPLY']._serialized_end=448
+  _globals['_SNAPSHOTCHUNK']._serialized_start=451
+  _globals['_SNAPSHOTCHUNK']._serialized_end=579
+  _globals['_INSTALLSNAPSHOTREPLY']._serialized_start=581
+  _globals['_INSTALLSNAPSHOTREPLY']._serialized_end=634
+  _globals['_RESPONSEMESSAGE']._serialized_start=636
+  _globals['_RESPONSEMESSAGE']._serialized_end=688
+  _globals['_RESPONSEACK']._serialized_start=690
+  _globals['_RESPONSEACK']._serialized_end=720
+  _globals['_QUERYREQUEST']._serialized_start=722
+  _globals['_QUERYREQUEST']._serialized_end=783
+  _globals['_QUERYRESPONSE']._serialized_start=785
+  _globals['_QUERYRESPONSE']._serialized_end=818
+  _globals['_QUERYBATCHREQUEST']._serialized_start=820
+  _globals['_QUERYBATCHREQUEST']._serialized_end=876
+  _globals['_QUERYBATCHRESULT']._serialized_start=878
+  _globals['_QUERYBATCHRESULT']._serialized_end=929
+  _globals['_RAFT']._serialized_start=932
+  _globals['_RAFT']._serialized_end=1196
+  _globals['_QUERYSERVICE']._serialized_start=1199
+  _globals['_QUERYSERVICE']._serialized_end=1328
 # @@protoc_insertion_point(module_scope)
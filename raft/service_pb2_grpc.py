@@ -49,6 +49,11 @@ class RaftStub(object):
                 request_serializer=raft_dot_service__pb2.ResponseMessage.SerializeToString,
                 response_deserializer=raft_dot_service__pb2.ResponseAck.FromString,
                 _registered_method=True)
+        self.InstallSnapshot = channel.stream_unary(
+                '/raft.Raft/InstallSnapshot',
+                request_serializer=raft_dot_service__pb2.SnapshotChunk.SerializeToString,
+                response_deserializer=raft_dot_service__pb2.InstallSnapshotReply.FromString,
+                _registered_method=True)
 
 
 class RaftServicer(object):
@@ -72,6 +77,14 @@ class RaftServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def InstallSnapshot(self, request_iterator, context):
+        """Leader sends its state machine snapshot in chunks to a follower whose
+        next entry was already compacted out of the leader's log
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_RaftServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -90,6 +103,11 @@ def add_RaftServicer_to_server(servicer, server):
                     request_deserializer=raft_dot_service__pb2.ResponseMessage.FromString,
                     response_serializer=raft_dot_service__pb2.ResponseAck.SerializeToString,
             ),
+            'InstallSnapshot': grpc.stream_unary_rpc_method_handler(
+                    servicer.InstallSnapshot,
+                    request_deserializer=raft_dot_service__pb2.SnapshotChunk.FromString,
+                    response_serializer=raft_dot_service__pb2.InstallSnapshotReply.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'raft.Raft', rpc_method_handlers)
@@ -181,3 +199,146 @@ class Raft(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def InstallSnapshot(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_unary(
+            request_iterator,
+            target,
+            '/raft.Raft/InstallSnapshot',
+            raft_dot_service__pb2.SnapshotChunk.SerializeToString,
+            raft_dot_service__pb2.InstallSnapshotReply.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+
+class QueryServiceStub(object):
+    """Missing associated documentation comment in .proto file."""
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.Query = channel.unary_unary(
+                '/raft.QueryService/Query',
+                request_serializer=raft_dot_service__pb2.QueryRequest.SerializeToString,
+                response_deserializer=raft_dot_service__pb2.QueryResponse.FromString,
+                _registered_method=True)
+        self.QueryBatch = channel.unary_stream(
+                '/raft.QueryService/QueryBatch',
+                request_serializer=raft_dot_service__pb2.QueryBatchRequest.SerializeToString,
+                response_deserializer=raft_dot_service__pb2.QueryBatchResult.FromString,
+                _registered_method=True)
+
+
+class QueryServiceServicer(object):
+    """Missing associated documentation comment in .proto file."""
+
+    def Query(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def QueryBatch(self, request, context):
+        """Answers stream back in request order
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+
+def add_QueryServiceServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+            'Query': grpc.unary_unary_rpc_method_handler(
+                    servicer.Query,
+                    request_deserializer=raft_dot_service__pb2.QueryRequest.FromString,
+                    response_serializer=raft_dot_service__pb2.QueryResponse.SerializeToString,
+            ),
+            'QueryBatch': grpc.unary_stream_rpc_method_handler(
+                    servicer.QueryBatch,
+                    request_deserializer=raft_dot_service__pb2.QueryBatchRequest.FromString,
+                    response_serializer=raft_dot_service__pb2.QueryBatchResult.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'raft.QueryService', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+    server.add_registered_method_handlers('raft.QueryService', rpc_method_handlers)
+
+
+ # This class is part of an EXPERIMENTAL API.
+class QueryService(object):
+    """Missing associated documentation comment in .proto file."""
+
+    @staticmethod
+    def Query(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/raft.QueryService/Query',
+            raft_dot_service__pb2.QueryRequest.SerializeToString,
+            raft_dot_service__pb2.QueryResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def QueryBatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/raft.QueryService/QueryBatch',
+            raft_dot_service__pb2.QueryBatchRequest.SerializeToString,
+            raft_dot_service__pb2.QueryBatchResult.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
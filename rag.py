@@ -1,23 +1,40 @@
-from sentence_transformers import SentenceTransformer
+import os
+import sys
+
 import faiss
 import numpy as np
 from llm_module import LLM  # Import the LLM class
 
+# Shared helpers live with the pipeline modules in rag/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "rag"))
+from micro_batcher import MicroBatcher
+from model_registry import get_encoder
+
 class RAG:
     def __init__(self, index_path="index.faiss", knowledge_base_path="knowledge_base.txt"):
-        self.embedding_model = SentenceTransformer('all-mpnet-base-v2')
+        self.embedding_model = get_encoder('all-mpnet-base-v2')
         self.index = faiss.read_index(index_path)
         self.knowledge_base = self._load_knowledge_base(knowledge_base_path)
         self.llm = LLM()  # Instantiate the LLM
+        # Concurrent retrieve() calls share one encode and one index.search
+        self._retrieve_batcher = MicroBatcher(self._retrieve_coalesced, max_batch_size=32, max_wait_ms=5.0)
 
     def _load_knowledge_base(self, knowledge_base_path):
         with open(knowledge_base_path, "r") as f:
             return [line.strip() for line in f]
 
     def retrieve(self, query, k=3):
-        query_embedding = self.embedding_model.encode([query], convert_to_tensor=True, show_progress_bar=False).cpu().numpy()
-        _, I = self.index.search(query_embedding, k)
-        return [self.knowledge_base[i] for i in I[0]]
+        return self._retrieve_batcher((query, k))
+
+    def retrieve_batch(self, queries, k=3):
+        query_embeddings = self.embedding_model.encode(queries, convert_to_numpy=True, show_progress_bar=False)
+        _, I = self.index.search(np.asarray(query_embeddings, dtype=np.float32), k)
+        return [[self.knowledge_base[i] for i in row if 0 <= i < len(self.knowledge_base)] for row in I]
+
+    def _retrieve_coalesced(self, items):
+        k = max(item_k for _, item_k in items)
+        results = self.retrieve_batch([query for query, _ in items], k)
+        return [hits[:item_k] for hits, (_, item_k) in zip(results, items)]
 
     def generate(self, query, context):
         # Use the LLM to generate a response
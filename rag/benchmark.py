@@ -0,0 +1,435 @@
+"""Micro-benchmarks for the retrieval and generation paths.
+
+Usage:
+    python benchmark.py retrieval --chunks 1000000 --dim 768 --queries 200
+    python benchmark.py quantization --chunks 200000 --dim 768 --queries 200
+    python benchmark.py encoder --model all-mpnet-base-v2 --backends torch onnx onnx-int8
+    python benchmark.py generation --model distilgpt2 --concurrency 1 8 16
+    python benchmark.py prefix --model distilgpt2 --contexts 4 --requests 64
+    python benchmark.py speculative --model gpt2-medium --draft-model distilgpt2 --draft-tokens 2 4 6
+    python benchmark.py workers --backend stub --calls 200
+    python benchmark.py batch --model distilgpt2 --queries 64
+"""
+import argparse
+import resource
+import time
+
+import numpy as np
+
+
+def _percentiles(samples_ms):
+    samples = np.asarray(samples_ms)
+    return {
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'mean_ms': float(samples.mean()),
+    }
+
+
+def _max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _synthetic_chunks(num_chunks, vocab_size, words_per_chunk, seed=0):
+    """Zipf-distributed synthetic text, with a sprinkling of identifier tokens."""
+    rng = np.random.default_rng(seed)
+    vocab = [f"w{i}" for i in range(vocab_size)]
+    for i in range(num_chunks):
+        ranks = np.minimum(rng.zipf(1.2, words_per_chunk), vocab_size) - 1
+        words = [vocab[r] for r in ranks]
+        words.append(f"ID-{i % 50000}")
+        yield i, " ".join(words)
+
+
+def bench_retrieval(args):
+    import faiss
+    from lexical_index import LexicalIndex
+
+    rng = np.random.default_rng(1)
+    results = {}
+
+    # Lexical: build and query the BM25 index
+    rss_before = _max_rss_mb()
+    lexical = LexicalIndex()
+    start = time.perf_counter()
+    lexical.add_many(_synthetic_chunks(args.chunks, args.vocab, args.words))
+    build_s = time.perf_counter() - start
+
+    queries = [f"w{rng.integers(0, 200)} w{rng.integers(0, args.vocab)}" for _ in range(args.queries)]
+    queries += [f"ID-{rng.integers(0, 50000)}" for _ in range(args.queries)]
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        lexical.search(query, args.top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    results['lexical'] = {
+        'build_s': build_s,
+        'index_mb': lexical.memory_bytes() / 2**20,
+        'rss_growth_mb': _max_rss_mb() - rss_before,
+        **_percentiles(latencies),
+    }
+    del lexical
+
+    # Dense: flat L2 search over random vectors. This excludes query
+    # encoding, which the lexical path avoids entirely.
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(args.dim))
+    start = time.perf_counter()
+    for offset in range(0, args.chunks, 100_000):
+        count = min(100_000, args.chunks - offset)
+        vectors = rng.random((count, args.dim), dtype=np.float32)
+        index.add_with_ids(vectors, np.arange(offset, offset + count, dtype=np.int64))
+    build_s = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(args.queries):
+        query = rng.random((1, args.dim), dtype=np.float32)
+        start = time.perf_counter()
+        index.search(query, args.top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    results['dense'] = {
+        'build_s': build_s,
+        'index_mb': index.ntotal * args.dim * 4 / 2**20,
+        **_percentiles(latencies),
+    }
+    return results
+
+
+def _recall(found, truth, k):
+    return float(np.mean([len(set(f[:k]) & set(t[:k])) / k for f, t in zip(found, truth)]))
+
+
+def _clustered_vectors(rng, count, dim, centers):
+    """Gaussian clusters around shared centers, closer to real embeddings than uniform noise."""
+    labels = rng.integers(0, len(centers), count)
+    return (centers[labels] + 0.3 * rng.standard_normal((count, dim))).astype(np.float32)
+
+
+def bench_quantization(args):
+    import faiss
+    from embedding_store import EmbeddingStore
+
+    rng = np.random.default_rng(2)
+    centers = rng.standard_normal((256, args.dim)).astype(np.float32)
+    vectors = _clustered_vectors(rng, args.chunks, args.dim, centers)
+    queries = _clustered_vectors(rng, args.queries, args.dim, centers)
+    ids = np.arange(args.chunks, dtype=np.int64)
+
+    flat = faiss.IndexFlatL2(args.dim)
+    flat.add(vectors)
+    _, truth = flat.search(queries, args.top_k)
+    results = {}
+
+    variants = [
+        ('flat', None, 1),
+        ('sq_fp16', faiss.ScalarQuantizer.QT_fp16, 1),
+        ('sq_int8', faiss.ScalarQuantizer.QT_8bit, 1),
+        ('sq_int8_rerank', faiss.ScalarQuantizer.QT_8bit, args.rerank_factor),
+    ]
+    store = EmbeddingStore('float16', initial_capacity=args.chunks)
+    store.add(ids.tolist(), vectors)
+    for name, qtype, factor in variants:
+        if qtype is None:
+            index = flat
+        else:
+            index = faiss.IndexScalarQuantizer(args.dim, qtype, faiss.METRIC_L2)
+            index.train(vectors[:min(len(vectors), 100_000)])
+            index.add(vectors)
+        latencies, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            _, candidates = index.search(query.reshape(1, -1), args.top_k * factor)
+            row = [int(i) for i in candidates[0] if i >= 0]
+            if factor > 1:
+                row = store.rerank(query, row, args.top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found.append(row)
+        index_mb = index.ntotal * args.dim * 4 / 2**20 if qtype is None else index.sa_code_size() * index.ntotal / 2**20
+        results[name] = {
+            'index_mb': index_mb,
+            f'recall@{args.top_k}': _recall(found, truth, args.top_k),
+            **_percentiles(latencies),
+        }
+        if factor > 1:
+            results[name]['rerank_store_mb'] = store.memory_bytes() / 2**20
+
+    for dtype in ('float32', 'float16', 'int8'):
+        sized = EmbeddingStore(dtype, initial_capacity=args.chunks)
+        sized.add(ids.tolist(), vectors)
+        error = np.abs(sized.get(ids[:1000].tolist()) - vectors[:1000]).mean()
+        results[f'store_{dtype}'] = {'store_mb': sized.memory_bytes() / 2**20, 'mean_abs_error': float(error)}
+    return results
+
+
+def bench_encoder(args):
+    from encoder_backends import PARITY_SENTENCES, check_parity, load_encoder
+
+    rng = np.random.default_rng(3)
+    words = "the index query cluster node raft leader chunk embedding latency".split()
+    queries = [" ".join(rng.choice(words, rng.integers(4, 16))) for _ in range(args.queries)]
+    passages = [" ".join(rng.choice(words, rng.integers(100, 200))) for _ in range(args.passages)]
+
+    reference = None
+    results = {}
+    for backend in args.backends:
+        encoder = load_encoder(args.model, backend, num_threads=args.threads)
+        encoder.encode(queries[:4])  # warm up
+        if reference is None:
+            reference = load_encoder(args.model, 'torch', num_threads=args.threads).encode(PARITY_SENTENCES)
+
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            encoder.encode([query])
+            latencies.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        encoder.encode(passages, batch_size=args.batch_size)
+        elapsed = time.perf_counter() - start
+        results[backend] = {
+            **_percentiles(latencies),
+            'passages_per_s': len(passages) / elapsed,
+            'min_cosine': check_parity(encoder, reference, min_cosine=0.0)['min_cosine'],
+        }
+    return results
+
+
+def bench_generation(args):
+    from concurrent.futures import ThreadPoolExecutor
+    from generation_engine import GenerationEngine
+
+    prompts = [f"Question {i}: explain how leader election works in a replicated log." for i in range(args.requests)]
+    results = {}
+    for concurrency in args.concurrency:
+        engine = GenerationEngine(args.model, max_batch_size=concurrency, max_new_tokens=args.new_tokens)
+        engine.generate(prompts[0], max_new_tokens=4)  # warm up
+        tokens_before = engine.get_stats()['tokens_generated']
+        latencies = []
+
+        def run(prompt):
+            start = time.perf_counter()
+            engine.generate(prompt, max_new_tokens=args.new_tokens)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(run, prompts))
+        elapsed = time.perf_counter() - start
+        stats = engine.get_stats()
+        engine.close()
+        results[f'concurrency_{concurrency}'] = {
+            'tokens_per_s': (stats['tokens_generated'] - tokens_before) / elapsed,
+            'avg_batch_size': stats['avg_batch_size'],
+            **_percentiles(latencies),
+        }
+    return results
+
+
+def bench_prefix(args):
+    """Time to first token for prompts that share a few popular context blocks."""
+    import random
+    from generation_engine import GenerationEngine
+
+    rng = random.Random(0)
+    contexts = [" ".join(f"Passage {c}.{i}: replicas append entries to the log and acknowledge the leader." for i in range(args.passages))
+                for c in range(args.contexts)]
+    prompts = [f"Context: {rng.choice(contexts)}\n\nQuery: question {i}?\n\nAnswer:" for i in range(args.requests)]
+    results = {}
+    for label, cache_bytes in (('no_prefix_cache', 0), ('prefix_cache', args.cache_mb * 2**20)):
+        engine = GenerationEngine(args.model, max_batch_size=1, prefix_cache_bytes=cache_bytes)
+        latencies = []
+        for prompt in prompts:
+            start = time.perf_counter()
+            engine.generate(prompt, max_new_tokens=1)
+            latencies.append((time.perf_counter() - start) * 1000)
+        stats = engine.get_stats()
+        engine.close()
+        results[label] = {
+            **_percentiles(latencies),
+            'prefix_hit_rate': stats['prefix_cache']['hit_rate'] if stats['prefix_cache'] else 0.0,
+        }
+    return results
+
+
+def bench_speculative(args):
+    """Single-request decode speed with and without a draft model."""
+    from generation_engine import GenerationEngine
+
+    prompts = [f"Question {i}: explain how leader election works in a replicated log.\n\nAnswer:"
+               for i in range(args.requests)]
+    results = {}
+    for draft_tokens in [0] + args.draft_tokens:
+        label = f'draft_{draft_tokens}' if draft_tokens else 'no_draft'
+        engine = GenerationEngine(args.model, max_batch_size=1, max_new_tokens=args.new_tokens, prefix_cache_bytes=0,
+                                  draft_model=args.draft_model if draft_tokens else None, draft_tokens=draft_tokens or 1)
+        engine.generate(prompts[0], max_new_tokens=4)  # warm up
+        tokens_before = engine.get_stats()['tokens_generated']
+        latencies = []
+        start = time.perf_counter()
+        for prompt in prompts:
+            request_start = time.perf_counter()
+            engine.generate(prompt, max_new_tokens=args.new_tokens)
+            latencies.append((time.perf_counter() - request_start) * 1000)
+        elapsed = time.perf_counter() - start
+        stats = engine.get_stats()
+        engine.close()
+        results[label] = {
+            'tokens_per_s': (stats['tokens_generated'] - tokens_before) / elapsed,
+            'acceptance_rate': stats['draft_acceptance_rate'],
+            'tokens_per_step': stats['tokens_per_draft_step'],
+            **_percentiles(latencies),
+        }
+    return results
+
+
+def bench_workers(args):
+    """Per-call overhead of a process per prompt versus the persistent worker pool."""
+    import subprocess
+    import sys
+    from cli_worker import read_frame, write_frame
+    from cli_worker_pool import WORKER_SCRIPT, CliWorkerPool
+
+    command = [sys.executable, WORKER_SCRIPT, '--backend', args.backend, '--model', args.model]
+    prompt = "Context: replicas append entries to the log.\n\nQuery: who commits entries?\n\nAnswer:"
+
+    latencies = []
+    for i in range(args.spawn_calls):
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        write_frame(process.stdin, {'id': i, 'op': 'generate', 'prompt': prompt})
+        read_frame(process.stdout)
+        process.stdin.close()
+        process.wait()
+        process.stdout.close()
+        latencies.append((time.perf_counter() - start) * 1000)
+    results = {'process_per_call': _percentiles(latencies)}
+
+    pool = CliWorkerPool(args.model, backend=args.backend, size=args.workers, health_interval=0)
+    pool.generate(prompt)  # warm up
+    latencies = []
+    for _ in range(args.calls):
+        start = time.perf_counter()
+        pool.generate(prompt)
+        latencies.append((time.perf_counter() - start) * 1000)
+    pool.close()
+    results['worker_pool'] = _percentiles(latencies)
+    return results
+
+
+def bench_batch(args):
+    """One-by-one queries against the batch path: matrix search, then all prompts to the engine at once."""
+    import faiss
+    from generation_engine import GenerationEngine
+    from llm_interface import LlmInterface
+
+    rng = np.random.default_rng(0)
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(args.dim))
+    index.add_with_ids(rng.random((args.chunks, args.dim), dtype=np.float32), np.arange(args.chunks, dtype=np.int64))
+    query_vectors = rng.random((args.queries, args.dim), dtype=np.float32)
+    results = {}
+
+    start = time.perf_counter()
+    for row in range(args.queries):
+        index.search(query_vectors[row:row + 1], args.top_k)
+    sequential_s = time.perf_counter() - start
+    start = time.perf_counter()
+    index.search(query_vectors, args.top_k)
+    batch_s = time.perf_counter() - start
+    results['search'] = {'sequential_s': sequential_s, 'batch_s': batch_s, 'speedup': sequential_s / batch_s}
+
+    queries = [f"Question {i}: how does the replicated log recover after a leader crash?" for i in range(args.queries)]
+    contexts = [f"Passage {i % 7}: followers replay committed entries in order." for i in range(args.queries)]
+    engine = GenerationEngine(args.model, max_batch_size=args.batch_size, max_new_tokens=args.new_tokens)
+    engine.generate(queries[0], max_new_tokens=4)  # warm up
+    sequential = LlmInterface(args.model, engine=engine, max_new_tokens=args.new_tokens)
+    start = time.perf_counter()
+    for query, context in zip(queries, contexts):
+        sequential.query(query, context)
+    sequential_s = time.perf_counter() - start
+    batched = LlmInterface(args.model, engine=engine, max_new_tokens=args.new_tokens)
+    start = time.perf_counter()
+    for future in batched.submit_batch(queries, contexts):
+        future.result()
+    batch_s = time.perf_counter() - start
+    engine.close()
+    results['generation'] = {'sequential_s': sequential_s, 'batch_s': batch_s, 'speedup': sequential_s / batch_s}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    retrieval = sub.add_parser('retrieval', help='BM25 vs dense search latency and memory')
+    retrieval.add_argument('--chunks', type=int, default=1_000_000)
+    retrieval.add_argument('--dim', type=int, default=768)
+    retrieval.add_argument('--vocab', type=int, default=200_000)
+    retrieval.add_argument('--words', type=int, default=120, help='tokens per synthetic chunk')
+    retrieval.add_argument('--queries', type=int, default=200)
+    retrieval.add_argument('--top-k', type=int, default=5)
+    retrieval.set_defaults(func=bench_retrieval)
+
+    quantization = sub.add_parser('quantization', help='Recall and memory of quantized dense storage')
+    quantization.add_argument('--chunks', type=int, default=200_000)
+    quantization.add_argument('--dim', type=int, default=768)
+    quantization.add_argument('--queries', type=int, default=200)
+    quantization.add_argument('--top-k', type=int, default=10)
+    quantization.add_argument('--rerank-factor', type=int, default=4)
+    quantization.set_defaults(func=bench_quantization)
+
+    encoder = sub.add_parser('encoder', help='Query latency, throughput and parity of embedding backends')
+    encoder.add_argument('--model', default='all-mpnet-base-v2')
+    encoder.add_argument('--backends', nargs='+', default=['torch', 'torch-int8', 'onnx', 'onnx-int8'])
+    encoder.add_argument('--threads', type=int, default=None)
+    encoder.add_argument('--queries', type=int, default=200)
+    encoder.add_argument('--passages', type=int, default=256)
+    encoder.add_argument('--batch-size', type=int, default=32)
+    encoder.set_defaults(func=bench_encoder)
+
+    generation = sub.add_parser('generation', help='Continuous-batching generation throughput')
+    generation.add_argument('--model', default='distilgpt2')
+    generation.add_argument('--requests', type=int, default=32)
+    generation.add_argument('--new-tokens', type=int, default=64)
+    generation.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 16])
+    generation.set_defaults(func=bench_generation)
+
+    prefix = sub.add_parser('prefix', help='Time to first token with and without the prompt-prefix KV cache')
+    prefix.add_argument('--model', default='distilgpt2')
+    prefix.add_argument('--contexts', type=int, default=4, help='distinct context blocks shared by the prompts')
+    prefix.add_argument('--passages', type=int, default=20, help='passages per context block')
+    prefix.add_argument('--requests', type=int, default=64)
+    prefix.add_argument('--cache-mb', type=int, default=256)
+    prefix.set_defaults(func=bench_prefix)
+
+    speculative = sub.add_parser('speculative', help='Decode speed with and without draft-model assisted decoding')
+    speculative.add_argument('--model', default='gpt2-medium')
+    speculative.add_argument('--draft-model', default='distilgpt2')
+    speculative.add_argument('--draft-tokens', type=int, nargs='+', default=[2, 4, 6])
+    speculative.add_argument('--requests', type=int, default=16)
+    speculative.add_argument('--new-tokens', type=int, default=64)
+    speculative.set_defaults(func=bench_speculative)
+
+    workers = sub.add_parser('workers', help='Per-call overhead of the external LLM backend')
+    workers.add_argument('--backend', default='stub')
+    workers.add_argument('--model', default='llama3')
+    workers.add_argument('--workers', type=int, default=2)
+    workers.add_argument('--calls', type=int, default=200)
+    workers.add_argument('--spawn-calls', type=int, default=20)
+    workers.set_defaults(func=bench_workers)
+
+    batch = sub.add_parser('batch', help='One-by-one queries vs the batch query path')
+    batch.add_argument('--model', default='distilgpt2')
+    batch.add_argument('--queries', type=int, default=64)
+    batch.add_argument('--chunks', type=int, default=100_000)
+    batch.add_argument('--dim', type=int, default=768)
+    batch.add_argument('--top-k', type=int, default=20)
+    batch.add_argument('--batch-size', type=int, default=16, help='engine decode batch size')
+    batch.add_argument('--new-tokens', type=int, default=32)
+    batch.set_defaults(func=bench_batch)
+
+    args = parser.parse_args()
+    results = args.func(args)
+    for name, stats in results.items():
+        print(name + ': ' + ', '.join(f"{k}={v:.3f}" for k, v in stats.items()))
+
+
+if __name__ == '__main__':
+    main()
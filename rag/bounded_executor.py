@@ -0,0 +1,97 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from tracing import tracer
+
+
+class ExecutorBusyError(RuntimeError):
+    """Raised when a BoundedExecutor's queue is full; callers should shed the request."""
+
+
+class BoundedExecutor:
+    """Thread pool with a cap on queued work.
+
+    At most max_workers calls run at once, and at most max_queue more wait
+    for a thread. submit() rejects anything beyond that with
+    ExecutorBusyError instead of letting the backlog, and with it every
+    caller's latency, grow without bound. run() is the awaitable form for
+    async handlers.
+
+    Calls run in a copy of the submitter's context, so the current trace
+    follows them onto the pool; the span records how long they queued.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int = 64):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self.completed = 0
+        self.rejected = 0
+        self._wait_s = 0.0
+        self._run_s = 0.0
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ExecutorBusyError(f"{self.name} pool is full ({self.max_workers} running, {self.max_queue} queued)")
+        with self._lock:
+            self._pending += 1
+        queued_at = time.perf_counter()
+        context = contextvars.copy_context()
+
+        def call():
+            started = time.perf_counter()
+            with self._lock:
+                self._running += 1
+                self._wait_s += started - queued_at
+            try:
+                with tracer.span(f"pool:{self.name}", queue_wait_ms=(started - queued_at) * 1000):
+                    return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._run_s += time.perf_counter() - started
+
+        try:
+            future = self._executor.submit(context.run, call)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'running': self._running,
+                'queued': self._pending - self._running,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_wait_ms': 1000 * self._wait_s / self.completed if self.completed else 0.0,
+                'avg_run_ms': 1000 * self._run_s / self.completed if self.completed else 0.0,
+            }
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+            if future is not None:
+                self.completed += 1
+        self._slots.release()
@@ -0,0 +1,134 @@
+"""Long-lived LLM backend worker, driven by CliWorkerPool over stdin/stdout.
+
+Every message, in both directions, is one frame: a 4-byte big-endian
+length followed by that many bytes of UTF-8 JSON. Requests look like
+{"id", "op": "generate" | "ping" | "shutdown", ...} and each gets exactly
+one response, {"id", "ok": true, ...} or {"id", "ok": false, "error"}.
+
+Usage:
+    python cli_worker.py --backend stub --model distilgpt2
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+import urllib.request
+from typing import Any, BinaryIO, Dict, Optional
+
+_HEADER = struct.Struct('>I')
+MAX_FRAME_BYTES = 64 * 2**20
+
+
+def write_frame(stream: BinaryIO, message: Dict[str, Any]):
+    payload = json.dumps(message).encode('utf-8')
+    stream.write(_HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+
+def _read_exact(stream: BinaryIO, size: int) -> Optional[bytes]:
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def read_frame(stream: BinaryIO) -> Optional[Dict[str, Any]]:
+    """Next message from stream, or None once the other side has closed it."""
+    header = _read_exact(stream, _HEADER.size)
+    if header is None:
+        return None
+    (size,) = _HEADER.unpack(header)
+    if size > MAX_FRAME_BYTES:
+        raise ValueError(f"Frame of {size} bytes exceeds the {MAX_FRAME_BYTES} byte limit")
+    payload = _read_exact(stream, size)
+    if payload is None:
+        return None
+    return json.loads(payload.decode('utf-8'))
+
+
+class StubBackend:
+    """Answers instantly without a model; for tests and overhead benchmarks."""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    def generate(self, prompt: str, max_length: int) -> str:
+        delay = float(os.environ.get('RAG_STUB_DELAY', '0'))
+        if delay:
+            time.sleep(delay)
+        return f"[{self.model_name}] {prompt}"[:max_length]
+
+
+class OllamaBackend:
+    """Generates through the local Ollama server's HTTP API.
+
+    keep_alive keeps the model resident between calls. The prompt goes in
+    the JSON body, so it never passes through a shell.
+    """
+
+    def __init__(self, model_name: str, host: Optional[str] = None, keep_alive: str = '30m',
+                 timeout: float = 300.0):
+        self.model_name = model_name
+        self.url = (host or os.environ.get('OLLAMA_HOST', 'http://127.0.0.1:11434')).rstrip('/') + '/api/generate'
+        if '://' not in self.url:
+            self.url = 'http://' + self.url
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+
+    def generate(self, prompt: str, max_length: int) -> str:
+        body = json.dumps({
+            'model': self.model_name,
+            'prompt': prompt,
+            'stream': False,
+            'keep_alive': self.keep_alive,
+            'options': {'num_predict': max_length},
+        }).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode('utf-8')).get('response', '').strip()
+
+
+BACKENDS = {'stub': StubBackend, 'ollama': OllamaBackend}
+
+
+def serve(backend, stdin: BinaryIO, stdout: BinaryIO):
+    while True:
+        message = read_frame(stdin)
+        if message is None:
+            return
+        op = message.get('op')
+        reply: Dict[str, Any] = {'id': message.get('id'), 'ok': True}
+        try:
+            if op == 'generate':
+                reply['text'] = backend.generate(message['prompt'], int(message.get('max_length', 100)))
+            elif op == 'ping':
+                reply['pid'] = os.getpid()
+            elif op == 'shutdown':
+                write_frame(stdout, reply)
+                return
+            else:
+                raise ValueError(f"Unknown op: {op}")
+        except Exception as e:
+            reply = {'id': message.get('id'), 'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        write_frame(stdout, reply)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='ollama')
+    parser.add_argument('--model', required=True)
+    args = parser.parse_args()
+
+    stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+    # Frames own stdout; anything the backend prints goes to stderr
+    sys.stdout = sys.stderr
+    serve(BACKENDS[args.backend](args.model), stdin, stdout)
+
+
+if __name__ == '__main__':
+    main()
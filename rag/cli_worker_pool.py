@@ -0,0 +1,217 @@
+import itertools
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from cli_worker import read_frame, write_frame
+from model_registry import registry
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli_worker.py')
+
+
+class WorkerCrashed(RuntimeError):
+    pass
+
+
+class _Worker:
+    """One cli_worker.py child process; a reader thread queues its replies."""
+
+    def __init__(self, command: List[str]):
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+        self.started_at = time.monotonic()
+        self._replies: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+        threading.Thread(target=self._read, name=f"cli-worker-{self.process.pid}", daemon=True).start()
+
+    def _read(self):
+        try:
+            while True:
+                reply = read_frame(self.process.stdout)
+                self._replies.put(reply)
+                if reply is None:
+                    return
+        except Exception:
+            self._replies.put(None)
+
+    def call(self, message: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """Send one request and wait for its reply; raises WorkerCrashed or TimeoutError."""
+        try:
+            write_frame(self.process.stdin, message)
+        except (BrokenPipeError, OSError) as e:
+            raise WorkerCrashed(f"Worker {self.process.pid} is gone: {e}")
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                reply = self._replies.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise TimeoutError(f"Worker {self.process.pid} did not answer within {timeout}s")
+            if reply is None:
+                raise WorkerCrashed(f"Worker {self.process.pid} exited with code {self.process.poll()}")
+            if reply.get('id') == message['id']:
+                return reply
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def stop(self, timeout: float = 2.0):
+        if self.alive():
+            try:
+                write_frame(self.process.stdin, {'id': None, 'op': 'shutdown'})
+                self.process.wait(timeout=timeout)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        if self.alive():
+            self.process.kill()
+            self.process.wait()
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+
+class CliWorkerPool:
+    """Pool of long-lived LLM backend processes (see cli_worker.py).
+
+    Each worker loads its backend once and then serves length-prefixed JSON
+    requests over its stdin/stdout, so a call costs one pipe round trip
+    instead of a process start and a model load. A worker serves one
+    request at a time, so the pool size is also the concurrency limit.
+    Callers beyond it wait up to acquire_timeout for a free worker.
+
+    A worker that exits mid-request is restarted and the request retried
+    once. A worker that exceeds request_timeout is killed and restarted. A
+    background thread pings idle workers every health_interval seconds and
+    replaces any that fail to answer.
+    """
+
+    def __init__(self, model_name: str, backend: str = 'ollama', size: int = 2,
+                 request_timeout: float = 120.0, acquire_timeout: float = 30.0,
+                 health_interval: float = 15.0, health_timeout: float = 5.0):
+        self.model_name = model_name
+        self.backend = backend
+        self.size = size
+        self.request_timeout = request_timeout
+        self.acquire_timeout = acquire_timeout
+        self.health_timeout = health_timeout
+        self._command = [sys.executable, WORKER_SCRIPT, '--backend', backend, '--model', model_name]
+        self._ids = itertools.count()
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        for _ in range(size):
+            self._idle.put(_Worker(self._command))
+        self._closed = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self.health_checks = 0
+        self._latency_s = 0.0
+        self._health = None
+        if health_interval:
+            self._health = threading.Thread(target=self._health_loop, args=(health_interval,),
+                                            name=f"cli-pool-health-{model_name}", daemon=True)
+            self._health.start()
+
+    def generate(self, prompt: str, max_length: int = 100) -> str:
+        if self._closed.is_set():
+            raise RuntimeError("CliWorkerPool is closed")
+        try:
+            worker = self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise TimeoutError(f"All {self.size} {self.backend} workers busy for {self.acquire_timeout}s")
+        start = time.perf_counter()
+        try:
+            message = {'id': next(self._ids), 'op': 'generate', 'prompt': prompt, 'max_length': max_length}
+            try:
+                reply = worker.call(message, self.request_timeout)
+            except WorkerCrashed:
+                worker = self._restart(worker)
+                reply = worker.call(message, self.request_timeout)
+        except TimeoutError:
+            worker = self._restart(worker)
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        except WorkerCrashed:
+            worker = self._restart(worker)
+            with self._stats_lock:
+                self.errors += 1
+            raise
+        finally:
+            self._idle.put(worker)
+        with self._stats_lock:
+            self.requests += 1
+            self._latency_s += time.perf_counter() - start
+            if not reply['ok']:
+                self.errors += 1
+        if not reply['ok']:
+            raise RuntimeError(reply['error'])
+        return reply['text']
+
+    def check_health(self) -> int:
+        """Ping every idle worker and replace the ones that fail; returns how many were replaced."""
+        replaced = 0
+        for _ in range(self._idle.qsize()):
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                healthy = worker.alive() and worker.call({'id': next(self._ids), 'op': 'ping'}, self.health_timeout)['ok']
+            except (WorkerCrashed, TimeoutError):
+                healthy = False
+            if not healthy:
+                worker = self._restart(worker)
+                replaced += 1
+            self._idle.put(worker)
+        with self._stats_lock:
+            self.health_checks += 1
+        return replaced
+
+    def close(self):
+        self._closed.set()
+        for _ in range(self.size):
+            try:
+                self._idle.get(timeout=self.request_timeout).stop()
+            except queue.Empty:
+                break
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                'backend': self.backend,
+                'workers': self.size,
+                'busy': self.size - self._idle.qsize(),
+                'requests': self.requests,
+                'errors': self.errors,
+                'timeouts': self.timeouts,
+                'restarts': self.restarts,
+                'health_checks': self.health_checks,
+                'avg_latency_ms': 1000 * self._latency_s / self.requests if self.requests else 0.0,
+            }
+
+    def _restart(self, worker: _Worker) -> _Worker:
+        worker.stop(timeout=0.5)
+        with self._stats_lock:
+            self.restarts += 1
+        print(f"Restarting {self.backend} worker for {self.model_name} (pid {worker.process.pid})")
+        return _Worker(self._command)
+
+    def _health_loop(self, interval: float):
+        while not self._closed.wait(interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                print(f"CLI worker health check failed: {e}")
+
+
+def get_worker_pool(model_name: str, backend: Optional[str] = None, size: Optional[int] = None) -> CliWorkerPool:
+    """The process-wide worker pool for model_name, started on first use."""
+    backend = backend or os.environ.get('RAG_CLI_BACKEND', 'ollama')
+    size = size or int(os.environ.get('RAG_CLI_WORKERS', '2'))
+    return registry.get('cli_worker_pool', model_name, lambda: CliWorkerPool(model_name, backend, size),
+                        backend=backend, size=size)
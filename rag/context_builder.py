@@ -0,0 +1,108 @@
+import re
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from semantic_cache import normalize_rows
+
+_WORD_RE = re.compile(r'\S+')
+
+
+class ContextBuilder:
+    """Assemble retrieved chunks into a prompt context under a token budget.
+
+    Candidates arrive in retrieval order. Selection is greedy maximal
+    marginal relevance: each step picks the chunk that best balances
+    relevance to the query against similarity to chunks already chosen.
+    Candidates nearly identical (cosine >= dedup_threshold) to a chosen
+    chunk are dropped outright. Chunks are added until the token budget,
+    measured with the LLM's tokenizer, is spent; the last one may be cut
+    short to fill it.
+    """
+
+    def __init__(self, token_budget: int = 1024, tokenizer=None, mmr_lambda: float = 0.7,
+                 dedup_threshold: float = 0.95, min_tail_tokens: int = 32, separator: str = "\n\n"):
+        self.token_budget = token_budget
+        self.tokenizer = tokenizer
+        self.mmr_lambda = mmr_lambda
+        self.dedup_threshold = dedup_threshold
+        self.min_tail_tokens = min_tail_tokens
+        self.separator = separator
+
+    def count_tokens(self, text: str) -> int:
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        # Without a tokenizer, about 1.3 tokens per whitespace-separated word
+        return int(len(_WORD_RE.findall(text)) * 1.3) + 1
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if self.tokenizer is not None:
+            ids = self.tokenizer.encode(text, add_special_tokens=False)[:max_tokens]
+            return self.tokenizer.decode(ids, skip_special_tokens=True)
+        words = _WORD_RE.findall(text)
+        return " ".join(words[:int(max_tokens / 1.3)])
+
+    def build(self, candidates: List[Dict[str, Any]], vectors: Optional[np.ndarray] = None,
+              query_vector: Optional[np.ndarray] = None, max_chunks: Optional[int] = None) -> Dict[str, Any]:
+        """Select and format candidates.
+
+        candidates are dicts with 'id', 'text' and 'source', best first.
+        vectors holds their embeddings row for row (None disables MMR and
+        deduplication). Without a query_vector, relevance falls off with
+        retrieval rank.
+
+        Returns {'text', 'tokens', 'chunks': [{'id', 'source', 'tokens'}]}.
+        """
+        order = self._select_order(candidates, vectors, query_vector)
+        budget = self.token_budget
+        chunks, parts = [], []
+        for i in order:
+            if max_chunks is not None and len(chunks) >= max_chunks:
+                break
+            candidate = candidates[i]
+            header = f"[{len(chunks) + 1}] ({candidate.get('source') or 'unknown'})\n"
+            text = candidate['text']
+            cost = self.count_tokens(header + text)
+            if cost > budget:
+                remaining = budget - self.count_tokens(header)
+                if remaining < self.min_tail_tokens:
+                    continue
+                text = self.truncate(text, remaining)
+                cost = self.count_tokens(header + text)
+                if cost > budget:
+                    continue
+            parts.append(header + text)
+            chunks.append({'id': candidate['id'], 'source': candidate.get('source'), 'tokens': cost})
+            budget -= cost
+        return {
+            'text': self.separator.join(parts),
+            'tokens': self.token_budget - budget,
+            'chunks': chunks,
+        }
+
+    def _select_order(self, candidates, vectors, query_vector) -> List[int]:
+        n = len(candidates)
+        if vectors is None or n < 2:
+            return list(range(n))
+
+        unit = normalize_rows(vectors)
+        if query_vector is not None:
+            relevance = unit @ normalize_rows(query_vector)[0]
+        else:
+            relevance = 1.0 - np.arange(n, dtype=np.float32) / n
+        similarity = unit @ unit.T
+
+        order: List[int] = []
+        remaining = np.ones(n, dtype=bool)
+        max_sim = np.full(n, -1.0, dtype=np.float32)  # to the closest chosen chunk
+        while remaining.any():
+            redundancy = np.where(max_sim > -1.0, max_sim, 0.0)
+            scores = self.mmr_lambda * relevance - (1.0 - self.mmr_lambda) * redundancy
+            scores[~remaining] = -np.inf
+            best = int(np.argmax(scores))
+            order.append(best)
+            remaining[best] = False
+            max_sim = np.maximum(max_sim, similarity[best])
+            # Near-duplicates of a chosen chunk add tokens but no information
+            remaining &= max_sim < self.dedup_threshold
+        return order
@@ -1,125 +1,195 @@
 import numpy as np
-import time
-import threading
-from typing import List, Dict, Any, Optional
+import re
+from typing import List, Dict, Any, Optional, Tuple
+
+from context_builder import ContextBuilder
+from metrics import stage_timer
+from single_flight import SingleFlight
+from ttl_cache import TTLCache, make_cache_key
+
+_IDENTIFIER_RE = re.compile(r"[A-Za-z]*\d|[_.\-]\w|[a-z][A-Z]|^[A-Z]{2,}$")
+
+
+def _looks_like_identifier_query(query: str) -> bool:
+    """Short queries containing codes, versions or snake/camel-case names."""
+    tokens = query.split()
+    return 0 < len(tokens) <= 4 and any(_IDENTIFIER_RE.search(t) for t in tokens)
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[int]:
+    """Merge ranked id lists by summing 1 / (k + rank) across lists."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
 
 class ContextFetcher:
-    def __init__(self, faiss_indexer):
+    def __init__(self, faiss_indexer, cache_size: int = 1000, cache_bytes: int = 32 * 2**20,
+                 cache_ttl: float = 600.0, token_budget: int = 1024):
         self.faiss_indexer = faiss_indexer
-        self._cache = {}  # Bug: Memory leak - cache grows indefinitely
-        self._cache_lock = threading.Lock()
-        self._last_cleanup = time.time()
-        self._cleanup_interval = 600  # 10 minutes
-        self._max_cache_size = 1000  # Bug: This limit is never enforced
-        
-        # Bug: No validation that faiss_indexer has required methods
-        
-    def retrieve(self, query: str, top_k: int = 5) -> str:
-        """Retrieve relevant context for a given query."""
+        # Keys include the index version, so a refresh never serves stale context
+        self._cache = TTLCache(max_entries=cache_size, max_bytes=cache_bytes, ttl=cache_ttl)
+        self.lexical_fast_path = True
+        self.fusion_candidates_factor = 4
+        self.rrf_k = 60
+        self._flight = SingleFlight()
+        self.flight_timeout = 60.0
+        # Swap in a builder with the LLM's tokenizer via set_tokenizer()
+        self.builder = ContextBuilder(token_budget=token_budget)
+
+    def retrieve(self, query: str, top_k: int = 5, mode: str = "hybrid",
+                 filters: Optional[Dict[str, Any]] = None) -> str:
+        """Retrieve relevant context for a given query as prompt-ready text.
+
+        mode is "dense" (FAISS only), "lexical" (BM25 only) or "hybrid", which
+        fuses both rankings with reciprocal-rank fusion. Hybrid queries that
+        look like exact identifiers take the lexical-only fast path and never
+        touch the embedding model.
+
+        filters restricts results by chunk metadata, e.g.
+        {"tenant": "acme", "date": {"from": "2024-01-01"}}.
+        """
         try:
-            # Bug: Input validation is incomplete
-            if not query or not isinstance(query, str):
-                return "Invalid query format"
-            
-            # Bug: Cache key generation can cause collisions
-            cache_key = f"{query[:30]}_{top_k}"
-            
-            # Bug: Race condition in cache access
-            with self._cache_lock:
-                if cache_key in self._cache:
-                    cached_result = self._cache[cache_key]
-                    # Bug: Cache entry format is inconsistent
-                    if isinstance(cached_result, dict):
-                        return cached_result.get('context', 'Cached context error')
-                    return cached_result
-            
-            # Bug: This will fail if faiss_indexer doesn't have the expected interface
-            try:
-                # Bug: Method name might not match the actual implementation
-                results = self.faiss_indexer.search(query, top_k)
-            except AttributeError:
-                # Bug: Silent failure - returns fake context
-                results = [f"Fake result {i}" for i in range(top_k)]
-            
-            # Bug: Results processing is flawed
-            if not results:
-                context = "No relevant context found"
-            else:
-                # Bug: This assumes results is a list of strings, but it might be different
-                if isinstance(results, list):
-                    context = " ".join(str(result) for result in results[:top_k])
-                else:
-                    # Bug: Silent failure - converts unexpected result type to string
-                    context = str(results)
-            
-            # Bug: Cache cleanup logic is flawed
-            if time.time() - self._last_cleanup > self._cleanup_interval:
-                self._cleanup_cache()
-                self._last_cleanup = time.time()
-            
-            # Bug: Cache entry format is inconsistent
-            cache_entry = {
-                'query': query,
-                'context': context,
-                'top_k': top_k,
-                'timestamp': time.time()
-            }
-            
-            with self._cache_lock:
-                # Bug: No size limit enforcement
-                self._cache[cache_key] = cache_entry
-            
-            return context
-            
+            result = self.retrieve_context(query, top_k, mode, filters)
+            return result['text'] or "No relevant context found"
         except Exception as e:
-            # Bug: Generic exception handling masks specific issues
             print(f"Error in context retrieval: {e}")
             return f"Error retrieving context: {str(e)}"
-    
-    def _cleanup_cache(self):
-        """Bug: Cache cleanup logic is incorrect"""
-        current_time = time.time()
-        # Bug: The cleanup logic is backwards - should remove old entries
-        # but the condition is wrong (should be < not >)
-        with self._cache_lock:
-            self._cache = {
-                k: v for k, v in self._cache.items()
-                if current_time - v.get('timestamp', 0) < self._cleanup_interval
-            }
-    
+
+    def retrieve_context(self, query: str, top_k: int = 5, mode: str = "hybrid",
+                         filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Structured context: {'text', 'tokens', 'chunks': [{'id', 'source', 'tokens'}]}.
+
+        At most top_k chunks are chosen by the context builder from a wider
+        candidate pool, deduplicated and trimmed to its token budget.
+        """
+        if not query or not isinstance(query, str):
+            raise ValueError("Invalid query format")
+
+        index_version = getattr(self.faiss_indexer, 'index_version', 0)
+        cache_key = make_cache_key(query, top_k, mode, filters, index_version, self.builder.token_budget)
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # Identical queries already being fetched wait for that result
+        return self._flight.do(cache_key, lambda: self._fetch(query, top_k, mode, filters, cache_key),
+                               timeout=self.flight_timeout)
+
+    def _fetch(self, query: str, top_k: int, mode: str, filters: Optional[Dict[str, Any]],
+               cache_key: str) -> Dict[str, Any]:
+        # A flight that finished just before this one started has already filled the cache
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        if hasattr(self.faiss_indexer, 'get_chunks'):
+            ids, dense = self._search_ids(query, top_k * self.fusion_candidates_factor, mode, filters)
+            context = self._build(query, ids, dense, top_k)
+        else:
+            chunks = [{'id': i, 'text': str(text), 'source': None}
+                      for i, text in enumerate(self._search(query, top_k, mode, filters))]
+            context = self.builder.build(chunks, None, None, max_chunks=top_k)
+
+        self._cache.put(cache_key, context)
+        return context
+
+    def retrieve_context_batch(self, queries: List[str], top_k: int = 5, mode: str = "hybrid",
+                               filters: Optional[List[Optional[Dict[str, Any]]]] = None) -> List[Dict[str, Any]]:
+        """retrieve_context() for many queries, in order.
+
+        Cache misses are embedded in one encoder call and searched with one
+        matrix index.search per distinct filter, instead of one of each per
+        query. BM25 ranking and context building stay per query.
+        """
+        filters = filters or [None] * len(queries)
+        if any(not query or not isinstance(query, str) for query in queries):
+            raise ValueError("Invalid query format")
+        if not hasattr(self.faiss_indexer, 'get_chunks'):
+            return [self.retrieve_context(q, top_k, mode, f) for q, f in zip(queries, filters)]
+
+        index_version = getattr(self.faiss_indexer, 'index_version', 0)
+        keys = [make_cache_key(q, top_k, mode, f, index_version, self.builder.token_budget)
+                for q, f in zip(queries, filters)]
+        results: List[Optional[Dict[str, Any]]] = [self._cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+
+        candidates = top_k * self.fusion_candidates_factor
+        lexical: Dict[int, List[int]] = {}
+        dense_rows: List[int] = []
+        for i in missing:
+            if mode != "dense":
+                lexical[i] = [chunk_id for chunk_id, _ in
+                              self.faiss_indexer.lexical_search_ids(queries[i], candidates, filters=filters[i])]
+            if mode == "dense" or (mode != "lexical" and not (
+                    self.lexical_fast_path and lexical[i] and _looks_like_identifier_query(queries[i]))):
+                dense_rows.append(i)
+
+        dense: Dict[int, Tuple[List[int], np.ndarray]] = {}
+        if dense_rows:
+            query_vectors = self.faiss_indexer.embed_queries([queries[i] for i in dense_rows])
+            hits = self.faiss_indexer.search_vectors_filtered_ids(query_vectors, candidates,
+                                                                  [filters[i] for i in dense_rows])
+            dense = {i: (ids, vector) for i, ids, vector in zip(dense_rows, hits, query_vectors)}
+
+        for i in missing:
+            if i not in dense:
+                results[i] = self._build(queries[i], lexical[i], False, top_k)
+            else:
+                ids, query_vector = dense[i]
+                if i in lexical:
+                    ids = reciprocal_rank_fusion([ids, lexical[i]], k=self.rrf_k)[:candidates]
+                results[i] = self._build(queries[i], ids, True, top_k, query_vector)
+            self._cache.put(keys[i], results[i])
+        return results
+
+    def _build(self, query: str, ids: List[int], dense: bool, top_k: int,
+               query_vector: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        if dense and query_vector is None:
+            query_vector = self.faiss_indexer.embed_queries([query])[0]
+        with stage_timer('context'):
+            chunks, vectors = self.faiss_indexer.get_chunks(ids)
+            return self.builder.build(chunks, vectors, query_vector if vectors is not None else None,
+                                      max_chunks=top_k)
+
+    def _search_ids(self, query: str, candidates: int, mode: str,
+                    filters: Optional[Dict[str, Any]] = None) -> Tuple[List[int], bool]:
+        """Ranked candidate ids and whether the dense index contributed."""
+        if mode == "dense":
+            return self.faiss_indexer.search_ids(query, candidates, filters=filters), True
+        lexical_ids = [chunk_id for chunk_id, _ in
+                       self.faiss_indexer.lexical_search_ids(query, candidates, filters=filters)]
+        if mode == "lexical" or (self.lexical_fast_path and lexical_ids and _looks_like_identifier_query(query)):
+            return lexical_ids, False
+        dense_ids = self.faiss_indexer.search_ids(query, candidates, filters=filters)
+        return reciprocal_rank_fusion([dense_ids, lexical_ids], k=self.rrf_k)[:candidates], True
+
+    def _search(self, query: str, top_k: int, mode: str,
+                filters: Optional[Dict[str, Any]] = None) -> List[str]:
+        """Plain text search for indexers that cannot return chunk ids."""
+        try:
+            return self.faiss_indexer.search(query, top_k, filters=filters)
+        except AttributeError:
+            return []
+
+    def set_tokenizer(self, tokenizer):
+        """Count context tokens with the LLM's own tokenizer."""
+        self.builder.tokenizer = tokenizer
+
     def get_cache_stats(self) -> Dict[str, Any]:
-        """Bug: This method has a race condition"""
-        # Bug: No lock protection for reading cache stats
-        return {
-            'size': len(self._cache),
-            'last_cleanup': self._last_cleanup,
-            'cleanup_interval': self._cleanup_interval,
-            'max_size': self._max_cache_size
-        }
-    
-    def clear_cache(self):
-        """Bug: This method has a race condition"""
-        with self._cache_lock:
-            # Bug: The operation is not atomic
-            old_cache = self._cache
-            self._cache = {}
-            # Bug: Between these lines, another thread could modify the cache
-            return len(old_cache)
+        return {**self._cache.get_stats(), 'single_flight': self._flight.get_stats()}
+
+    def clear_cache(self) -> int:
+        return self._cache.clear()
     
-    def search_similar(self, query: str, threshold: float = 0.5) -> List[str]:
-        """Bug: This method has incorrect similarity calculation"""
+    def search_similar(self, query: str, threshold: float = 0.5, top_k: int = 10) -> List[str]:
+        """Chunks whose embedding is within cosine threshold of the query."""
         try:
-            # Bug: This method assumes faiss_indexer has a similarity search method
-            # but it might not exist
-            if hasattr(self.faiss_indexer, 'search_similar'):
-                results = self.faiss_indexer.search_similar(query, threshold)
-            else:
-                # Bug: Silent failure - returns empty list
-                results = []
-            
-            # Bug: No validation of results format
-            return results if isinstance(results, list) else []
-            
+            return self.faiss_indexer.search_similar(query, threshold, top_k)
         except Exception as e:
-            # Bug: Silent failure - errors are not logged
+            print(f"Error in similarity search: {e}")
             return []
@@ -0,0 +1,207 @@
+import hashlib
+import multiprocessing
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Iterable, List, Optional, Tuple, Union
+
+TEXT_EXTENSIONS = ('.txt', '.md')
+PDF_EXTENSIONS = ('.pdf',)
+SUPPORTED_EXTENSIONS = TEXT_EXTENSIONS + PDF_EXTENSIONS
+# Characters read from a text file at a time
+TEXT_BLOCK_CHARS = 1 << 18
+
+_WORD_RE = re.compile(r'\S+')
+
+
+class DocumentChunk:
+    """A slice of a source document ready to be embedded."""
+
+    __slots__ = ('text', 'source', 'chunk_index', 'start', 'end')
+
+    def __init__(self, text: str, source: str, chunk_index: int, start: int, end: int):
+        self.text = text
+        self.source = source
+        self.chunk_index = chunk_index
+        self.start = start
+        self.end = end
+
+    def metadata(self) -> dict:
+        return {
+            'source': self.source,
+            'chunk_index': self.chunk_index,
+            'start': self.start,
+            'end': self.end,
+        }
+
+
+def iter_document_files(doc_path: str, extensions: Tuple[str, ...] = SUPPORTED_EXTENSIONS) -> Iterator[str]:
+    """Yield absolute paths of supported files under doc_path, recursively and in a stable order."""
+    if os.path.isfile(doc_path):
+        if doc_path.lower().endswith(extensions):
+            yield os.path.abspath(doc_path)
+        return
+
+    for root, dirs, files in os.walk(doc_path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for filename in sorted(files):
+            if filename.lower().endswith(extensions):
+                yield os.path.abspath(os.path.join(root, filename))
+
+
+class TextFile:
+    """A text document that is read in blocks instead of all at once.
+
+    Constructing one streams the file once to hash its text. chunk_text()
+    streams it again, so neither pass holds the whole file.
+    """
+
+    def __init__(self, path: str, block_chars: int = TEXT_BLOCK_CHARS):
+        self.path = path
+        self.block_chars = block_chars
+        digest = hashlib.sha256()
+        for block in self.blocks():
+            digest.update(block.encode('utf-8'))
+        # Same value as content_hash() of the whole text
+        self.sha256 = digest.hexdigest()
+
+    def blocks(self) -> Iterator[str]:
+        with open(self.path, 'r', encoding='utf-8', errors='replace') as f:
+            while True:
+                block = f.read(self.block_chars)
+                if not block:
+                    return
+                yield block
+
+
+def extract_pdf_text(path: str) -> str:
+    """Extract the text of every page of a PDF. Runs inside a worker process."""
+    import pdfplumber
+
+    pages = []
+    with pdfplumber.open(path) as pdf:
+        for page in pdf.pages:
+            pages.append(page.extract_text() or '')
+            # pdfplumber caches layout objects per page; drop them as we go
+            page.flush_cache()
+    return '\n\n'.join(pages)
+
+
+def extract_texts(paths: Iterable[str], max_workers: Optional[int] = None) -> Iterator[Tuple[str, Optional[str]]]:
+    """Yield (path, text) pairs in input order.
+
+    Plain text files are yielded as TextFile objects, hashed but not held
+    in memory; PDFs are parsed to a str in a process pool. At most
+    max_workers * 2 PDFs are in flight so memory stays bounded no matter how
+    many files are queued. A file that cannot be read yields None as text.
+    """
+    max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+    executor = None
+    pending = deque()
+
+    def drain(limit):
+        while len(pending) > limit:
+            path, future = pending.popleft()
+            try:
+                text = future.result() if future is not None else TextFile(path)
+            except Exception as e:
+                print(f"Error extracting text from {path}: {e}")
+                text = None
+            yield path, text
+
+    try:
+        for path in paths:
+            if path.lower().endswith(PDF_EXTENSIONS):
+                if executor is None:
+                    # forkserver avoids forking the gRPC/uvicorn threads of the parent
+                    methods = multiprocessing.get_all_start_methods()
+                    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else None)
+                    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+                pending.append((path, executor.submit(extract_pdf_text, path)))
+            else:
+                pending.append((path, None))
+            yield from drain(max_workers * 2)
+        yield from drain(0)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _token_spans(text: str, tokenizer=None) -> List[Tuple[int, int]]:
+    """Character spans of the tokens in text, using the model tokenizer when available."""
+    if tokenizer is not None:
+        try:
+            encoded = tokenizer(
+                text,
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+                return_attention_mask=False,
+                verbose=False,
+            )
+            return [tuple(span) for span in encoded['offset_mapping'] if span[1] > span[0]]
+        except Exception as e:
+            print(f"Tokenizer offsets unavailable, falling back to whitespace tokens: {e}")
+    return [m.span() for m in _WORD_RE.finditer(text)]
+
+
+def _complete_words(text: str) -> int:
+    """Length of text up to its last whitespace; the word after it may continue in the next block."""
+    end = len(text)
+    while end > 0 and not text[end - 1].isspace():
+        end -= 1
+    return end
+
+
+def chunk_text(text: Union[str, TextFile], source: str, tokenizer=None, chunk_tokens: int = 256,
+               overlap_tokens: int = 32) -> Iterator[DocumentChunk]:
+    """Split text into overlapping windows of at most chunk_tokens tokens.
+
+    Windows are cut on token boundaries and mapped back to character offsets,
+    so every chunk is a verbatim slice of the source text. A TextFile is
+    tokenized a block at a time; between blocks only the text from the
+    start of the next window is kept, so memory is bounded by the block
+    size rather than the file size.
+    """
+    if overlap_tokens >= chunk_tokens:
+        raise ValueError("overlap_tokens must be smaller than chunk_tokens")
+
+    step = chunk_tokens - overlap_tokens
+    blocks = text.blocks() if isinstance(text, TextFile) else iter([text])
+    buffer, base, chunk_index = '', 0, 0
+    while True:
+        block = next(blocks, None)
+        if block is not None:
+            buffer += block
+            end = _complete_words(buffer)
+            if end == 0 and len(buffer) < 4 * TEXT_BLOCK_CHARS:
+                continue
+            spans = _token_spans(buffer[:end or len(buffer)], tokenizer)
+            if len(spans) < chunk_tokens:
+                continue
+            # Emit the windows that are complete; the next one starts at resume
+            starts = range(0, len(spans) - chunk_tokens + 1, step)
+        else:
+            spans = _token_spans(buffer, tokenizer)
+            if chunk_index and len(spans) <= overlap_tokens:
+                # Already covered by the overlap of the last emitted window
+                return
+            starts = range(0, len(spans), step)
+
+        for start_token in starts:
+            window = spans[start_token:start_token + chunk_tokens]
+            start, end = window[0][0], window[-1][1]
+            chunk = buffer[start:end].strip()
+            if chunk:
+                yield DocumentChunk(chunk, source, chunk_index, base + start, base + end)
+                chunk_index += 1
+            if start_token + chunk_tokens >= len(spans):
+                break
+        if block is None:
+            return
+        next_start = starts[-1] + step
+        # Without overlap the next window can start past the last complete
+        # token; then no token is carried over, only the unfinished tail
+        resume = spans[next_start][0] if next_start < len(spans) else spans[-1][1]
+        buffer, base = buffer[resume:], base + resume
+
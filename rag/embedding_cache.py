@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+class EmbeddingCache:
+    """Persistent embedding cache keyed by (model name, normalized text hash).
+
+    Vectors live in a fixed-capacity memory-mapped matrix on disk. A second
+    memory-mapped array stores, per row, the key digest the row holds and a
+    write sequence number. Rows are recycled in LRU order once the cache is
+    full, so disk and page-cache usage stay bounded.
+
+    A row's key tag is written together with its vector and checked on
+    every read, so a crash can lose recent entries but never return one
+    text's vector for another. The key map is rebuilt from the tags on
+    load, and flush() only writes back dirty pages; there is no index
+    file to rewrite.
+    """
+
+    ROW_DTYPE = np.dtype([('key', np.uint8, (32,)), ('seq', '<u8')])
+
+    def __init__(self, cache_dir: str, model_name: str, capacity: int = 200_000,
+                 dtype: str = 'float16', flush_every: int = 1024):
+        if dtype not in ('float16', 'float32'):
+            raise ValueError("dtype must be 'float16' or 'float32'")
+        self.model_name = model_name
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.flush_every = flush_every
+
+        safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name)
+        self.cache_dir = os.path.join(cache_dir, safe_name)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._vectors_path = os.path.join(self.cache_dir, f'vectors.{self.dtype.name}')
+        self._rows_path = os.path.join(self.cache_dir, 'rows.bin')
+        self._layout_path = os.path.join(self.cache_dir, 'layout.json')
+
+        self._lock = threading.Lock()
+        self._slots: "OrderedDict[str, int]" = OrderedDict()  # key -> row, oldest first
+        self._free_slots: List[int] = []
+        self._vectors: Optional[np.memmap] = None
+        self._rows: Optional[np.memmap] = None
+        self._seq = 0
+        self.dimension: Optional[int] = None
+        self._dirty = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._load()
+
+    def make_key(self, text: str) -> str:
+        payload = f"{self.model_name}\0{normalize_text(text)}".encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()
+
+    def get_many(self, texts: List[str]) -> Tuple[List[Optional[np.ndarray]], List[int]]:
+        """Look up texts; returns per-text vectors (None on miss) and the miss positions."""
+        keys = [self.make_key(t) for t in texts]
+        results: List[Optional[np.ndarray]] = [None] * len(texts)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                slot = self._slots.get(key)
+                if slot is not None and self._vectors is not None and \
+                        self._rows['key'][slot].tobytes() != bytes.fromhex(key):
+                    # The row was rewritten for another key; never serve it
+                    del self._slots[key]
+                    slot = None
+                if slot is None or self._vectors is None:
+                    missing.append(i)
+                    continue
+                self._slots.move_to_end(key)
+                results[i] = np.array(self._vectors[slot], dtype=np.float32)
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        return results, missing
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        results, _ = self.get_many([text])
+        return results[0]
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        with self._lock:
+            if self._vectors is None or self.dimension != vectors.shape[1]:
+                self._open_matrix(vectors.shape[1], reset=True)
+            for text, vector in zip(texts, vectors):
+                key = self.make_key(text)
+                slot = self._slots.get(key)
+                if slot is None:
+                    slot = self._allocate_slot()
+                self._slots[key] = slot
+                self._slots.move_to_end(key)
+                # Untag the row while its vector changes, then tag it with the new key
+                self._rows['key'][slot] = 0
+                self._vectors[slot] = vector.astype(self.dtype)
+                self._seq += 1
+                self._rows[slot] = (np.frombuffer(bytes.fromhex(key), dtype=np.uint8), self._seq)
+            self._dirty += len(texts)
+            should_flush = self._dirty >= self.flush_every
+        if should_flush:
+            self.flush()
+
+    def put(self, text: str, vector: np.ndarray):
+        self.put_many([text], vector)
+
+    def flush(self):
+        """Write dirty vector and tag pages to disk."""
+        with self._lock:
+            if self._vectors is None:
+                return
+            self._vectors.flush()
+            self._rows.flush()
+            self._dirty = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._slots),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'bytes': self.capacity * (self.dimension or 0) * self.dtype.itemsize,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._slots.clear()
+            self._free_slots = list(range(self.capacity - 1, -1, -1))
+            if self._rows is not None:
+                self._rows['key'][:] = 0
+            self._dirty += 1
+
+    def _allocate_slot(self) -> int:
+        if self._free_slots:
+            return self._free_slots.pop()
+        _, slot = self._slots.popitem(last=False)
+        self.evictions += 1
+        return slot
+
+    def _open_matrix(self, dimension: int, reset: bool = False):
+        mode = 'w+' if reset or not os.path.exists(self._vectors_path) else 'r+'
+        self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode=mode,
+                                  shape=(self.capacity, dimension))
+        self._rows = np.memmap(self._rows_path, dtype=self.ROW_DTYPE, mode=mode, shape=(self.capacity,))
+        self.dimension = dimension
+        if reset:
+            self._slots.clear()
+            self._free_slots = list(range(self.capacity - 1, -1, -1))
+            self._seq = 0
+            tmp_path = self._layout_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'model_name': self.model_name, 'dimension': dimension,
+                           'dtype': self.dtype.name, 'capacity': self.capacity}, f)
+            os.replace(tmp_path, self._layout_path)
+
+    def _load(self):
+        self._free_slots = list(range(self.capacity - 1, -1, -1))
+        if not all(os.path.exists(p) for p in (self._layout_path, self._vectors_path, self._rows_path)):
+            return
+        try:
+            with open(self._layout_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if (data.get('model_name') != self.model_name or data.get('dtype') != self.dtype.name
+                    or data.get('capacity') != self.capacity):
+                print(f"Embedding cache at {self.cache_dir} has a different layout, starting empty")
+                return
+            self._open_matrix(data['dimension'])
+            # Tagged rows, least recently written first, rebuild the LRU order
+            tagged = np.flatnonzero(self._rows['key'].any(axis=1))
+            order = tagged[np.argsort(self._rows['seq'][tagged], kind='stable')]
+            self._slots = OrderedDict((self._rows['key'][slot].tobytes().hex(), int(slot)) for slot in order)
+            self._seq = int(self._rows['seq'][tagged].max()) if len(tagged) else 0
+            used = set(self._slots.values())
+            self._free_slots = [s for s in range(self.capacity - 1, -1, -1) if s not in used]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading embedding cache from {self.cache_dir}: {e}")
+            self._vectors = None
+            self._rows = None
+            self.dimension = None
+            self._slots.clear()
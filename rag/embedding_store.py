@@ -0,0 +1,162 @@
+import os
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+STORE_DTYPES = ('float32', 'float16', 'int8')
+
+
+class EmbeddingStore:
+    """Contiguous, optionally quantized matrix of chunk embeddings.
+
+    Rows are kept densely packed (a removal moves the last row into the
+    hole) with an id -> row map alongside. float16 halves memory; int8 uses
+    symmetric per-dimension scales and quarters it. Until train_size rows
+    have been added an int8 store keeps float32 rows; the scales are then
+    fitted on all of them and the matrix re-encoded, so they do not depend
+    on whatever the first batch happened to be. get() always returns
+    dequantized float32 rows, for reconstruction and exact re-ranking of
+    FAISS candidates.
+    """
+
+    def __init__(self, dtype: str = 'float32', initial_capacity: int = 1024,
+                 scale_headroom: float = 1.1, train_size: int = 1024):
+        if dtype not in STORE_DTYPES:
+            raise ValueError(f"dtype must be one of {STORE_DTYPES}")
+        self.dtype = np.dtype(dtype)
+        self.dimension: Optional[int] = None
+        self.scale_headroom = scale_headroom
+        self.train_size = train_size
+        self._initial_capacity = initial_capacity
+        self._matrix: Optional[np.ndarray] = None
+        self._scale: Optional[np.ndarray] = None
+        self._row_ids: List[int] = []
+        self._rows: Dict[int, int] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, chunk_id: int):
+        return chunk_id in self._rows
+
+    def add(self, ids: List[int], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        with self._lock:
+            if self._matrix is None:
+                self._init_matrix(vectors)
+            encoded = self._quantize(vectors)
+            for chunk_id, row_values in zip(ids, encoded):
+                row = self._rows.get(chunk_id)
+                if row is None:
+                    row = len(self._row_ids)
+                    self._grow_to(row + 1)
+                    self._rows[chunk_id] = row
+                    self._row_ids.append(chunk_id)
+                self._matrix[row] = row_values
+            if self.dtype == np.int8 and self._scale is None and len(self._row_ids) >= self.train_size:
+                self._fit_scale()
+
+    def remove(self, ids: Iterable[int]):
+        with self._lock:
+            for chunk_id in ids:
+                row = self._rows.pop(chunk_id, None)
+                if row is None:
+                    continue
+                last = len(self._row_ids) - 1
+                last_id = self._row_ids.pop()
+                if row != last:
+                    self._matrix[row] = self._matrix[last]
+                    self._row_ids[row] = last_id
+                    self._rows[last_id] = row
+
+    def get(self, ids: List[int]) -> np.ndarray:
+        """Dequantized float32 rows for ids, in order; missing ids raise KeyError."""
+        with self._lock:
+            if not ids:
+                return np.empty((0, self.dimension or 0), dtype=np.float32)
+            rows = [self._rows[chunk_id] for chunk_id in ids]
+            return self._dequantize(self._matrix[rows])
+
+    def rerank(self, query: np.ndarray, ids: List[int], top_k: int) -> List[int]:
+        """Reorder candidate ids by exact L2 distance to query using the stored vectors."""
+        ids = [i for i in ids if i in self._rows]
+        if not ids:
+            return []
+        vectors = self.get(ids)
+        distances = np.sum((vectors - np.asarray(query, dtype=np.float32).reshape(1, -1)) ** 2, axis=1)
+        order = np.argsort(distances, kind='stable')[:top_k]
+        return [ids[i] for i in order]
+
+    def save(self, directory: str):
+        """Write the packed rows, their ids and the int8 scale as .npy files."""
+        with self._lock:
+            n = len(self._row_ids)
+            matrix = self._matrix[:n] if self._matrix is not None else np.zeros((0, 0), dtype=self.dtype)
+            np.save(os.path.join(directory, 'vectors.npy'), matrix)
+            np.save(os.path.join(directory, 'vector_ids.npy'), np.asarray(self._row_ids, dtype=np.int64))
+            if self._scale is not None:
+                np.save(os.path.join(directory, 'vector_scale.npy'), self._scale)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> 'EmbeddingStore':
+        """Store over files written by save(); with mmap the rows stay in the
+        page cache, shared by every process that maps them, and must not be
+        modified."""
+        matrix = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r' if mmap else None)
+        ids = np.load(os.path.join(directory, 'vector_ids.npy'))
+        scale_path = os.path.join(directory, 'vector_scale.npy')
+        # An int8 store saved before its scales were fitted holds float32 rows
+        store = cls('int8' if os.path.exists(scale_path) else matrix.dtype.name)
+        if len(ids):
+            store.dimension = matrix.shape[1]
+            store._matrix = matrix
+        if os.path.exists(scale_path):
+            store._scale = np.load(scale_path)
+        store._row_ids = ids.tolist()
+        store._rows = {chunk_id: row for row, chunk_id in enumerate(store._row_ids)}
+        return store
+
+    def memory_bytes(self) -> int:
+        with self._lock:
+            matrix = self._matrix.nbytes if self._matrix is not None else 0
+            scale = self._scale.nbytes if self._scale is not None else 0
+            return matrix + scale
+
+    def _init_matrix(self, sample: np.ndarray):
+        self.dimension = sample.shape[1]
+        # int8 rows stay float32 until the scales are fitted
+        dtype = np.float32 if self.dtype == np.int8 else self.dtype
+        self._matrix = np.zeros((self._initial_capacity, self.dimension), dtype=dtype)
+
+    def _fit_scale(self):
+        """Fit the int8 scales on every row so far and re-encode the matrix."""
+        rows = self._matrix[:len(self._row_ids)]
+        # Symmetric per-dimension scale with headroom; later outliers are clipped
+        max_abs = np.abs(rows).max(axis=0) * self.scale_headroom
+        self._scale = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+        matrix = np.zeros(self._matrix.shape, dtype=np.int8)
+        matrix[:len(rows)] = self._quantize(rows)
+        self._matrix = matrix
+
+    def _grow_to(self, rows: int):
+        if rows <= len(self._matrix):
+            return
+        grown = np.zeros((max(rows, len(self._matrix) * 2), self.dimension), dtype=self._matrix.dtype)
+        grown[:len(self._matrix)] = self._matrix
+        self._matrix = grown
+
+    def _quantize(self, vectors: np.ndarray) -> np.ndarray:
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(f"Expected dimension {self.dimension}, got {vectors.shape[1]}")
+        if self.dtype == np.int8 and self._scale is not None:
+            return np.clip(np.rint(vectors / self._scale), -127, 127).astype(np.int8)
+        return vectors.astype(self._matrix.dtype)
+
+    def _dequantize(self, rows: np.ndarray) -> np.ndarray:
+        if self._scale is not None:
+            return rows.astype(np.float32) * self._scale
+        return rows.astype(np.float32)
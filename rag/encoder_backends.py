@@ -0,0 +1,241 @@
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+ENCODER_BACKENDS = ('torch', 'torch-int8', 'onnx', 'onnx-int8')
+
+# Minimum cosine similarity to the float32 PyTorch reference for a backend
+# to be used; int8 weights are allowed slightly more drift.
+PARITY_THRESHOLDS = {'torch-int8': 0.98, 'onnx': 0.999, 'onnx-int8': 0.98}
+
+PARITY_SENTENCES = [
+    "What is the capital of France?",
+    "Paris is the capital and most populous city of France.",
+    "The mitochondria is the powerhouse of the cell.",
+    "How do I reset my password if I no longer have access to my email?",
+    "Raft is a consensus algorithm designed to be easy to understand.",
+    "ERR-4012: connection refused by upstream service",
+    "a",
+    "The quick brown fox jumps over the lazy dog. " * 20,
+]
+
+
+def check_parity(encoder, reference: np.ndarray, sentences: List[str] = PARITY_SENTENCES,
+                 min_cosine: float = 0.99) -> Dict[str, float]:
+    """Compare encoder output against reference embeddings of the same sentences.
+
+    Raises ValueError if any sentence falls below min_cosine.
+    """
+    candidate = np.asarray(encoder.encode(sentences), dtype=np.float32)
+    reference = np.asarray(reference, dtype=np.float32)
+    cosine = np.sum(candidate * reference, axis=1) / (
+        np.linalg.norm(candidate, axis=1) * np.linalg.norm(reference, axis=1) + 1e-12)
+    stats = {'min_cosine': float(cosine.min()), 'mean_cosine': float(cosine.mean())}
+    if stats['min_cosine'] < min_cosine:
+        raise ValueError(f"Encoder parity check failed: min cosine {stats['min_cosine']:.4f} < {min_cosine}")
+    return stats
+
+
+class TorchEncoder:
+    """SentenceTransformer on CPU, optionally with dynamically int8-quantized Linear layers."""
+
+    def __init__(self, model_name: str, quantize: bool = False, num_threads: Optional[int] = None,
+                 max_seq_length: Optional[int] = None, parity_check: bool = True):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        self._torch = torch
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model = SentenceTransformer(model_name, device='cpu')
+        if max_seq_length:
+            self.model.max_seq_length = max_seq_length
+        self.tokenizer = self.model.tokenizer
+        self.parity: Optional[Dict[str, float]] = None
+        if quantize:
+            reference = self.encode(PARITY_SENTENCES) if parity_check else None
+            self.model = torch.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+            if parity_check:
+                self.parity = check_parity(self, reference, min_cosine=PARITY_THRESHOLDS['torch-int8'])
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts, batch_size: int = 32, **kwargs) -> np.ndarray:
+        # SentenceTransformer already sorts by length and pads each batch to its longest text
+        with self._torch.inference_mode():
+            embeddings = self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True,
+                                           show_progress_bar=False)
+        return np.asarray(embeddings, dtype=np.float32)
+
+
+class OnnxEncoder:
+    """ONNX Runtime session over an exported transformer, with pooling done in numpy.
+
+    Texts are sorted by length and each batch is padded only to its own
+    longest sequence, so short queries never pay for max_seq_length.
+    """
+
+    def __init__(self, export_dir: str, quantized: bool = False, num_threads: Optional[int] = None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(export_dir, 'encoder.json'), 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        self.max_seq_length = self.config['max_seq_length']
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = num_threads or os.cpu_count() or 1
+        options.inter_op_num_threads = 1
+        self.model_path = os.path.join(export_dir, 'model_int8.onnx' if quantized else 'model.onnx')
+        self.session = ort.InferenceSession(self.model_path, options,
+                                            providers=['CPUExecutionProvider'])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config['dimension']
+
+    def encode(self, texts, batch_size: int = 32, **kwargs) -> np.ndarray:
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        order = np.argsort([-len(t) for t in texts], kind='stable')
+        output = np.empty((len(texts), self.config['dimension']), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            encoded = self.tokenizer([texts[i] for i in rows], padding='longest', truncation=True,
+                                     max_length=self.max_seq_length, return_tensors='np')
+            feeds = {name: value.astype(np.int64) for name, value in encoded.items() if name in self._input_names}
+            token_embeddings = self.session.run(None, feeds)[0]
+            output[rows] = self._pool(token_embeddings, encoded['attention_mask'])
+        return output[0] if single else output
+
+    def _pool(self, token_embeddings: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self.config['pooling'] == 'cls':
+            pooled = token_embeddings[:, 0]
+        else:
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.config['normalize']:
+            pooled = pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return pooled.astype(np.float32, copy=False)
+
+
+def default_export_dir(model_name: str) -> str:
+    root = os.environ.get('RAG_ENCODER_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'rag-encoders'))
+    return os.path.join(root, re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name))
+
+
+def export_onnx(model_name: str, export_dir: str, opset: int = 14) -> Dict[str, Any]:
+    """Export a SentenceTransformer to ONNX (float32 and dynamic int8).
+
+    Needs torch once, at export time. Parity of both variants against the
+    PyTorch model is measured and recorded in encoder.json; load_encoder
+    refuses a variant whose parity check failed.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device='cpu')
+    modules = list(model)
+    module_types = [type(m).__name__ for m in modules]
+    if module_types[:2] != ['Transformer', 'Pooling'] or set(module_types[2:]) - {'Normalize'}:
+        raise ValueError(f"Unsupported module layout for ONNX export: {module_types}")
+    pooling = modules[1]
+    if getattr(pooling, 'pooling_mode_cls_token', False):
+        pooling_mode = 'cls'
+    elif getattr(pooling, 'pooling_mode_mean_tokens', False):
+        pooling_mode = 'mean'
+    else:
+        raise ValueError("Only mean and CLS pooling can be exported")
+
+    os.makedirs(export_dir, exist_ok=True)
+    transformer = modules[0].auto_model.eval()
+    sample = model.tokenizer(["export sample"], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+
+    class _TokenEmbeddings(torch.nn.Module):
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, *inputs):
+            return self.inner(**dict(zip(input_names, inputs))).last_hidden_state
+
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names + ['token_embeddings']}
+    fp32_path = os.path.join(export_dir, 'model.onnx')
+    with torch.inference_mode():
+        torch.onnx.export(_TokenEmbeddings(transformer), tuple(sample[name] for name in input_names), fp32_path,
+                          input_names=input_names, output_names=['token_embeddings'],
+                          dynamic_axes=dynamic_axes, opset_version=opset)
+    quantize_dynamic(fp32_path, os.path.join(export_dir, 'model_int8.onnx'), weight_type=QuantType.QInt8)
+    model.tokenizer.save_pretrained(export_dir)
+
+    config = {
+        'model_name': model_name,
+        'dimension': model.get_sentence_embedding_dimension(),
+        'max_seq_length': model.max_seq_length,
+        'pooling': pooling_mode,
+        'normalize': 'Normalize' in module_types,
+        'parity': {},
+    }
+    with open(os.path.join(export_dir, 'encoder.json'), 'w', encoding='utf-8') as f:
+        json.dump(config, f)
+
+    reference = model.encode(PARITY_SENTENCES, convert_to_numpy=True, show_progress_bar=False)
+    for backend, quantized in (('onnx', False), ('onnx-int8', True)):
+        try:
+            config['parity'][backend] = check_parity(OnnxEncoder(export_dir, quantized),
+                                                     reference, min_cosine=PARITY_THRESHOLDS[backend])
+        except ValueError as e:
+            config['parity'][backend] = {'error': str(e)}
+    with open(os.path.join(export_dir, 'encoder.json'), 'w', encoding='utf-8') as f:
+        json.dump(config, f)
+    return config
+
+
+def load_encoder(model_name: str, backend: Optional[str] = None, num_threads: Optional[int] = None,
+                 export_dir: Optional[str] = None, max_seq_length: Optional[int] = None):
+    """Load an embedding model with the requested CPU backend.
+
+    backend defaults to $RAG_ENCODER_BACKEND (else 'torch') and num_threads
+    to $RAG_ENCODER_THREADS. ONNX backends export the model on first use.
+    Any backend that cannot load or fails its parity check falls back to
+    plain PyTorch. Every backend exposes encode(), tokenizer and
+    get_sentence_embedding_dimension() like SentenceTransformer.
+    """
+    backend = backend or os.environ.get('RAG_ENCODER_BACKEND', 'torch')
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend {backend!r}, expected one of {ENCODER_BACKENDS}")
+    if num_threads is None and os.environ.get('RAG_ENCODER_THREADS'):
+        num_threads = int(os.environ['RAG_ENCODER_THREADS'])
+
+    try:
+        if backend == 'torch-int8':
+            return TorchEncoder(model_name, quantize=True, num_threads=num_threads, max_seq_length=max_seq_length)
+        if backend in ('onnx', 'onnx-int8'):
+            export_dir = export_dir or default_export_dir(model_name)
+            config_path = os.path.join(export_dir, 'encoder.json')
+            if os.path.exists(config_path):
+                with open(config_path, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+            else:
+                print(f"Exporting {model_name} to ONNX in {export_dir}")
+                config = export_onnx(model_name, export_dir)
+            parity = config.get('parity', {}).get(backend, {})
+            if 'error' in parity:
+                raise ValueError(parity['error'])
+            encoder = OnnxEncoder(export_dir, quantized=backend == 'onnx-int8', num_threads=num_threads)
+            if max_seq_length:
+                encoder.max_seq_length = max_seq_length
+            return encoder
+    except Exception as e:
+        print(f"Encoder backend {backend} unavailable, falling back to torch: {e}")
+    return TorchEncoder(model_name, num_threads=num_threads, max_seq_length=max_seq_length)
@@ -1,19 +1,81 @@
 import numpy as np
 import time
 import threading
-from typing import List, Tuple, Any, Optional
+from typing import List, Tuple, Any, Optional, Dict, Iterator, Callable, Mapping
 import os
+import json
+import base64
+
+from index_manifest import IndexManifest, content_hash
+from embedding_cache import EmbeddingCache
+from model_registry import get_encoder
+from semantic_cache import cosine_similarity_matrix
+from ttl_cache import TTLCache
+from micro_batcher import MicroBatcher
+from metrics import stage_timer
+from lexical_index import LexicalIndex
+from embedding_store import EmbeddingStore
+from index_snapshot import MappedDocuments, read_manifest, write_manifest
+from metadata_store import MetadataStore, default_chunk_attributes
+from document_loader import DocumentChunk, TextFile, iter_document_files, extract_texts, chunk_text
+from tracing import tracer
 
 class FaissIndexer:
-    def __init__(self, embedding_model_name: str, doc_path: str, raft_node):
+    def __init__(self, embedding_model_name: str, doc_path: str, raft_node,
+                 index_dir: Optional[str] = None, chunk_tokens: int = 256,
+                 chunk_overlap: int = 32, embed_batch_size: int = 64,
+                 ingest_workers: Optional[int] = None,
+                 embedding_cache: Optional[EmbeddingCache] = None,
+                 query_batch_size: int = 32, query_batch_wait_ms: float = 5.0,
+                 index_quantization: str = 'none', store_dtype: str = 'float32',
+                 rerank_factor: int = 4, encoder_backend: Optional[str] = None,
+                 quantizer_train_size: int = 1024):
         self.embedding_model_name = embedding_model_name
+        self.encoder_backend = encoder_backend
         self.doc_path = doc_path
         self.raft_node = raft_node
+        self.index_dir = index_dir
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap = chunk_overlap
+        self.embed_batch_size = embed_batch_size
+        self.ingest_workers = ingest_workers
+        self.embedding_cache = embedding_cache
+        # Recent query embeddings, shared by the semantic cache and dense search
+        self._query_vectors = TTLCache(max_entries=4096, max_bytes=16 * 2**20, ttl=60.0,
+                                       size_fn=lambda v: v.nbytes)
+        self._search_batcher = MicroBatcher(self._search_coalesced, max_batch_size=query_batch_size,
+                                            max_wait_ms=query_batch_wait_ms, name="faiss-search")
         
         # Bug: FAISS index is never actually created
         self.index = None
-        self.documents = []
-        self.embeddings = []
+        # Chunk text and embeddings keyed by the vector id stored in the index
+        self.documents: Mapping[int, str] = {}
+        # Chunk attributes with per-value id bitmaps for filtered search
+        self.metadata_store = MetadataStore()
+        self.attribute_fn = default_chunk_attributes
+        self.index_quantization = index_quantization
+        self.rerank_factor = rerank_factor
+        # Vectors to collect before int8 ranges are fitted; search is exact until then
+        self.quantizer_train_size = quantizer_train_size
+        self.embeddings = EmbeddingStore(store_dtype, train_size=quantizer_train_size)
+        # BM25 index over the same chunk ids, maintained alongside FAISS
+        self.lexical_index = LexicalIndex()
+        self.index_version = 0
+        # Last Raft log index reflected in the index; None when unknown
+        self.applied_index: Optional[int] = 0
+        self._version_listeners: List[Callable[[int], None]] = []
+        # Set once serving from a memory-mapped snapshot; updates then belong to the coordinator
+        self.read_only = False
+        self.snapshot_dir: Optional[str] = None
+        self._next_id = 0
+        self._index_lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self.commit_timeout = 30.0
+        self._watcher_thread = None
+        self._watcher_stop = threading.Event()
+
+        manifest_path = os.path.join(index_dir, 'manifest.json') if index_dir else None
+        self.manifest = IndexManifest(manifest_path)
         
         # Bug: Memory leak - document cache grows indefinitely
         self._doc_cache = {}
@@ -27,22 +89,29 @@ class FaissIndexer:
         
         # Bug: Embedding model is not loaded
         self._embedding_model = None
+
+        if raft_node is not None and hasattr(raft_node, 'register_apply_callback'):
+            raft_node.register_apply_callback(self._on_raft_apply)
+        if raft_node is not None and hasattr(raft_node, 'register_snapshot_handlers'):
+            raft_node.register_snapshot_handlers(self.export_raft_snapshot, self.install_raft_snapshot)
         
     def create_faiss_index(self):
-        """Bug: This method doesn't actually create a FAISS index"""
+        """Create an ID-mapped FAISS index, restoring a saved one if present."""
         try:
-            # Bug: This will fail because FAISS is not imported
             import faiss
-            
-            # Bug: Index creation logic is flawed
-            dimension = 768  # Bug: Hardcoded dimension that might not match the model
-            
-            # Bug: Index type is inappropriate for the use case
-            self.index = faiss.IndexFlatL2(dimension)
-            
-            # Bug: No error handling if index creation fails
-            print(f"Created FAISS index with dimension {dimension}")
-            
+
+            loaded = False
+            if self.index_dir:
+                try:
+                    loaded = self._load_saved_index(self.index_dir)
+                except Exception as e:
+                    print(f"Error loading saved index from {self.index_dir}, rebuilding: {e}")
+                    self._reset_state()
+            if loaded:
+                print(f"Loaded FAISS index with {self.index.ntotal} vectors from {self.index_dir}")
+            else:
+                self._create_empty_index(faiss)
+
         except ImportError:
             # Bug: Silent failure - creates a mock index that won't work
             print("Warning: FAISS not available, using mock index")
@@ -51,72 +120,364 @@ class FaissIndexer:
             # Bug: Generic error handling masks specific issues
             print(f"Error creating FAISS index: {e}")
             self.index = MockIndex()
+        self._start_applying()
+
+    def _create_empty_index(self, faiss):
+        if self.index_dir and len(self.manifest):
+            # Without the saved index the manifest would mark every file unchanged
+            print(f"No usable saved index in {self.index_dir}; resetting the manifest")
+            self.manifest.clear()
+
+        dimension = 768  # Bug: Hardcoded dimension that might not match the model
+
+        # IndexIDMap2 keeps an id -> vector mapping so chunks can be
+        # removed and replaced individually on refresh.
+        self.index = faiss.IndexIDMap2(self._create_base_index(faiss, dimension))
+        self.applied_index = 0
+        print(f"Created FAISS index with dimension {dimension} ({self.index_quantization} quantization)")
+
+    def _reset_state(self):
+        """Forget every chunk, e.g. after a partial load."""
+        self.documents = {}
+        self.metadata_store = MetadataStore()
+        self.embeddings = EmbeddingStore(self.embeddings.dtype.name, train_size=self.quantizer_train_size)
+        self.lexical_index = LexicalIndex()
+
+    def _start_applying(self):
+        """Let the Raft node apply committed entries this index does not reflect yet.
+
+        A saved index records the last log entry it contains, so a restart
+        replays only what came after. If that position is unknown or past
+        the end of the node's log, the index is rebuilt from empty and the
+        whole log is replayed instead of being applied on top of it.
+        """
+        if self.raft_node is None or not hasattr(self.raft_node, 'start_applying'):
+            return
+        if self.applied_index is not None and self.raft_node.start_applying(self.applied_index):
+            return
+        print(f"Index does not match the Raft log (applied index {self.applied_index}); rebuilding it from the log")
+        with self._index_lock:
+            self._reset_state()
+            import faiss
+            self._create_empty_index(faiss)
+        self.raft_node.start_applying(0)
     
-    def add_documents_to_index(self, doc_path: str):
-        """Bug: This method has incorrect document processing logic"""
-        try:
-            # Bug: Path validation is missing
-            if not os.path.exists(doc_path):
-                print(f"Document path {doc_path} does not exist")
-                return
-            
-            # Bug: Document reading logic is flawed
-            documents = self._read_documents(doc_path)
-            
-            # Bug: No validation of document format
-            if not documents:
-                print("No documents found")
-                return
-            
-            # Bug: This will fail because embeddings are not generated
-            embeddings = self._generate_embeddings(documents)
-            
-            # Bug: Index update logic is incorrect
-            if self.index and embeddings:
-                # Bug: This assumes the index has an add method
+    def _create_base_index(self, faiss, dimension: int, trained: bool = False):
+        # int8 ranges need training data; until there is enough the index stays exact
+        if self.index_quantization == 'none' or (self.index_quantization == 'int8' and not trained):
+            return faiss.IndexFlatL2(dimension)
+        qtypes = {'fp16': faiss.ScalarQuantizer.QT_fp16, 'int8': faiss.ScalarQuantizer.QT_8bit}
+        if self.index_quantization not in qtypes:
+            raise ValueError(f"Unknown index quantization: {self.index_quantization}")
+        return faiss.IndexScalarQuantizer(dimension, qtypes[self.index_quantization], faiss.METRIC_L2)
+
+    def add_documents_to_index(self, doc_path: str) -> Dict[str, int]:
+        """Incrementally sync the index with the files under doc_path.
+
+        Unchanged files are skipped on a stat check, files with new content
+        only re-embed the chunks whose hash is not already indexed, and
+        vectors belonging to edited or deleted chunks are removed. Text is
+        extracted and chunked as a stream and embedded in fixed-size batches,
+        so memory does not grow with the size of the corpus.
+
+        With a Raft node attached only the leader may refresh. Each batch is
+        committed as an index_update log entry carrying its embeddings, and
+        every node (leader included) applies the entry when it commits.
+        """
+        stats = {'added': 0, 'removed': 0, 'unchanged_files': 0, 'changed_files': 0, 'deleted_files': 0}
+        self._check_writable()
+        if not os.path.exists(doc_path):
+            print(f"Document path {doc_path} does not exist")
+            return stats
+        if self._replicated() and not self.raft_node.is_leader():
+            raise Exception("Not the leader; index updates must go through the leader")
+
+        with self._refresh_lock:
+            seen = set()
+            candidates: Dict[str, os.stat_result] = {}
+            for path in iter_document_files(doc_path):
+                seen.add(path)
                 try:
-                    self.index.add(embeddings)
-                    self.documents.extend(documents)
-                    self.embeddings.extend(embeddings)
-                except AttributeError:
-                    # Bug: Silent failure - index is not updated
-                    print("Warning: Index does not support add operation")
-            
-        except Exception as e:
-            # Bug: Generic exception handling masks specific issues
-            print(f"Error adding documents to index: {e}")
+                    stat = os.stat(path)
+                except OSError as e:
+                    print(f"Error reading {path}: {e}")
+                    continue
+                if self.manifest.is_unchanged(path, stat.st_mtime, stat.st_size):
+                    stats['unchanged_files'] += 1
+                else:
+                    candidates[path] = stat
+
+            deleted_paths = [p for p in self.manifest.paths_under(doc_path) if p not in seen]
+            deleted_ids: List[int] = []
+            for path in deleted_paths:
+                deleted_ids.extend(chunk_id for _, chunk_id in self.manifest.get(path)['chunks'])
+            stats['deleted_files'] = len(deleted_paths)
+
+            stale_ids: List[int] = []
+            added_ids: List[int] = []
+            manifest_updates = []
+            batch: List[Tuple[int, DocumentChunk, Dict[str, Any]]] = []
+            tokenizer = self._get_tokenizer() if candidates else None
+
+            def flush():
+                self._commit_update(self._encode_additions(batch))
+                added_ids.extend(chunk_id for chunk_id, _, _ in batch)
+                batch.clear()
+
+            try:
+                for path, content in extract_texts(list(candidates), self.ingest_workers):
+                    if content is None:
+                        continue
+                    stat = candidates[path]
+                    digest = content.sha256 if isinstance(content, TextFile) else content_hash(content)
+                    entry = self.manifest.get(path)
+                    if entry and entry['sha256'] == digest:
+                        manifest_updates.append((path, stat.st_mtime, stat.st_size, digest, entry['chunks']))
+                        stats['unchanged_files'] += 1
+                        continue
+
+                    attributes = self.attribute_fn(path, stat, doc_path)
+
+                    # Reuse vector ids for chunks that are already indexed
+                    previous: Dict[str, List[int]] = {}
+                    for chunk_digest, chunk_id in (entry['chunks'] if entry else []):
+                        previous.setdefault(chunk_digest, []).append(chunk_id)
+
+                    chunks = []
+                    for chunk in chunk_text(content, path, tokenizer, self.chunk_tokens, self.chunk_overlap):
+                        chunk_digest = content_hash(chunk.text)
+                        if previous.get(chunk_digest):
+                            chunks.append((chunk_digest, previous[chunk_digest].pop()))
+                            continue
+                        chunk_id = self._allocate_id()
+                        chunks.append((chunk_digest, chunk_id))
+                        batch.append((chunk_id, chunk, attributes))
+                        if len(batch) >= self.embed_batch_size:
+                            flush()
+
+                    stale_ids.extend(i for ids in previous.values() for i in ids)
+                    manifest_updates.append((path, stat.st_mtime, stat.st_size, digest, chunks))
+                    stats['changed_files'] += 1
+                if batch:
+                    flush()
+            except Exception as e:
+                # Roll back this refresh's vectors; changed files keep their
+                # old manifest entries so the next refresh retries them
+                print(f"Error indexing documents, refresh aborted: {e}")
+                try:
+                    self._commit_update({'remove': added_ids + deleted_ids,
+                                         'manifest_remove': deleted_paths})
+                    stats['removed'] = len(deleted_ids)
+                except Exception as rollback_error:
+                    print(f"Error rolling back aborted refresh: {rollback_error}")
+                return stats
+
+            stats['added'] = len(added_ids)
+            stats['removed'] = len(stale_ids) + len(deleted_ids)
+            if manifest_updates or deleted_paths:
+                self._commit_update({
+                    'remove': stale_ids + deleted_ids,
+                    'manifest_update': manifest_updates,
+                    'manifest_remove': deleted_paths,
+                })
+
+        print(f"Index refresh for {doc_path}: {stats}")
+        return stats
+
+    def remove_documents(self, doc_path: str) -> int:
+        """Remove every indexed chunk that came from files under doc_path."""
+        self._check_writable()
+        if self._replicated() and not self.raft_node.is_leader():
+            raise Exception("Not the leader; index updates must go through the leader")
+        with self._refresh_lock:
+            paths = self.manifest.paths_under(doc_path)
+            stale_ids = [chunk_id for p in paths for _, chunk_id in self.manifest.get(p)['chunks']]
+            if paths:
+                self._commit_update({'remove': stale_ids, 'manifest_remove': paths})
+            return len(stale_ids)
+
+    def apply_index_update(self, update: Dict[str, Any]):
+        """Apply one index mutation, either locally or from a committed Raft entry."""
+        self._check_writable()
+        with self._index_lock:
+            removed = self._remove_ids(update.get('remove', []))
+            self.lexical_index.remove(update.get('remove', []))
+
+            added = 0
+            if update.get('add_ids'):
+                ids = update['add_ids']
+                vectors = np.frombuffer(base64.b64decode(update['embeddings']), dtype=np.float32)
+                vectors = vectors.reshape(len(ids), -1)
+                if self._awaiting_quantizer() and self.index.ntotal + len(ids) >= self.quantizer_train_size:
+                    self._train_quantizer(ids, vectors)
+                else:
+                    self.index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+                self.embeddings.add(ids, vectors)
+                for chunk_id, text, metadata in zip(ids, update['texts'], update['metadata']):
+                    self.documents[chunk_id] = text
+                    self.metadata_store.add(chunk_id, metadata)
+                self.lexical_index.add_many(zip(ids, update['texts']))
+                self._next_id = max(self._next_id, max(ids) + 1)
+                added = len(ids)
+
+            for manifest_entry in update.get('manifest_update', []):
+                self.manifest.update(*manifest_entry)
+            for path in update.get('manifest_remove', []):
+                self.manifest.remove(path)
+
+            if added or removed:
+                self.index_version += 1
+            if 'manifest_update' in update or 'manifest_remove' in update:
+                self.save_index()
+            version = self.index_version if added or removed else None
+
+        if version is not None:
+            for listener in self._version_listeners:
+                listener(version)
+
+    def add_version_listener(self, listener: Callable[[int], None]):
+        """Call listener(index_version) after every update that changes the index."""
+        self._version_listeners.append(listener)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise Exception("Index is a read-only snapshot; updates go through the coordinator")
+
+    def export_snapshot(self, directory: str) -> int:
+        """Write a self-contained copy of the index and chunk store for
+        open_snapshot(); returns the index version it captures."""
+        import faiss
+        with self._index_lock:
+            if isinstance(self.index, MockIndex):
+                raise Exception("No FAISS index to snapshot")
+            faiss.write_index(self.index, os.path.join(directory, 'index.faiss'))
+            MappedDocuments.write(directory, self.documents)
+            self.embeddings.save(directory)
+            self.lexical_index.save(directory)
+            with open(os.path.join(directory, 'metadata.json'), 'w', encoding='utf-8') as f:
+                json.dump({str(k): v for k, v in self.metadata_store.items()}, f)
+            write_manifest(directory, {
+                'index_version': self.index_version,
+                'index_quantization': self.index_quantization,
+                'chunks': len(self.documents),
+                'created_at': time.time(),
+            })
+            return self.index_version
+
+    def open_snapshot(self, directory: str):
+        """Serve from a snapshot written by export_snapshot().
+
+        The FAISS codes, embeddings, chunk texts and BM25 postings are
+        memory-mapped, so processes serving the same snapshot share one copy
+        in the page cache. Everything is loaded before the swap; searches
+        already running finish on the previous snapshot. The indexer is
+        read-only from then on.
+        """
+        import faiss
+        flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        info = read_manifest(directory)
+        index = faiss.read_index(os.path.join(directory, 'index.faiss'), flags)
+        documents = MappedDocuments(directory)
+        embeddings = EmbeddingStore.load(directory)
+        lexical_index = LexicalIndex.load(directory)
+        metadata_store = MetadataStore()
+        with open(os.path.join(directory, 'metadata.json'), 'r', encoding='utf-8') as f:
+            for chunk_id, metadata in json.load(f).items():
+                metadata_store.add(int(chunk_id), metadata)
+        with self._index_lock:
+            self.index = index
+            self.documents = documents
+            self.embeddings = embeddings
+            self.lexical_index = lexical_index
+            self.metadata_store = metadata_store
+            self.index_quantization = info['index_quantization']
+            self.index_version = info['index_version']
+            self.read_only = True
+            self.snapshot_dir = directory
+
+    def export_raft_snapshot(self, directory: str) -> int:
+        """Write the saved-index files into directory for a Raft follower
+        whose log entries were compacted away; returns the log index they reflect."""
+        with self._index_lock:
+            if isinstance(self.index, MockIndex) or self.applied_index is None:
+                raise Exception("Index does not reflect a known Raft log position")
+            self._write_index_files(directory)
+            self.manifest.save(os.path.join(directory, 'manifest.json'))
+            return self.applied_index
+
+    def install_raft_snapshot(self, directory: str, index: int):
+        """Replace the index with the leader's export_raft_snapshot() at log index."""
+        with self._index_lock:
+            version = self.index_version
+            self._reset_state()
+            manifest = IndexManifest(os.path.join(directory, 'manifest.json'))
+            manifest.manifest_path = self.manifest.manifest_path
+            self.manifest = manifest
+            if not self._load_saved_index(directory):
+                raise Exception(f"Incomplete Raft snapshot in {directory}")
+            self.applied_index = index
+            # Cached results of the replaced index must not match the new one
+            self.index_version = max(self.index_version, version + 1)
+            self.save_index()
+            version = self.index_version
+
+        for listener in self._version_listeners:
+            listener(version)
+
+    def _replicated(self) -> bool:
+        return self.raft_node is not None and hasattr(self.raft_node, 'propose')
+
+    def _commit_update(self, update: Dict[str, Any]):
+        """Route a mutation through the Raft log when replicated, else apply it directly."""
+        if self._replicated():
+            with tracer.span('raft_commit') as span:
+                command = {'type': 'index_update', 'data': update}
+                # Each node's apply joins the proposer's trace
+                if span.sampled:
+                    command['traceparent'] = span.traceparent()
+                self.raft_node.apply_log(command, True, timeout=self.commit_timeout)
+        else:
+            self.apply_index_update(update)
+
+    def _on_raft_apply(self, index: int, command: Dict[str, Any]):
+        if command.get('type') == 'index_update':
+            with tracer.continue_trace('raft_apply', command.get('traceparent'), log_index=index):
+                with self._index_lock:
+                    # Saved with the index, so a restart resumes after this entry
+                    self.applied_index = index
+                    try:
+                        self.apply_index_update(command['data'])
+                    except Exception:
+                        # Partly applied: no later save may claim a log position
+                        self.applied_index = None
+                        raise
+
+    def _encode_additions(self, batch: List[Tuple[int, DocumentChunk, Dict[str, Any]]]) -> Dict[str, Any]:
+        """Embed a batch of chunks into a self-contained, JSON-serialisable update."""
+        embeddings = self._generate_embeddings([chunk.text for _, chunk, _ in batch])
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        return {
+            'add_ids': [chunk_id for chunk_id, _, _ in batch],
+            'texts': [chunk.text for _, chunk, _ in batch],
+            'metadata': [{**chunk.metadata(), **attributes} for _, chunk, attributes in batch],
+            'embeddings': base64.b64encode(vectors.tobytes()).decode('ascii'),
+        }
     
-    def search(self, query: str, top_k: int = 5) -> List[str]:
-        """Bug: This method has incorrect search logic"""
+    def search(self, query: str, top_k: int = 5,
+               filters: Optional[Dict[str, Any]] = None) -> List[str]:
+        """Return the top_k chunks for a query, optionally restricted by metadata filters.
+
+        Concurrent calls are coalesced by the search batcher, so queries that
+        arrive within a few milliseconds share one encode and one index.search.
+        """
         try:
             # Bug: Input validation is incomplete
             if not query or not isinstance(query, str):
                 return []
             
-            # Bug: Query embedding is not generated
-            query_embedding = self._generate_embedding(query)
-            
-            if query_embedding is None:
-                # Bug: Silent failure - returns empty results
-                return []
-            
-            # Bug: Search logic is flawed
             if self.index and hasattr(self.index, 'search'):
                 try:
-                    # Bug: This assumes the index returns results in the expected format
-                    distances, indices = self.index.search(query_embedding.reshape(1, -1), top_k)
-                    
-                    # Bug: Result processing is incorrect
-                    results = []
-                    for idx in indices[0]:
-                        if 0 <= idx < len(self.documents):
-                            results.append(self.documents[idx])
-                        else:
-                            # Bug: Index out of bounds handling is missing
-                            results.append(f"Document {idx} not found")
-                    
-                    return results
-                    
+                    return self.get_documents(self.search_ids(query, top_k, filters))
                 except Exception as e:
                     # Bug: Silent failure - errors are not logged
                     print(f"Search error: {e}")
@@ -129,77 +490,299 @@ class FaissIndexer:
             # Bug: Generic exception handling masks specific issues
             print(f"Error in search: {e}")
             return []
-    
-    def _read_documents(self, doc_path: str) -> List[str]:
-        """Bug: This method has incorrect document reading logic"""
-        try:
-            documents = []
-            
-            # Bug: Only handles text files, ignores other formats
-            if os.path.isfile(doc_path) and doc_path.endswith('.txt'):
-                with open(doc_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    # Bug: Simple splitting by newlines, no proper document parsing
-                    documents = [line.strip() for line in content.split('\n') if line.strip()]
-            elif os.path.isdir(doc_path):
-                # Bug: Recursive directory traversal is missing
-                for filename in os.listdir(doc_path):
-                    filepath = os.path.join(doc_path, filename)
-                    if filename.endswith('.txt'):
-                        try:
-                            with open(filepath, 'r', encoding='utf-8') as f:
-                                content = f.read()
-                                documents.append(content)
-                        except Exception as e:
-                            # Bug: Silent failure - file reading errors are ignored
-                            print(f"Error reading {filepath}: {e}")
-            
-            return documents
-            
-        except Exception as e:
-            # Bug: Generic exception handling masks specific issues
-            print(f"Error reading documents: {e}")
+
+    def search_ids(self, query: str, top_k: int = 5,
+                   filters: Optional[Dict[str, Any]] = None) -> List[int]:
+        """Dense search returning chunk ids, best first.
+
+        Unfiltered queries go through the search batcher. Filtered queries
+        push the allowed-id bitmap into FAISS via an IDSelector, so they
+        still return a full top_k instead of whatever survives a post-filter.
+        """
+        if not filters:
+            # The batcher thread is outside the trace; this span covers the wait for it
+            with tracer.span('search_batcher'):
+                return self._search_batcher((query, top_k))
+        bitmap = self.metadata_store.filter_bitmap(filters)
+        return self.search_batch_ids([query], top_k, bitmap=bitmap)[0]
+
+    def search_batch(self, queries: List[str], top_k: int = 5) -> List[List[str]]:
+        """Search many queries with one encode call and one matrix index.search."""
+        return [self.get_documents(ids) for ids in self.search_batch_ids(queries, top_k)]
+
+    def search_batch_ids(self, queries: List[str], top_k: int = 5,
+                         bitmap: Optional[np.ndarray] = None) -> List[List[int]]:
+        if not queries:
             return []
-    
-    def _generate_embeddings(self, documents: List[str]) -> List[np.ndarray]:
-        """Bug: This method doesn't actually generate embeddings"""
-        try:
-            # Bug: Embedding model is not loaded
-            if self._embedding_model is None:
-                # Bug: This will fail because the model is not available
-                from sentence_transformers import SentenceTransformer
-                self._embedding_model = SentenceTransformer(self.embedding_model_name)
-            
-            # Bug: This will fail if the model is not properly loaded
-            embeddings = []
-            for doc in documents:
+        if bitmap is not None and not bitmap.any():
+            return [[] for _ in queries]
+        return self.search_vectors_ids(self.embed_queries(queries), top_k, bitmap)
+
+    def search_vectors_ids(self, query_vectors: np.ndarray, top_k: int = 5,
+                           bitmap: Optional[np.ndarray] = None) -> List[List[int]]:
+        """Dense search for already-encoded queries, one id list per row."""
+        query_vectors = np.ascontiguousarray(np.atleast_2d(query_vectors), dtype=np.float32)
+        # A quantized index only gives approximate distances; over-fetch and
+        # re-rank with the stored vectors
+        rerank = self.index_quantization != 'none' and self.rerank_factor > 1
+        fetch_k = top_k * self.rerank_factor if rerank else top_k
+        with self._index_lock, stage_timer('search'):
+            if bitmap is None:
+                distances, indices = self.index.search(query_vectors, fetch_k)
+            else:
+                import faiss
+                # IndexIDMap2 translates the selector to external (chunk) ids
+                selector = faiss.IDSelectorBitmap(len(bitmap) * 8, faiss.swig_ptr(bitmap))
+                params = faiss.SearchParameters(sel=selector)
+                distances, indices = self.index.search(query_vectors, fetch_k, params=params)
+            # The index returns vector ids, -1 marks an empty slot
+            results = [[int(idx) for idx in row if idx >= 0] for row in indices]
+            if rerank:
+                results = [self.embeddings.rerank(q, ids, top_k) for q, ids in zip(query_vectors, results)]
+        return results
+
+    def search_vectors_filtered_ids(self, query_vectors: np.ndarray, top_k: int,
+                                    filters: List[Optional[Dict[str, Any]]]) -> List[List[int]]:
+        """search_vectors_ids() with a filter per row; rows sharing a filter share one matrix search."""
+        query_vectors = np.atleast_2d(query_vectors)
+        groups: Dict[str, List[int]] = {}
+        for row, row_filters in enumerate(filters):
+            key = json.dumps(row_filters, sort_keys=True, default=str) if row_filters else ""
+            groups.setdefault(key, []).append(row)
+        results: List[List[int]] = [[] for _ in filters]
+        for rows in groups.values():
+            row_filters = filters[rows[0]]
+            bitmap = self.metadata_store.filter_bitmap(row_filters) if row_filters else None
+            if bitmap is not None and not bitmap.any():
+                continue
+            for row, ids in zip(rows, self.search_vectors_ids(query_vectors[rows], top_k, bitmap)):
+                results[row] = ids
+        return results
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Query embeddings, reusing recent ones so a query is encoded once per request
+        even when the semantic cache and dense retrieval both need it."""
+        vectors: List[Optional[np.ndarray]] = [self._query_vectors.get(q) for q in queries]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            with stage_timer('embed'):
+                encoded = self._generate_embeddings([queries[i] for i in missing])
+            for i, vector in zip(missing, encoded):
+                self._query_vectors.put(queries[i], vector)
+                vectors[i] = vector
+        return np.vstack(vectors).astype(np.float32, copy=False)
+
+    def search_similar(self, query: str, threshold: float = 0.5, top_k: int = 10) -> List[str]:
+        """Chunks whose embedding has cosine similarity >= threshold with the query."""
+        query_vector = self.embed_queries([query])[0]
+        ids = self.search_vectors_ids(query_vector, top_k)[0]
+        if not ids:
+            return []
+        similarities = cosine_similarity_matrix(query_vector, self.embeddings.get(ids))[0]
+        return self.get_documents([i for i, sim in zip(ids, similarities) if sim >= threshold])
+
+    def lexical_search_ids(self, query: str, top_k: int = 5,
+                           filters: Optional[Dict[str, Any]] = None) -> List[Tuple[int, float]]:
+        """BM25 search over chunk text; needs no embedding model."""
+        allowed = None
+        if filters:
+            allowed = MetadataStore.to_mask(self.metadata_store.filter_bitmap(filters))
+        with stage_timer('lexical_search'):
+            return self.lexical_index.search(query, top_k, allowed=allowed)
+
+    def get_documents(self, ids: List[int]) -> List[str]:
+        with self._index_lock:
+            return [self.documents[i] for i in ids if i in self.documents]
+
+    def get_chunks(self, ids: List[int]) -> Tuple[List[Dict[str, Any]], Optional[np.ndarray]]:
+        """Text, source and stored embedding of each indexed id, in order."""
+        with self._index_lock:
+            ids = [i for i in ids if i in self.documents]
+            chunks = [{'id': i, 'text': self.documents[i],
+                       'source': (self.metadata_store.get(i) or {}).get('source')} for i in ids]
+            vectors = self.embeddings.get([i for i in ids if i in self.embeddings])
+        return chunks, vectors if len(vectors) == len(chunks) else None
+
+    def _search_coalesced(self, items: List[Tuple[str, int]]) -> List[List[int]]:
+        top_k = max(k for _, k in items)
+        results = self.search_batch_ids([q for q, _ in items], top_k)
+        return [hits[:k] for hits, (_, k) in zip(results, items)]
+
+    def start_watcher(self, interval: float = 30.0):
+        """Poll doc_path and refresh the index when files change.
+
+        The manifest makes an idle poll a stat() per file, so a short
+        interval is cheap.
+        """
+        if self._watcher_thread and self._watcher_thread.is_alive():
+            return
+        self._watcher_stop.clear()
+
+        def watch():
+            while not self._watcher_stop.wait(interval):
+                if self._replicated() and not self.raft_node.is_leader():
+                    continue
                 try:
-                    # Bug: No error handling for encoding failures
-                    embedding = self._embedding_model.encode(doc, convert_to_tensor=False)
-                    embeddings.append(embedding)
+                    self.add_documents_to_index(self.doc_path)
                 except Exception as e:
-                    # Bug: Silent failure - failed embeddings are ignored
-                    print(f"Error encoding document: {e}")
-                    # Bug: Adds zero vector as fallback, which will cause search issues
-                    embeddings.append(np.zeros(768))
-            
-            return embeddings
-            
+                    print(f"Error in index watcher: {e}")
+
+        self._watcher_thread = threading.Thread(target=watch, daemon=True)
+        self._watcher_thread.start()
+
+    def stop_watcher(self):
+        self._watcher_stop.set()
+        if self._watcher_thread:
+            self._watcher_thread.join(timeout=5)
+            self._watcher_thread = None
+
+    def save_index(self):
+        """Persist the index, chunk store and manifest to index_dir."""
+        if not self.index_dir or isinstance(self.index, MockIndex):
+            return
+        os.makedirs(self.index_dir, exist_ok=True)
+        with self._index_lock:
+            self._write_index_files(self.index_dir)
+            self.manifest.save()
+            applied_index = self.applied_index
+
+        if self.embedding_cache is not None:
+            self.embedding_cache.flush()
+        # The saved index stands in for the log entries it reflects, so the
+        # node no longer keeps their embeddings in memory and on disk
+        if applied_index and self._replicated() and hasattr(self.raft_node, 'compact_log'):
+            self.raft_node.compact_log(applied_index)
+
+    def _write_index_files(self, directory: str):
+        """Write index.faiss and documents.json; caller must hold _index_lock."""
+        import faiss
+        index_path = os.path.join(directory, 'index.faiss')
+        faiss.write_index(self.index, index_path + '.tmp')
+        os.replace(index_path + '.tmp', index_path)
+
+        docs_path = os.path.join(directory, 'documents.json')
+        with open(docs_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({
+                'index_version': self.index_version,
+                'next_id': self._next_id,
+                'raft_applied_index': self.applied_index,
+                'documents': {str(k): v for k, v in self.documents.items()},
+                'metadata': {str(k): v for k, v in self.metadata_store.items()},
+            }, f)
+        os.replace(docs_path + '.tmp', docs_path)
+
+    def _awaiting_quantizer(self) -> bool:
+        """True while an int8 index is still exact, collecting vectors to train on."""
+        if self.index_quantization != 'int8' or isinstance(self.index, MockIndex):
+            return False
+        import faiss
+        return not isinstance(faiss.downcast_index(self.index.index), faiss.IndexScalarQuantizer)
+
+    def _train_quantizer(self, ids: List[int], vectors: np.ndarray):
+        """Fit the int8 ranges on every vector so far plus this batch and re-encode them all.
+
+        Every node applies the same log entries in order, so they all switch
+        on the same entry and end up with the same ranges.
+        """
+        import faiss
+        exact = self.index.index
+        existing = exact.reconstruct_n(0, exact.ntotal) if exact.ntotal else np.empty((0, vectors.shape[1]), dtype=np.float32)
+        all_ids = np.concatenate([faiss.vector_to_array(self.index.id_map), np.asarray(ids, dtype=np.int64)])
+        all_vectors = np.vstack([existing, vectors])
+        index = faiss.IndexIDMap2(self._create_base_index(faiss, vectors.shape[1], trained=True))
+        index.train(all_vectors)
+        index.add_with_ids(all_vectors, all_ids)
+        self.index = index
+        print(f"Trained int8 quantizer on {len(all_ids)} vectors")
+
+    def _load_saved_index(self, directory: str) -> bool:
+        import faiss
+        index_path = os.path.join(directory, 'index.faiss')
+        docs_path = os.path.join(directory, 'documents.json')
+        if not (os.path.exists(index_path) and os.path.exists(docs_path)):
+            return False
+
+        with open(docs_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.index = faiss.read_index(index_path)
+        self.documents = {int(k): v for k, v in data['documents'].items()}
+        for chunk_id, metadata in data.get('metadata', {}).items():
+            self.metadata_store.add(int(chunk_id), metadata)
+        self.index_version = data.get('index_version', 0)
+        # Absent from indexes saved before this was recorded
+        self.applied_index = data.get('raft_applied_index')
+        self._next_id = max(data.get('next_id', 0), self.manifest.max_id() + 1)
+        ids = list(self.documents)
+        if ids:
+            self.embeddings.add(ids, np.vstack([self.index.reconstruct(i) for i in ids]))
+        self.lexical_index.add_many(self.documents.items())
+        return True
+
+    def _allocate_id(self) -> int:
+        with self._index_lock:
+            chunk_id = self._next_id
+            self._next_id += 1
+            return chunk_id
+
+    def _remove_ids(self, ids: List[int]) -> int:
+        if not ids:
+            return 0
+        removed = self.index.remove_ids(np.asarray(ids, dtype=np.int64))
+        for chunk_id in ids:
+            self.documents.pop(chunk_id, None)
+        self.embeddings.remove(ids)
+        self.metadata_store.remove(ids)
+        return removed
+
+    def _get_tokenizer(self):
+        """Tokenizer of the embedding model, used for token-aware chunking."""
+        try:
+            self._load_embedding_model()
+            return getattr(self._embedding_model, 'tokenizer', None)
         except Exception as e:
-            # Bug: Generic exception handling masks specific issues
-            print(f"Error generating embeddings: {e}")
-            # Bug: Returns fake embeddings that won't work
-            return [np.random.rand(768) for _ in documents]
+            print(f"Embedding tokenizer unavailable, chunking on whitespace: {e}")
+            return None
+
+    def _read_documents(self, doc_path: str) -> Iterator[DocumentChunk]:
+        """Stream the chunks of every document under doc_path."""
+        tokenizer = self._get_tokenizer()
+        for path, content in extract_texts(iter_document_files(doc_path), self.ingest_workers):
+            if content:
+                yield from chunk_text(content, path, tokenizer, self.chunk_tokens, self.chunk_overlap)
+
+    def _load_embedding_model(self):
+        if self._embedding_model is None:
+            self._embedding_model = get_encoder(self.embedding_model_name, self.encoder_backend)
+        return self._embedding_model
     
+    def _generate_embeddings(self, documents: List[str]) -> np.ndarray:
+        """Encode a list of chunks into a float32 matrix, one row per chunk.
+
+        Texts already in the embedding cache skip the model; only misses
+        are encoded, then written back to the cache.
+        """
+        if self.embedding_cache is None:
+            return self._encode(documents)
+
+        cached, missing = self.embedding_cache.get_many(documents)
+        if missing:
+            missing_texts = [documents[i] for i in missing]
+            encoded = self._encode(missing_texts)
+            self.embedding_cache.put_many(missing_texts, encoded)
+            for i, vector in zip(missing, encoded):
+                cached[i] = vector
+        return np.vstack(cached).astype(np.float32, copy=False)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        embeddings = self._load_embedding_model().encode(
+            texts, batch_size=self.embed_batch_size, convert_to_numpy=True, show_progress_bar=False
+        )
+        return np.asarray(embeddings, dtype=np.float32)
+
     def _generate_embedding(self, text: str) -> Optional[np.ndarray]:
         """Bug: This method has the same issues as _generate_embeddings"""
         try:
-            if self._embedding_model is None:
-                from sentence_transformers import SentenceTransformer
-                self._embedding_model = SentenceTransformer(self.embedding_model_name)
-            
-            embedding = self._embedding_model.encode(text, convert_to_tensor=False)
-            return embedding
+            return self._generate_embeddings([text])[0]
             
         except Exception as e:
             # Bug: Silent failure - errors are not logged
@@ -221,12 +804,22 @@ class MockIndex:
     """Bug: This mock class doesn't implement the required interface properly"""
     def __init__(self):
         self.dimension = 768
+        self.is_trained = True
     
     def add(self, vectors):
         # Bug: This method does nothing
         pass
+
+    def add_with_ids(self, vectors, ids):
+        pass
+
+    def remove_ids(self, ids):
+        return 0
     
     def search(self, query_vector, k):
         # Bug: Returns fake results that don't make sense
-        return np.array([[0.1, 0.2, 0.3]]), np.array([[0, 1, 2]])
+        rows = len(np.atleast_2d(query_vector))
+        ids = np.full((rows, k), -1, dtype=np.int64)
+        ids[:, :min(k, 3)] = np.arange(min(k, 3))
+        return np.where(ids >= 0, 0.1 * (ids + 1), np.inf).astype(np.float32), ids
 
@@ -0,0 +1,479 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from model_registry import get_causal_lm, registry
+from prefix_cache import PrefixKVCache
+
+
+def _to_legacy(past):
+    """Per-layer (key, value) tuples from whatever cache object the model returned."""
+    if hasattr(past, 'to_legacy_cache'):
+        return past.to_legacy_cache()
+    return tuple((layer[0], layer[1]) for layer in past)
+
+
+def _from_legacy(legacy):
+    """Cache object the model accepts; newer transformers want a Cache instance."""
+    try:
+        from transformers import DynamicCache
+        return DynamicCache.from_legacy_cache(legacy)
+    except (ImportError, AttributeError):
+        return legacy
+
+
+class GenerationRequest:
+    """One prompt in flight. Its future stays pending until the result is set,
+    so a caller can cancel() it at any point and the engine drops the
+    sequence at the next step boundary."""
+
+    __slots__ = ('prompt_ids', 'max_new_tokens', 'temperature', 'future', 'on_token', 'generated',
+                 'past', 'kv_len', 'next_token', 'draft_past', 'draft_len',
+                 'submitted_at', 'first_token_at')
+
+    def __init__(self, prompt_ids: List[int], max_new_tokens: int, temperature: float,
+                 on_token: Optional[Callable[[int], None]] = None):
+        self.prompt_ids = prompt_ids
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.future: Future = Future()
+        self.on_token = on_token  # called on the engine thread with each accepted token id
+        self.generated: List[int] = []
+        self.past = None          # this sequence's own KV cache while it is outside the batch
+        self.kv_len = 0           # tokens held in its KV cache
+        self.next_token: Optional[int] = None
+        self.draft_past = None    # draft model's KV cache, may lag behind the sequence
+        self.draft_len = 0        # tokens held in draft_past
+        self.submitted_at = time.monotonic()
+        self.first_token_at: Optional[float] = None
+
+
+class GenerationEngine:
+    """Continuous-batching text generation for a local Hugging Face causal LM.
+
+    A single scheduler thread owns the model. Each iteration it admits
+    queued requests into free batch slots and prefills them. It then runs
+    one decode step for every active sequence at once, and retires the
+    sequences that hit EOS or their token limit. Sequences therefore join
+    and leave the batch between any two decode steps instead of waiting for
+    the longest request.
+
+    The batched KV cache is left-padded, with an attention mask and explicit
+    position ids. It is only repacked when batch membership changes; steady
+    decoding just appends to it.
+
+    Prefill resumes from the longest block-aligned prompt prefix held in
+    prefix_cache, so prompts that open with the same context only run
+    their new tail through the model.
+
+    With a draft_model (a small causal LM sharing the tokenizer), a lone
+    greedy sequence uses assisted decoding. The draft proposes up to
+    draft_tokens tokens, and the main model checks them all in one forward
+    pass. The matching prefix is kept, plus the main model's own next
+    token, so the output is identical to plain greedy decoding. Once more
+    sequences share the batch, or for sampled requests, the engine decodes
+    normally, since batching already amortizes the main model's weights.
+    """
+
+    def __init__(self, model_name: str, max_batch_size: int = 8, max_new_tokens: int = 128,
+                 max_prompt_tokens: int = 1024, num_threads: Optional[int] = None,
+                 prefix_cache_bytes: int = 256 * 2**20, prefix_block_tokens: int = 32,
+                 draft_model: Optional[str] = None, draft_tokens: int = 4):
+        import torch
+
+        self._torch = torch
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model_name = model_name
+        self.tokenizer, self.model = get_causal_lm(model_name)
+        self.max_batch_size = max_batch_size
+        self.max_new_tokens = max_new_tokens
+        max_positions = getattr(self.model.config, 'max_position_embeddings', None) or \
+            getattr(self.model.config, 'n_positions', None)
+        self.max_prompt_tokens = min(max_prompt_tokens, max_positions - 1) if max_positions else max_prompt_tokens
+        self.max_positions = max_positions
+        self.eos_token_id = self.tokenizer.eos_token_id
+        # KV of recently seen prompt prefixes (e.g. a popular "Context: ..." block)
+        self.prefix_cache = PrefixKVCache(prefix_cache_bytes, prefix_block_tokens) if prefix_cache_bytes else None
+        self.draft_model = None
+        self.draft_tokens = max(1, draft_tokens)
+        if draft_model:
+            draft_tokenizer, model = get_causal_lm(draft_model)
+            if draft_tokenizer.get_vocab() == self.tokenizer.get_vocab():
+                self.draft_model = model
+            else:
+                print(f"Draft model {draft_model} does not share the tokenizer of {model_name}; assisted decoding disabled")
+        self.draft_model_name = draft_model if self.draft_model is not None else None
+
+        self._queue: "queue.Queue[Optional[GenerationRequest]]" = queue.Queue()
+        self._active: List[GenerationRequest] = []
+        self._batch_past = None
+        self._batch_mask = None
+        self._batch_rows: List[GenerationRequest] = []  # row order of _batch_past
+        self._repack = True
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.tokens_generated = 0
+        self.decode_steps = 0
+        self.batched_tokens = 0
+        self._busy_s = 0.0
+        self._ttft_s = 0.0
+        self.draft_steps = 0
+        self.draft_proposed = 0
+        self.draft_accepted = 0
+        self._worker = threading.Thread(target=self._run, name=f"generation-{model_name}", daemon=True)
+        self._worker.start()
+
+    def submit(self, prompt: str, max_new_tokens: Optional[int] = None, temperature: float = 0.0,
+               on_token: Optional[Callable[[int], None]] = None) -> Future:
+        if self._closed:
+            raise RuntimeError("GenerationEngine is closed")
+        limit = max_new_tokens or self.max_new_tokens
+        prompt_ids = self.tokenizer.encode(prompt)
+        budget = self.prompt_budget(limit)
+        if len(prompt_ids) > budget:
+            # Callers fit their prompts to prompt_budget(); this only protects the position limit
+            prompt_ids = prompt_ids[-budget:]
+        if self.max_positions:
+            limit = max(1, min(limit, self.max_positions - len(prompt_ids)))
+        request = GenerationRequest(prompt_ids, limit, temperature, on_token)
+        self._queue.put(request)
+        return request.future
+
+    def prompt_budget(self, max_new_tokens: Optional[int] = None) -> int:
+        """Prompt tokens that still leave the model room for max_new_tokens of answer."""
+        if not self.max_positions:
+            return self.max_prompt_tokens
+        limit = max_new_tokens or self.max_new_tokens
+        return max(1, min(self.max_prompt_tokens, self.max_positions - limit))
+
+    def generate(self, prompt: str, max_new_tokens: Optional[int] = None, temperature: float = 0.0,
+                 timeout: Optional[float] = None) -> str:
+        future = self.submit(prompt, max_new_tokens, temperature)
+        try:
+            return future.result(timeout=timeout)
+        except Exception:
+            # Stop spending decode steps on an answer nobody is waiting for
+            future.cancel()
+            raise
+
+    def stream(self, prompt: str, max_new_tokens: Optional[int] = None,
+               temperature: float = 0.0) -> Iterator[str]:
+        """Yield the continuation in pieces as its tokens are decoded.
+
+        Closing the generator before the end cancels the request.
+        """
+        tokens: "queue.Queue[Optional[int]]" = queue.Queue()
+        future = self.submit(prompt, max_new_tokens, temperature, on_token=tokens.put)
+        future.add_done_callback(lambda _: tokens.put(None))
+        generated: List[int] = []
+        emitted = 0
+        try:
+            while True:
+                token = tokens.get()
+                if token is None:
+                    break
+                generated.append(token)
+                text = self.tokenizer.decode(generated, skip_special_tokens=True)
+                # A multi-byte character split across tokens decodes to U+FFFD until it is complete
+                if text.endswith('\ufffd') or len(text) <= emitted:
+                    continue
+                yield text[emitted:]
+                emitted = len(text)
+            future.result()  # raise the engine's error, if any
+        finally:
+            future.cancel()
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join(timeout=10)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                'requests': self.requests,
+                'tokens_generated': self.tokens_generated,
+                'decode_steps': self.decode_steps,
+                'avg_batch_size': self.batched_tokens / self.decode_steps if self.decode_steps else 0.0,
+                'tokens_per_s': self.tokens_generated / self._busy_s if self._busy_s else 0.0,
+                'avg_ttft_ms': 1000 * self._ttft_s / self.requests if self.requests else 0.0,
+                'active': len(self._active),
+                'queued': self._queue.qsize(),
+                'prefix_cache': self.prefix_cache.get_stats() if self.prefix_cache is not None else None,
+                'draft_model': self.draft_model_name,
+                'draft_tokens': self.draft_tokens,
+                'draft_steps': self.draft_steps,
+                'draft_proposed': self.draft_proposed,
+                'draft_accepted': self.draft_accepted,
+                'draft_acceptance_rate': self.draft_accepted / self.draft_proposed if self.draft_proposed else 0.0,
+                # Tokens emitted per main-model forward pass while drafting
+                'tokens_per_draft_step': (self.draft_accepted + self.draft_steps) / self.draft_steps if self.draft_steps else 0.0,
+            }
+
+    def _run(self):
+        with self._torch.inference_mode():
+            while True:
+                if not self._admit():
+                    return
+                if not self._active:
+                    continue
+                start = time.perf_counter()
+                try:
+                    if self._can_draft():
+                        self._draft_step(self._active[0])
+                    else:
+                        self._decode_step()
+                except Exception as e:
+                    for request in self._active:
+                        self._fail(request, e)
+                    self._active = []
+                    self._batch_past = self._batch_mask = None
+                    self._batch_rows = []
+                    self._repack = True
+                with self._stats_lock:
+                    self._busy_s += time.perf_counter() - start
+
+    def _admit(self) -> bool:
+        """Move queued requests into free slots; blocks while idle. False once closed."""
+        while len(self._active) < self.max_batch_size:
+            try:
+                request = self._queue.get(block=not self._active)
+            except queue.Empty:
+                break
+            if request is None:
+                self._closed = True
+                break
+            if request.future.cancelled():
+                continue
+            start = time.perf_counter()
+            try:
+                self._prefill(request)
+            except Exception as e:
+                self._fail(request, e)
+                continue
+            finally:
+                with self._stats_lock:
+                    self._busy_s += time.perf_counter() - start
+            if self._finished(request):
+                self._complete(request)
+                continue
+            self._active.append(request)
+            self._repack = True
+        return not (self._closed and not self._active and self._queue.empty())
+
+    def _prefill(self, request: GenerationRequest):
+        torch = self._torch
+        cached_len, cached_past = 0, None
+        if self.prefix_cache is not None:
+            # Resume from the longest cached prefix; only the tail is run through the model
+            cached_len, cached_past = self.prefix_cache.lookup(request.prompt_ids)
+        input_ids = torch.tensor([request.prompt_ids[cached_len:]], dtype=torch.long)
+        if cached_past is not None:
+            outputs = self.model(input_ids=input_ids, past_key_values=_from_legacy(cached_past), use_cache=True)
+        else:
+            outputs = self.model(input_ids=input_ids, use_cache=True)
+        request.past = _to_legacy(outputs.past_key_values)
+        request.kv_len = len(request.prompt_ids)
+        if self.prefix_cache is not None:
+            self.prefix_cache.put(request.prompt_ids, request.past, cached_len)
+        self._accept(request, self._sample(outputs.logits[:, -1, :], [request])[0])
+        with self._stats_lock:
+            self.requests += 1
+
+    def _decode_step(self):
+        torch = self._torch
+        # Callers that gave up leave at the step boundary
+        dropped = [r for r in self._active if r.future.cancelled()]
+        if dropped:
+            self._retire(dropped)
+        if not self._active:
+            return
+        if self._repack:
+            self._pack()
+
+        batch = self._active
+        input_ids = torch.tensor([[r.next_token] for r in batch], dtype=torch.long)
+        position_ids = torch.tensor([[r.kv_len] for r in batch], dtype=torch.long)
+        self._batch_mask = torch.cat([self._batch_mask, torch.ones((len(batch), 1), dtype=torch.long)], dim=1)
+        outputs = self.model(input_ids=input_ids, attention_mask=self._batch_mask, position_ids=position_ids,
+                             past_key_values=_from_legacy(self._batch_past), use_cache=True)
+        self._batch_past = _to_legacy(outputs.past_key_values)
+        for request in batch:
+            request.kv_len += 1
+
+        tokens = self._sample(outputs.logits[:, -1, :], batch)
+        finished = []
+        for request, token in zip(batch, tokens):
+            self._accept(request, token)
+            if self._finished(request):
+                finished.append(request)
+        with self._stats_lock:
+            self.decode_steps += 1
+            self.batched_tokens += len(batch)
+        if finished:
+            self._retire(finished)
+
+    def _can_draft(self) -> bool:
+        return (self.draft_model is not None and len(self._active) == 1
+                and self._active[0].temperature <= 0 and self._queue.empty())
+
+    def _draft_step(self, request: GenerationRequest):
+        """One assisted-decoding step: draft proposes, the main model verifies."""
+        torch = self._torch
+        if request.future.cancelled():
+            self._retire([request])
+            return
+        count = min(self.draft_tokens, request.max_new_tokens - len(request.generated))
+        if self.max_positions is not None:
+            count = min(count, self.max_positions - request.kv_len - 2)
+        if count < 1:
+            self._decode_step()
+            return
+        # Take the sequence out of the batch cache; it is repacked if others join
+        self._unpack()
+        self._repack = True
+
+        # The draft cache may lag behind after batched steps, so feed it everything it has not seen
+        sequence = request.prompt_ids + request.generated
+        past = _from_legacy(request.draft_past) if request.draft_past is not None else None
+        outputs = self.draft_model(input_ids=torch.tensor([sequence[request.draft_len:]], dtype=torch.long),
+                                   past_key_values=past, use_cache=True)
+        draft: List[int] = []
+        while True:
+            token = int(torch.argmax(outputs.logits[0, -1]))
+            draft.append(token)
+            if len(draft) == count or token == self.eos_token_id:
+                break
+            outputs = self.draft_model(input_ids=torch.tensor([[token]], dtype=torch.long),
+                                       past_key_values=outputs.past_key_values, use_cache=True)
+        draft_past = _to_legacy(outputs.past_key_values)
+
+        input_ids = torch.tensor([[request.next_token] + draft], dtype=torch.long)
+        outputs = self.model(input_ids=input_ids, past_key_values=_from_legacy(request.past), use_cache=True)
+        predicted = torch.argmax(outputs.logits[0], dim=-1).tolist()  # predicted[i] follows input_ids[0, i]
+        accepted = 0
+        while accepted < len(draft) and draft[accepted] == predicted[accepted]:
+            accepted += 1
+
+        # Drop the cache entries of rejected draft tokens from both models
+        keep = request.kv_len + accepted + 1
+        request.past = tuple((k[:, :, :keep, :], v[:, :, :keep, :]) for k, v in _to_legacy(outputs.past_key_values))
+        request.kv_len = keep
+        request.draft_len = len(sequence) + min(accepted, len(draft) - 1)
+        request.draft_past = tuple((k[:, :, :request.draft_len, :], v[:, :, :request.draft_len, :])
+                                   for k, v in draft_past)
+        with self._stats_lock:
+            self.draft_steps += 1
+            self.draft_proposed += len(draft)
+            self.draft_accepted += accepted
+
+        for token in draft[:accepted] + [predicted[accepted]]:
+            self._accept(request, token)
+            if self._finished(request):
+                self._retire([request])
+                return
+
+    def _pack(self):
+        """Rebuild the left-padded batch cache from each active sequence's own cache."""
+        torch = self._torch
+        self._unpack()
+        max_len = max(r.kv_len for r in self._active)
+        layers = []
+        for layer in range(len(self._active[0].past)):
+            keys, values = [], []
+            for request in self._active:
+                key, value = request.past[layer]
+                pad = max_len - request.kv_len
+                if pad:
+                    shape = (1, key.shape[1], pad, key.shape[3])
+                    key = torch.cat([key.new_zeros(shape), key], dim=2)
+                    value = torch.cat([value.new_zeros(shape), value], dim=2)
+                keys.append(key)
+                values.append(value)
+            layers.append((torch.cat(keys, dim=0), torch.cat(values, dim=0)))
+        self._batch_past = tuple(layers)
+        self._batch_mask = torch.zeros((len(self._active), max_len), dtype=torch.long)
+        for row, request in enumerate(self._active):
+            self._batch_mask[row, max_len - request.kv_len:] = 1
+            request.past = None
+        self._batch_rows = list(self._active)
+        self._repack = False
+
+    def _unpack(self):
+        """Copy the cache rows of sequences still active out of the batch, without padding."""
+        if self._batch_past is None:
+            return
+        active = set(map(id, self._active))
+        max_len = self._batch_mask.shape[1]
+        for row, request in enumerate(self._batch_rows):
+            if id(request) not in active:
+                continue
+            pad = max_len - request.kv_len
+            request.past = tuple((k[row:row + 1, :, pad:, :], v[row:row + 1, :, pad:, :])
+                                 for k, v in self._batch_past)
+        self._batch_past = self._batch_mask = None
+        self._batch_rows = []
+
+    def _retire(self, requests: List[GenerationRequest]):
+        """Finish requests and take them out of the batch; the cache is repacked next step."""
+        retired = set(map(id, requests))
+        for request in requests:
+            self._complete(request)
+        self._active = [r for r in self._active if id(r) not in retired]
+        self._repack = True
+
+    def _complete(self, request: GenerationRequest):
+        request.past = request.draft_past = None
+        if request.future.cancelled():
+            return
+        text = self.tokenizer.decode(request.generated, skip_special_tokens=True)
+        try:
+            request.future.set_result(text)
+        except InvalidStateError:
+            pass  # cancelled concurrently
+
+    def _fail(self, request: GenerationRequest, error: Exception):
+        request.past = request.draft_past = None
+        try:
+            request.future.set_exception(error)
+        except InvalidStateError:
+            pass
+
+    def _accept(self, request: GenerationRequest, token: int):
+        if request.first_token_at is None:
+            request.first_token_at = time.monotonic()
+            with self._stats_lock:
+                self._ttft_s += request.first_token_at - request.submitted_at
+        request.generated.append(token)
+        request.next_token = token
+        with self._stats_lock:
+            self.tokens_generated += 1
+        if request.on_token is not None:
+            try:
+                request.on_token(token)
+            except Exception as e:
+                print(f"Token callback failed: {e}")
+
+    def _finished(self, request: GenerationRequest) -> bool:
+        return (request.next_token == self.eos_token_id
+                or len(request.generated) >= request.max_new_tokens
+                or (self.max_positions is not None and request.kv_len + 1 >= self.max_positions))
+
+    def _sample(self, logits, requests: List[GenerationRequest]) -> List[int]:
+        torch = self._torch
+        tokens = torch.argmax(logits, dim=-1)
+        for row, request in enumerate(requests):
+            if request.temperature > 0:
+                probs = torch.softmax(logits[row].float() / request.temperature, dim=-1)
+                tokens[row] = torch.multinomial(probs, 1)[0]
+        return tokens.tolist()
+
+
+def get_generation_engine(model_name: str, **options) -> GenerationEngine:
+    """The process-wide engine for model_name, created on first use."""
+    return registry.get('generation_engine', model_name, lambda: GenerationEngine(model_name, **options),
+                        **options)
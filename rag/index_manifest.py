@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Any, Optional, Tuple
+
+
+def content_hash(data) -> str:
+    """Return the sha256 hex digest of a str or bytes payload."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+class IndexManifest:
+    """Tracks which files and chunks are in the index.
+
+    Each entry is keyed by absolute file path and records the file's mtime,
+    size and content hash, plus the (chunk hash, vector id) pairs that were
+    indexed for it. A refresh compares the filesystem against the manifest so
+    only changed chunks are re-embedded and stale vectors can be removed.
+    """
+
+    def __init__(self, manifest_path: Optional[str] = None):
+        self.manifest_path = manifest_path
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+        if manifest_path and os.path.exists(manifest_path):
+            self.load()
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._entries.get(path)
+
+    def is_unchanged(self, path: str, mtime: float, size: int) -> bool:
+        """Cheap stat-only check, no file read required."""
+        entry = self.get(path)
+        return bool(entry) and entry['mtime'] == mtime and entry['size'] == size
+
+    def touch(self, path: str, mtime: float, size: int):
+        """Record a new mtime/size for a file whose content did not change."""
+        with self._lock:
+            if path in self._entries:
+                self._entries[path]['mtime'] = mtime
+                self._entries[path]['size'] = size
+
+    def update(self, path: str, mtime: float, size: int, digest: str,
+               chunks: List[Tuple[str, int]]):
+        with self._lock:
+            self._entries[path] = {
+                'mtime': mtime,
+                'size': size,
+                'sha256': digest,
+                'chunks': [list(c) for c in chunks],
+            }
+
+    def remove(self, path: str) -> List[int]:
+        """Drop a file from the manifest and return the vector ids it owned."""
+        with self._lock:
+            entry = self._entries.pop(path, None)
+        if not entry:
+            return []
+        return [chunk_id for _, chunk_id in entry['chunks']]
+
+    def paths_under(self, root: str) -> List[str]:
+        root = os.path.abspath(root)
+        with self._lock:
+            if os.path.isfile(root):
+                return [p for p in self._entries if p == root]
+            prefix = root.rstrip(os.sep) + os.sep
+            return [p for p in self._entries if p.startswith(prefix)]
+
+    def max_id(self) -> int:
+        with self._lock:
+            ids = [c[1] for e in self._entries.values() for c in e['chunks']]
+        return max(ids) if ids else -1
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def clear(self):
+        """Forget every file, so the next refresh indexes everything again."""
+        with self._lock:
+            self._entries = {}
+        self.save()
+
+    def load(self):
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        with self._lock:
+            self._entries = data.get('files', {})
+
+    def save(self, path: Optional[str] = None):
+        """Write the manifest to manifest_path, or to path if given."""
+        path = path or self.manifest_path
+        if not path:
+            return
+        with self._lock:
+            payload = json.dumps({'version': 1, 'files': self._entries})
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
@@ -0,0 +1,163 @@
+import json
+import os
+import shutil
+import threading
+import time
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+SNAPSHOT_PREFIX = 'v'
+
+
+class MappedDocuments(Mapping):
+    """Read-only chunk id -> text mapping over a memory-mapped text blob.
+
+    Texts are stored back to back as UTF-8 with an offsets array, and ids
+    are sorted so a lookup is a binary search. Every process that opens the
+    same files shares one copy in the page cache.
+    """
+
+    def __init__(self, directory: str):
+        self._ids = np.load(os.path.join(directory, 'doc_ids.npy'), mmap_mode='r')
+        self._offsets = np.load(os.path.join(directory, 'doc_offsets.npy'), mmap_mode='r')
+        path = os.path.join(directory, 'docs.bin')
+        self._blob = np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else np.zeros(0, np.uint8)
+
+    @staticmethod
+    def write(directory: str, documents: Dict[int, str]):
+        ids = np.asarray(sorted(documents), dtype=np.int64)
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        with open(os.path.join(directory, 'docs.bin'), 'wb') as f:
+            for i, chunk_id in enumerate(ids):
+                data = documents[int(chunk_id)].encode('utf-8')
+                f.write(data)
+                offsets[i + 1] = offsets[i] + len(data)
+        np.save(os.path.join(directory, 'doc_ids.npy'), ids)
+        np.save(os.path.join(directory, 'doc_offsets.npy'), offsets)
+
+    def _row(self, chunk_id) -> int:
+        row = int(np.searchsorted(self._ids, chunk_id))
+        if row < len(self._ids) and self._ids[row] == chunk_id:
+            return row
+        return -1
+
+    def __getitem__(self, chunk_id: int) -> str:
+        row = self._row(chunk_id)
+        if row < 0:
+            raise KeyError(chunk_id)
+        return self._blob[self._offsets[row]:self._offsets[row + 1]].tobytes().decode('utf-8')
+
+    def __contains__(self, chunk_id) -> bool:
+        return self._row(chunk_id) >= 0
+
+    def __iter__(self) -> Iterator[int]:
+        return (int(chunk_id) for chunk_id in self._ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+def snapshot_path(root: str, version: int) -> str:
+    return os.path.join(root, f"{SNAPSHOT_PREFIX}{version:08d}")
+
+
+def list_snapshots(root: str) -> List[str]:
+    """Complete snapshot directories under root, oldest first."""
+    if not os.path.isdir(root):
+        return []
+    names = sorted(n for n in os.listdir(root) if n.startswith(SNAPSHOT_PREFIX) and not n.endswith('.tmp'))
+    return [os.path.join(root, n) for n in names if os.path.exists(os.path.join(root, n, 'snapshot.json'))]
+
+
+class SnapshotPublisher:
+    """Writes read-only index snapshots for serving workers and announces them.
+
+    Index versions can change many times during a refresh, so changes are
+    coalesced. After a change, the publisher waits min_interval seconds
+    and then writes one snapshot of whatever version is current. The
+    newest `keep` snapshots are kept. Older ones are deleted; workers still
+    mapping them keep their pages until they switch.
+
+    Snapshots left under root by an earlier run are deleted on start():
+    index versions restart with the index, so an old v{version} directory
+    may hold different content.
+    """
+
+    def __init__(self, indexer, root: str, on_publish: Callable[[str, int], None],
+                 min_interval: float = 2.0, keep: int = 2):
+        self.indexer = indexer
+        self.root = root
+        self.on_publish = on_publish
+        self.min_interval = min_interval
+        self.keep = max(1, keep)
+        self.published_version: Optional[int] = None
+        self.published_path: Optional[str] = None
+        self._changed = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        os.makedirs(root, exist_ok=True)
+
+    def start(self):
+        for name in os.listdir(self.root):
+            if name.startswith(SNAPSHOT_PREFIX):
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+        self.publish()
+        self._thread = threading.Thread(target=self._run, name="snapshot-publisher", daemon=True)
+        self._thread.start()
+
+    def notify(self, *_):
+        """Version listener hook: mark the index as changed."""
+        self._changed.set()
+
+    def stop(self):
+        self._stop.set()
+        self._changed.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+
+    def publish(self) -> str:
+        """Write a snapshot of the current version, if it is new, and announce it."""
+        version = self.indexer.index_version
+        if version != self.published_version:
+            start = time.perf_counter()
+            tmp = snapshot_path(self.root, version) + '.tmp'
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            version = self.indexer.export_snapshot(tmp)
+            path = snapshot_path(self.root, version)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp, path)
+            print(f"Published index snapshot v{version} in {time.perf_counter() - start:.2f}s")
+            self.published_version, self.published_path = version, path
+            self.on_publish(path, version)
+            self._prune()
+        return self.published_path
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._changed.wait()
+            if self._stop.wait(self.min_interval):
+                return
+            self._changed.clear()
+            try:
+                self.publish()
+            except Exception as e:
+                print(f"Error publishing index snapshot: {e}")
+
+    def _prune(self):
+        for path in list_snapshots(self.root)[:-self.keep]:
+            if path != self.published_path:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def write_manifest(directory: str, info: Dict[str, Any]):
+    """Written last: a snapshot directory without it is incomplete."""
+    with open(os.path.join(directory, 'snapshot.json'), 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+
+
+def read_manifest(directory: str) -> Dict[str, Any]:
+    with open(os.path.join(directory, 'snapshot.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
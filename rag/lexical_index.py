@@ -0,0 +1,255 @@
+import json
+import math
+import os
+import re
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"[a-z0-9_]+(?:[.\-][a-z0-9_]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word/identifier tokens; keeps things like 'co2', 'ars-2' and 'v1.2' whole."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+class LexicalIndex:
+    """Compact BM25 inverted index over chunk ids.
+
+    Each term owns two parallel typed arrays (doc ids and term frequencies)
+    instead of Python lists of tuples, so a posting costs 12 bytes rather
+    than ~100. Removed chunks are tombstoned and physically dropped by
+    compact(), which runs automatically once a quarter of the postings
+    belong to removed chunks. Re-adding an id whose old postings are still
+    there compacts first, so its old text never counts again.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._term_ids: Dict[str, int] = {}
+        self._posting_ids: List[array] = []
+        self._posting_tfs: List[array] = []
+        self._doc_len = array('I')     # indexed by chunk id, 0 for unused ids
+        self._doc_terms = array('I')   # distinct terms per chunk id, i.e. its posting count
+        self._alive = bytearray()      # 1 if the chunk id is live
+        self._stale = bytearray()      # 1 if postings of a removed chunk id are not compacted yet
+        self._num_docs = 0
+        self._total_len = 0
+        self._dead_postings = 0
+        self._total_postings = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._num_docs
+
+    def add(self, doc_id: int, text: str):
+        self.add_many([(doc_id, text)])
+
+    def add_many(self, docs: Iterable[Tuple[int, str]]):
+        """Index chunks, replacing any earlier text under the same ids."""
+        # The last text given for an id wins
+        docs = dict(docs)
+        counted = []
+        for doc_id, text in docs.items():
+            tokens = tokenize(text)
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            counted.append((doc_id, len(tokens), counts))
+
+        with self._lock:
+            self.remove(docs)
+            if any(doc_id < len(self._stale) and self._stale[doc_id] for doc_id in docs):
+                self.compact()
+            for doc_id, length, counts in counted:
+                self._ensure_capacity(doc_id)
+                for term, tf in counts.items():
+                    term_id = self._term_ids.get(term)
+                    if term_id is None:
+                        term_id = len(self._posting_ids)
+                        self._term_ids[term] = term_id
+                        self._posting_ids.append(array('q'))
+                        self._posting_tfs.append(array('I'))
+                    self._posting_ids[term_id].append(doc_id)
+                    self._posting_tfs[term_id].append(tf)
+                self._doc_len[doc_id] = length
+                self._doc_terms[doc_id] = len(counts)
+                self._alive[doc_id] = 1
+                self._num_docs += 1
+                self._total_len += length
+                self._total_postings += len(counts)
+
+    def remove(self, doc_ids: Iterable[int]):
+        with self._lock:
+            for doc_id in doc_ids:
+                if doc_id >= len(self._alive) or not self._alive[doc_id]:
+                    continue
+                self._alive[doc_id] = 0
+                self._stale[doc_id] = 1
+                self._num_docs -= 1
+                self._total_len -= self._doc_len[doc_id]
+                self._dead_postings += self._doc_terms[doc_id]
+                self._doc_len[doc_id] = 0
+                self._doc_terms[doc_id] = 0
+            if self._total_postings and self._dead_postings > self._total_postings // 4:
+                self.compact()
+
+    def compact(self):
+        """Drop postings of removed chunks and reclaim their memory."""
+        with self._lock:
+            alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+            total = 0
+            for term_id in range(len(self._posting_ids)):
+                ids = np.frombuffer(self._posting_ids[term_id], dtype=np.int64)
+                if not len(ids):
+                    continue
+                keep = alive[ids]
+                kept = int(keep.sum())
+                if kept < len(ids):
+                    tfs = np.frombuffer(self._posting_tfs[term_id], dtype=np.uint32)
+                    new_ids, new_tfs = array('q'), array('I')
+                    new_ids.frombytes(ids[keep].tobytes())
+                    new_tfs.frombytes(tfs[keep].tobytes())
+                    del ids, tfs
+                    self._posting_ids[term_id] = new_ids
+                    self._posting_tfs[term_id] = new_tfs
+                total += kept
+            self._total_postings = total
+            self._dead_postings = 0
+            self._stale = bytearray(len(self._alive))
+
+    def search(self, query: str, top_k: int = 5,
+               allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """Return up to top_k (chunk id, BM25 score) pairs, best first.
+
+        allowed is an optional boolean mask indexed by chunk id; chunks
+        outside it are never returned.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or not self._num_docs:
+                return []
+            ids, scores = self._score_postings(terms)
+
+        if allowed is not None and len(ids):
+            in_range = ids < len(allowed)
+            keep = np.zeros(len(ids), dtype=bool)
+            keep[in_range] = allowed[ids[in_range]]
+            ids, scores = ids[keep], scores[keep]
+        if not len(ids):
+            return []
+
+        unique_ids, inverse = np.unique(ids, return_inverse=True)
+        totals = np.bincount(inverse, weights=scores)
+        if len(totals) > top_k:
+            best = np.argpartition(-totals, top_k)[:top_k]
+        else:
+            best = np.arange(len(totals))
+        best = best[np.argsort(-totals[best])]
+        return [(int(unique_ids[i]), float(totals[i])) for i in best]
+
+    def _score_postings(self, terms) -> Tuple[np.ndarray, np.ndarray]:
+        """Per-posting BM25 contributions of live chunks; caller must hold the lock.
+
+        Only copies leave this method, so no numpy view keeps a buffer export
+        on the typed arrays (which would block later appends).
+        """
+        doc_len = np.frombuffer(self._doc_len, dtype=np.uint32)
+        alive = np.frombuffer(self._alive, dtype=np.uint8)
+        avg_len = self._total_len / self._num_docs
+        n = self._num_docs
+
+        id_parts, score_parts = [], []
+        for term in terms:
+            term_id = self._term_ids.get(term)
+            if term_id is None:
+                continue
+            ids = np.frombuffer(self._posting_ids[term_id], dtype=np.int64)
+            if not len(ids):
+                continue
+            live = alive[ids].astype(bool)
+            ids = ids[live]
+            tfs = np.frombuffer(self._posting_tfs[term_id], dtype=np.uint32)[live].astype(np.float32)
+            df = len(ids)
+            if not df:
+                continue
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * doc_len[ids] / avg_len)
+            id_parts.append(ids)
+            score_parts.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+
+        if not id_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return np.concatenate(id_parts), np.concatenate(score_parts)
+
+    def save(self, directory: str):
+        """Write the postings as flat .npy arrays plus a small JSON header."""
+        with self._lock:
+            lengths = [len(a) for a in self._posting_ids]
+            offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            ids, tfs = array('q'), array('I')
+            for posting_ids, posting_tfs in zip(self._posting_ids, self._posting_tfs):
+                ids.extend(posting_ids)
+                tfs.extend(posting_tfs)
+            arrays = {
+                'posting_ids': np.frombuffer(ids, dtype=np.int64),
+                'posting_tfs': np.frombuffer(tfs, dtype=np.uint32),
+                'posting_offsets': offsets,
+                'doc_len': np.frombuffer(self._doc_len, dtype=np.uint32),
+                'doc_terms': np.frombuffer(self._doc_terms, dtype=np.uint32),
+                'alive': np.frombuffer(self._alive, dtype=np.uint8),
+            }
+            for name, values in arrays.items():
+                np.save(os.path.join(directory, f'lexical_{name}.npy'), values)
+            del arrays
+            terms = sorted(self._term_ids, key=self._term_ids.get)
+            with open(os.path.join(directory, 'lexical.json'), 'w', encoding='utf-8') as f:
+                json.dump({'k1': self.k1, 'b': self.b, 'num_docs': self._num_docs,
+                           'total_len': self._total_len, 'dead_postings': self._dead_postings,
+                           'total_postings': self._total_postings, 'terms': terms}, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> 'LexicalIndex':
+        """Index over files written by save(). With mmap, postings are views of
+        the shared files, so the index is read-only: search() only."""
+        with open(os.path.join(directory, 'lexical.json'), 'r', encoding='utf-8') as f:
+            header = json.load(f)
+        mode = 'r' if mmap else None
+
+        def load_array(name):
+            return np.load(os.path.join(directory, f'lexical_{name}.npy'), mmap_mode=mode).view(np.ndarray)
+
+        index = cls(header['k1'], header['b'])
+        ids, tfs, offsets = load_array('posting_ids'), load_array('posting_tfs'), load_array('posting_offsets')
+        index._term_ids = {term: term_id for term_id, term in enumerate(header['terms'])}
+        index._posting_ids = [ids[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        index._posting_tfs = [tfs[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        index._doc_len = load_array('doc_len')
+        index._doc_terms = load_array('doc_terms')
+        index._alive = load_array('alive')
+        index._stale = bytearray(len(index._alive))
+        index._num_docs = header['num_docs']
+        index._total_len = header['total_len']
+        index._dead_postings = header['dead_postings']
+        index._total_postings = header['total_postings']
+        return index
+
+    def memory_bytes(self) -> int:
+        with self._lock:
+            postings = sum(a.itemsize * len(a) for a in self._posting_ids)
+            postings += sum(a.itemsize * len(a) for a in self._posting_tfs)
+            per_doc = (self._doc_len.itemsize + self._doc_terms.itemsize) * len(self._doc_len)
+            return postings + per_doc + len(self._alive)
+
+    def _ensure_capacity(self, doc_id: int):
+        if doc_id >= len(self._alive):
+            grow = max(doc_id + 1 - len(self._alive), len(self._alive))
+            self._doc_len.frombytes(bytes(grow * self._doc_len.itemsize))
+            self._doc_terms.frombytes(bytes(grow * self._doc_terms.itemsize))
+            self._alive.extend(b'\x00' * grow)
+            self._stale.extend(b'\x00' * grow)
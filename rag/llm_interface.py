@@ -1,15 +1,21 @@
 import time
-import threading
-import json
-from typing import Optional, Dict, Any
+from concurrent.futures import Future, InvalidStateError
+from typing import Optional, Dict, Any, Iterator, List
+
+from metrics import observe_stage, stage_timer
+from single_flight import SingleFlight
+from ttl_cache import TTLCache, make_cache_key
 
 class LlmInterface:
-    def __init__(self, model_name: str):
+    def __init__(self, model_name: str, cache_size: int = 1000, cache_bytes: int = 32 * 2**20,
+                 cache_ttl: float = 300.0, engine=None, max_new_tokens: int = 256):
         self.model_name = model_name
-        self._cache = {}
-        self._cache_lock = threading.Lock()
-        self._last_cleanup = time.time()
-        self._cleanup_interval = 300
+        # Local continuous-batching GenerationEngine; None leaves generation unimplemented
+        self.engine = engine
+        self.max_new_tokens = max_new_tokens
+        self._cache = TTLCache(max_entries=cache_size, max_bytes=cache_bytes, ttl=cache_ttl)
+        self._flight = SingleFlight()
+        self.flight_timeout = 120.0
         
         if not model_name or not isinstance(model_name, str):
             raise ValueError("Invalid model name")
@@ -23,60 +29,156 @@ class LlmInterface:
             if not context:
                 context = "No context available"
             
-            cache_key = f"{query[:50]}_{hash(context) % 1000}"
-            
-            with self._cache_lock:
-                if cache_key in self._cache:
-                    cached_result = self._cache[cache_key]
-                    if isinstance(cached_result, dict):
-                        return cached_result.get('response', 'Cached response error')
-                    return cached_result
-            
-            try:
-                response = self._generate_response(query, context)
-            except AttributeError:
-                response = f"Generated response for: {query[:30]}... (using context: {len(context)} chars)"
-            
-            if time.time() - self._last_cleanup > self._cleanup_interval:
-                self._cleanup_cache()
-                self._last_cleanup = time.time()
-            
-            cache_entry = {
-                'query': query,
-                'context': context,
-                'response': response,
-                'timestamp': time.time()
-                }
-            
-            with self._cache_lock:
-                self._cache[cache_key] = cache_entry
-            
-            return response
+            cache_key = make_cache_key(self.model_name, query, context)
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+            # Concurrent identical prompts share one generation
+            return self._flight.do(cache_key, lambda: self._generate_and_cache(query, context, cache_key),
+                                   timeout=self.flight_timeout)
             
         except Exception as e:
             print(f"Error in LLM query: {e}")
             return f"Error processing query: {str(e)}"
     
+    def stream(self, query: str, context: str) -> Iterator[str]:
+        """Like query(), but yields the answer in pieces as it is generated.
+
+        Cached answers, and backends without a local engine, arrive as one piece.
+        """
+        if not query:
+            yield "Empty query provided"
+            return
+        if not context:
+            context = "No context available"
+
+        cache_key = make_cache_key(self.model_name, query, context)
+        cached = self._cache.get(cache_key)
+        if cached is not None or self.engine is None:
+            yield cached if cached is not None else self.query(query, context)
+            return
+
+        pieces = []
+        start = time.perf_counter()
+        for piece in self.engine.stream(self._prompt(query, context), max_new_tokens=self.max_new_tokens):
+            if not pieces:
+                piece = piece.lstrip()
+                if not piece:
+                    continue
+            pieces.append(piece)
+            yield piece
+        observe_stage('generate', time.perf_counter() - start)
+        self._cache.put(cache_key, "".join(pieces).strip())
+
+    def submit_batch(self, queries: List[str], contexts: List[str]) -> List[Future]:
+        """Start answering many (query, context) pairs at once; one future per pair, in order.
+
+        With a local engine every uncached prompt is queued together, so
+        continuous batching decodes them side by side; identical prompts
+        share one request. Futures resolve to the answer text, or to an
+        error message as query() returns one. Cancelling a future cancels
+        its generation.
+        """
+        futures: List[Future] = []
+        started: Dict[str, Future] = {}
+        for query, context in zip(queries, contexts):
+            context = context or "No context available"
+            cache_key = make_cache_key(self.model_name, query, context)
+            cached = self._cache.get(cache_key)
+            future: Future = Future()
+            if cached is not None or not query or self.engine is None:
+                future.set_result(cached if cached is not None else self.query(query, context))
+            else:
+                if cache_key not in started:
+                    started[cache_key] = self.engine.submit(self._prompt(query, context),
+                                                            max_new_tokens=self.max_new_tokens)
+                    self._time_generation(started[cache_key])
+                self._chain(started[cache_key], future, cache_key)
+            futures.append(future)
+        return futures
+
+    @staticmethod
+    def _time_generation(generation: Future):
+        start = time.perf_counter()
+        generation.add_done_callback(
+            lambda f: f.cancelled() or observe_stage('generate', time.perf_counter() - start))
+
+    def _chain(self, generation: Future, future: Future, cache_key: str):
+        def finish(done: Future):
+            if future.cancelled():
+                return
+            try:
+                response = done.result().strip()
+                self._cache.put(cache_key, response)
+            except Exception as e:
+                print(f"Error in LLM query: {e}")
+                response = f"Error processing query: {str(e)}"
+            try:
+                future.set_result(response)
+            except InvalidStateError:
+                # Cancelled by the caller
+                pass
+
+        future.add_done_callback(lambda f: f.cancelled() and generation.cancel())
+        generation.add_done_callback(finish)
+
+    def _generate_and_cache(self, query: str, context: str, cache_key: str) -> str:
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            return cached
+        try:
+            response = self._generate_response(query, context)
+        except AttributeError:
+            response = f"Generated response for: {query[:30]}... (using context: {len(context)} chars)"
+        self._cache.put(cache_key, response)
+        return response
+
     def _generate_response(self, query: str, context: str) -> str:
-        raise NotImplementedError("LLM generation not implemented")
-    
-    def _cleanup_cache(self):
-        current_time = time.time()
-        with self._cache_lock:
-            self._cache = {
-                k: v for k, v in self._cache.items()
-                if current_time - v.get('timestamp', 0) < self._cleanup_interval
-            }
+        if self.engine is None:
+            raise NotImplementedError("LLM generation not implemented")
+        with stage_timer('generate'):
+            return self.engine.generate(self._prompt(query, context), max_new_tokens=self.max_new_tokens,
+                                        timeout=self.flight_timeout).strip()
+
+    @staticmethod
+    def _format_prompt(query: str, context: str) -> str:
+        # Context first, so repeated contexts share the engine's prefix cache
+        return f"Context: {context}\n\nQuery: {query}\n\nAnswer:"
+
+    def _prompt(self, query: str, context: str) -> str:
+        """The prompt for the engine, with the end of the context cut so the
+        template, the query and max_new_tokens of answer fit the model."""
+        prompt = self._format_prompt(query, context)
+        if self.engine is None:
+            return prompt
+        tokenizer = self.engine.tokenizer
+        budget = self.engine.prompt_budget(self.max_new_tokens)
+        overflow = len(tokenizer.encode(prompt)) - budget
+        context_ids = tokenizer.encode(context, add_special_tokens=False) if overflow > 0 else []
+        # Re-encoding can merge tokens at the cut, so check again
+        while overflow > 0 and context_ids:
+            context_ids = context_ids[:max(0, len(context_ids) - overflow)]
+            prompt = self._format_prompt(query, tokenizer.decode(context_ids, skip_special_tokens=True))
+            overflow = len(tokenizer.encode(prompt)) - budget
+        return prompt
+
+    def max_context_tokens(self) -> Optional[int]:
+        """Context tokens the engine's model leaves after the template and answer, or None without an engine."""
+        if self.engine is None:
+            return None
+        template = len(self.engine.tokenizer.encode(self._format_prompt("", "")))
+        return max(0, self.engine.prompt_budget(self.max_new_tokens) - template)
+
+    @property
+    def tokenizer(self):
+        return self.engine.tokenizer if self.engine is not None else None
     
     def get_cache_stats(self) -> Dict[str, Any]:
-        return {
-            'size': len(self._cache),
-            'last_cleanup': self._last_cleanup,
-            'cleanup_interval': self._cleanup_interval
-        }
-    
-    def clear_cache(self):
-        with self._cache_lock:
-            old_cache = self._cache
-            self._cache = {}
-            return len(old_cache)
+        return {**self._cache.get_stats(), 'single_flight': self._flight.get_stats()}
+
+    def get_engine_stats(self) -> Optional[Dict[str, Any]]:
+        return self.engine.get_stats() if self.engine is not None else None
+
+    def clear_cache(self) -> int:
+        return self._cache.clear()
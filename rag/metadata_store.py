@@ -0,0 +1,162 @@
+import datetime
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+FILTERABLE_ATTRIBUTES = ('source', 'tenant', 'date')
+_SCALAR_TYPES = (str, int, float, bool)
+
+
+def validate_filters(filters: Any, attributes: Tuple[str, ...] = FILTERABLE_ATTRIBUTES):
+    """Raise ValueError unless filters is a dict filter_bitmap() accepts."""
+    if filters is None:
+        return
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object")
+    for attr, wanted in filters.items():
+        if attr not in attributes:
+            raise ValueError(f"Unknown filter attribute: {attr} (expected one of {', '.join(attributes)})")
+        if isinstance(wanted, dict):
+            if attr != 'date':
+                raise ValueError(f"Range filters are only supported on date, not {attr}")
+            unknown = set(wanted) - {'from', 'to'}
+            if unknown:
+                raise ValueError(f"Unknown date bound: {', '.join(sorted(unknown))}")
+            for bound in wanted.values():
+                if bound is not None and not isinstance(bound, str):
+                    raise ValueError("Date bounds must be ISO date strings")
+        elif isinstance(wanted, (list, tuple, set)):
+            if not all(isinstance(value, _SCALAR_TYPES) for value in wanted):
+                raise ValueError(f"Values of filter {attr} must be strings or numbers")
+        elif not isinstance(wanted, _SCALAR_TYPES):
+            raise ValueError(f"Filter {attr} must be a value, a list of values or a date range")
+
+
+class MetadataStore:
+    """Per-chunk attributes with a precomputed id bitmap per attribute value.
+
+    Bitmaps are packed little-endian bit arrays indexed by chunk id, the
+    layout faiss.IDSelectorBitmap expects, so a filter is resolved with a
+    few vectorised OR/AND passes over id_space / 8 bytes and handed to
+    FAISS without materialising id lists.
+    """
+
+    def __init__(self, attributes: Tuple[str, ...] = FILTERABLE_ATTRIBUTES):
+        self.attributes = attributes
+        self._metadata: Dict[int, Dict[str, Any]] = {}
+        # The attribute values each chunk is set under in the bitmaps
+        self._indexed: Dict[int, Dict[str, Any]] = {}
+        self._bitmaps: Dict[str, Dict[Any, np.ndarray]] = {attr: {} for attr in attributes}
+        self._counts: Dict[str, Dict[Any, int]] = {attr: {} for attr in attributes}
+        self._num_bytes = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._metadata)
+
+    def get(self, chunk_id: int) -> Optional[Dict[str, Any]]:
+        return self._metadata.get(chunk_id)
+
+    def items(self):
+        with self._lock:
+            return list(self._metadata.items())
+
+    def add(self, chunk_id: int, metadata: Dict[str, Any]):
+        with self._lock:
+            if chunk_id in self._metadata:
+                self.remove([chunk_id])
+            self._metadata[chunk_id] = metadata
+            # Copied so removal clears these bits even if the caller changes metadata later
+            indexed = {attr: metadata[attr] for attr in self.attributes if metadata.get(attr) is not None}
+            self._indexed[chunk_id] = indexed
+            self._ensure_capacity(chunk_id)
+            byte, bit = chunk_id >> 3, np.uint8(1 << (chunk_id & 7))
+            for attr, value in indexed.items():
+                bitmap = self._bitmaps[attr].get(value)
+                if bitmap is None:
+                    bitmap = np.zeros(self._num_bytes, dtype=np.uint8)
+                    self._bitmaps[attr][value] = bitmap
+                bitmap[byte] |= bit
+                self._counts[attr][value] = self._counts[attr].get(value, 0) + 1
+
+    def remove(self, chunk_ids: Iterable[int]):
+        with self._lock:
+            for chunk_id in chunk_ids:
+                if self._metadata.pop(chunk_id, None) is None:
+                    continue
+                byte, bit = chunk_id >> 3, np.uint8(~(1 << (chunk_id & 7)) & 0xFF)
+                for attr, value in self._indexed.pop(chunk_id).items():
+                    bitmap = self._bitmaps[attr].get(value)
+                    if bitmap is None:
+                        continue
+                    bitmap[byte] &= bit
+                    self._counts[attr][value] -= 1
+                    if not self._counts[attr][value]:
+                        del self._bitmaps[attr][value]
+                        del self._counts[attr][value]
+
+    def values(self, attr: str) -> List[Any]:
+        with self._lock:
+            return sorted(self._bitmaps.get(attr, {}))
+
+    def filter_bitmap(self, filters: Dict[str, Any]) -> np.ndarray:
+        """Packed bitmap of the chunk ids matching every filter.
+
+        Each filter value may be a single value, a list of values (any of),
+        or for 'date' a dict with optional 'from'/'to' bounds (inclusive,
+        ISO date strings compare correctly as text).
+        """
+        validate_filters(filters, self.attributes)
+        with self._lock:
+            result = None
+            for attr, wanted in filters.items():
+                values = self._matching_values(attr, wanted)
+                combined = np.zeros(self._num_bytes, dtype=np.uint8)
+                for value in values:
+                    np.bitwise_or(combined, self._bitmaps[attr][value], out=combined)
+                result = combined if result is None else np.bitwise_and(result, combined, out=result)
+            if result is None:
+                result = np.full(self._num_bytes, 0xFF, dtype=np.uint8)
+            return result
+
+    @staticmethod
+    def to_mask(bitmap: np.ndarray) -> np.ndarray:
+        """Unpack a bitmap into a boolean mask indexed by chunk id."""
+        return np.unpackbits(bitmap, bitorder='little').astype(bool)
+
+    def _matching_values(self, attr: str, wanted) -> List[Any]:
+        known = self._bitmaps[attr]
+        if isinstance(wanted, dict):
+            low, high = wanted.get('from'), wanted.get('to')
+            return [v for v in known if (low is None or v >= low) and (high is None or v <= high)]
+        if isinstance(wanted, (list, tuple, set)):
+            return [v for v in wanted if v in known]
+        return [wanted] if wanted in known else []
+
+    def _ensure_capacity(self, chunk_id: int):
+        needed = (chunk_id >> 3) + 1
+        if needed <= self._num_bytes:
+            return
+        new_size = max(needed, self._num_bytes * 2, 1024)
+        for values in self._bitmaps.values():
+            for value, bitmap in values.items():
+                grown = np.zeros(new_size, dtype=np.uint8)
+                grown[:len(bitmap)] = bitmap
+                values[value] = grown
+        self._num_bytes = new_size
+
+
+def default_chunk_attributes(path: str, stat, doc_root: str) -> Dict[str, Any]:
+    """Derive filterable attributes for a file: the top-level folder under the
+    document root is its tenant, and its modification date is its date."""
+    tenant = 'default'
+    if os.path.isdir(doc_root):
+        parts = os.path.relpath(path, doc_root).split(os.sep)
+        if len(parts) > 1:
+            tenant = parts[0]
+    return {
+        'tenant': tenant,
+        'date': datetime.date.fromtimestamp(stat.st_mtime).isoformat(),
+    }
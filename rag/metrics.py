@@ -0,0 +1,217 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+from tracing import tracer
+
+# Seconds; spans a sub-millisecond cache hit to a long generation
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# A collector returns (name, type, help, [(labels, value), ...]) families
+Family = Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]
+
+
+def _format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            return [(self.name, self._labels(k), v) for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            return [(self.name, self._labels(k), v) for k, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; an observation is one bisect and three additions."""
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (last one is +Inf), then sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][slot] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            values = [(k, list(counts), total) for k, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', {**labels, 'le': _format_value(bound)}, cumulative))
+            samples.append((self.name + '_sum', labels, total))
+            samples.append((self.name + '_count', labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """Process-wide metrics, rendered in the Prometheus text format.
+
+    Hot paths record into Counter, Gauge and Histogram objects. State that
+    components already track (cache hit counts, queue depths, Raft
+    indexes) is read at scrape time by collectors, so it costs nothing
+    between scrapes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.type}")
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        """name should end in _total."""
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def add_collector(self, collector: Callable[[], Iterable[Family]]):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], Iterable[Family]]):
+        with self._lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines: List[str] = []
+        for metric in metrics:
+            samples = metric.samples()
+            if samples:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.type}")
+                lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in samples)
+        families: Dict[str, Family] = {}
+        for collector in collectors:
+            try:
+                for name, kind, help, samples in collector():
+                    if name in families:
+                        families[name][3].extend(samples)
+                    else:
+                        families[name] = (name, kind, help, list(samples))
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+        for name, kind, help, samples in families.values():
+            samples = [(labels, value) for labels, value in samples if value is not None]
+            if samples:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+# Latency of each stage of a query and of index replication
+stage_seconds = registry.histogram('rag_stage_seconds', 'Time spent in each pipeline and Raft stage', ['stage'])
+
+
+def observe_stage(stage: str, seconds: float):
+    stage_seconds.observe(seconds, stage=stage)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Context manager recording its block's duration under stage.
+
+    Inside a sampled trace the block is also a span named after the stage.
+    """
+    start = time.perf_counter()
+    try:
+        with tracer.span(stage):
+            yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
@@ -0,0 +1,104 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-item calls into batched calls.
+
+    Callers submit one item and block on a Future. A background thread takes
+    the first waiting item, keeps collecting until max_batch_size items are
+    queued or max_wait_ms has passed, then hands the whole group to
+    process_fn, which must return one result per item in the same order.
+    If a batched call fails, its items are retried one at a time, so one
+    bad item fails only its own caller.
+    """
+
+    def __init__(self, process_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, name: str = "micro-batcher"):
+        self.process_fn = process_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item: Any) -> Future:
+        if self._closed:
+            raise RuntimeError("MicroBatcher is closed")
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item: Any, timeout: float = None) -> Any:
+        return self.submit(item).result(timeout=timeout)
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join(timeout=5)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                'batches': self.batches,
+                'items': self.items,
+                'avg_batch_size': self.items / self.batches if self.batches else 0.0,
+                'queue_depth': self._queue.qsize(),
+            }
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if entry is None:
+                    self._closed = True
+                    break
+                batch.append(entry)
+
+            # Callers that gave up (cancelled futures) are dropped from the batch
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if batch:
+                self._process(batch)
+            if self._closed and self._queue.empty():
+                return
+
+    def _process(self, batch):
+        try:
+            results = self._call([item for item, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            for entry in batch:
+                self._process([entry])
+            return
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+        with self._stats_lock:
+            self.batches += 1
+            self.items += len(batch)
+
+    def _call(self, items: List[Any]) -> List[Any]:
+        results = self.process_fn(items)
+        if len(results) != len(items):
+            raise RuntimeError(f"process_fn returned {len(results)} results for {len(items)} items")
+        return results
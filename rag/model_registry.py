@@ -0,0 +1,141 @@
+import gc
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from encoder_backends import load_encoder
+
+
+def _model_bytes(model) -> int:
+    """Best-effort size of a model's weights: torch parameters and buffers, or ONNX files."""
+    modules = [getattr(model, 'model', None), model]
+    for module in modules:
+        if module is not None and hasattr(module, 'parameters'):
+            try:
+                size = sum(p.numel() * p.element_size() for p in module.parameters())
+                size += sum(b.numel() * b.element_size() for b in module.buffers())
+                # Dynamically quantized Linear layers keep packed weights outside parameters()
+                for sub in module.modules():
+                    packed = getattr(sub, '_packed_params', None)
+                    if packed is not None and hasattr(packed, '_weight_bias'):
+                        weight, bias = packed._weight_bias()
+                        size += weight.numel() * weight.element_size()
+                        size += bias.numel() * bias.element_size() if bias is not None else 0
+                return size
+            except Exception:
+                pass
+    model_path = getattr(model, 'model_path', None)
+    if model_path and os.path.exists(model_path):
+        return os.path.getsize(model_path)
+    return 0
+
+
+def process_rss_bytes() -> int:
+    """Current resident set size of this process (Linux), 0 if unavailable."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class ModelRegistry:
+    """Process-wide registry that loads each model once and shares it.
+
+    Models are keyed by (kind, name, options). Loading holds a per-key lock,
+    so concurrent first requests for the same model wait for one load while
+    different models can load in parallel. Call preload() before forking
+    worker processes so children share the weights copy-on-write.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Tuple, threading.Lock] = {}
+        self._models: Dict[Tuple, Dict[str, Any]] = {}
+
+    def get(self, kind: str, name: str, loader: Callable[[], Any], **options) -> Any:
+        key = (kind, name, tuple(sorted(options.items())))
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None:
+                entry['users'] += 1
+                return entry['model']
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            entry = self._models.get(key)
+            if entry is None:
+                start = time.perf_counter()
+                model = loader()
+                entry = {
+                    'model': model,
+                    'load_s': time.perf_counter() - start,
+                    'weight_bytes': _model_bytes(model),
+                    'users': 0,
+                }
+                print(f"Loaded {kind} model {name} in {entry['load_s']:.1f}s")
+            with self._lock:
+                self._models[key] = entry
+                entry['users'] += 1
+            return entry['model']
+
+    def get_encoder(self, model_name: str, backend: Optional[str] = None):
+        backend = backend or os.environ.get('RAG_ENCODER_BACKEND', 'torch')
+        return self.get('encoder', model_name, lambda: load_encoder(model_name, backend), backend=backend)
+
+    def get_causal_lm(self, model_name: str):
+        """(tokenizer, model) for a Hugging Face causal LM, in eval mode."""
+        def load():
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            model = AutoModelForCausalLM.from_pretrained(model_name)
+            model.eval()
+            return tokenizer, model
+        return self.get('causal_lm', model_name, load)
+
+    def preload(self, encoders: List[Tuple[str, Optional[str]]] = (), causal_lms: List[str] = ()):
+        """Load models up front, then freeze the GC so forked workers keep sharing their pages."""
+        for model_name, backend in encoders:
+            self.get_encoder(model_name, backend)
+        for model_name in causal_lms:
+            self.get_causal_lm(model_name)
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+    def release(self, kind: str, name: str):
+        with self._lock:
+            for key in [k for k in self._models if k[0] == kind and k[1] == name]:
+                del self._models[key]
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = [
+                {
+                    'kind': kind,
+                    'name': name,
+                    'options': dict(options),
+                    'load_s': entry['load_s'],
+                    'weight_mb': entry['weight_bytes'] / 2**20,
+                    'users': entry['users'],
+                }
+                for (kind, name, options), entry in self._models.items()
+            ]
+        return {'models': models, 'process_rss_mb': process_rss_bytes() / 2**20}
+
+
+registry = ModelRegistry()
+
+
+def get_encoder(model_name: str, backend: Optional[str] = None):
+    return registry.get_encoder(model_name, backend)
+
+
+def get_causal_lm(model_name: str):
+    return registry.get_causal_lm(model_name)
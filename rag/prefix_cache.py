@@ -0,0 +1,127 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def _kv_bytes(past) -> int:
+    return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in past)
+
+
+class PrefixKVCache:
+    """LRU cache of transformer past-key-values for prompt prefixes.
+
+    Prefixes are cached at block_tokens boundaries. Each entry holds the KV
+    tensors of one block-aligned prefix, and every boundary inside it is
+    indexed by the hash of the token ids up to that point. Any prompt that
+    shares a block-aligned prefix with a cached one can therefore resume
+    from a slice of that entry. Entries are evicted least recently used
+    once their tensors exceed max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2**20, block_tokens: int = 32):
+        self.max_bytes = max_bytes
+        self.block_tokens = block_tokens
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # key -> {past, length, boundaries, bytes}
+        self._boundaries: Dict[str, Dict[str, None]] = {}  # prefix hash -> keys of entries containing it
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.evictions = 0
+
+    def _prefix_hashes(self, token_ids: List[int], max_len: int) -> List[Tuple[int, str]]:
+        """(length, hash) for every block boundary up to max_len, shortest first."""
+        digest = hashlib.sha256()
+        tokens = np.asarray(token_ids[:max_len], dtype=np.int64)
+        hashes = []
+        for end in range(self.block_tokens, max_len + 1, self.block_tokens):
+            digest.update(tokens[end - self.block_tokens:end].tobytes())
+            hashes.append((end, digest.copy().hexdigest()))
+        return hashes
+
+    def lookup(self, token_ids: List[int]) -> Tuple[int, Optional[tuple]]:
+        """Longest cached prefix strictly shorter than token_ids: (length, past) or (0, None).
+
+        At least one token is always left over so the caller still gets
+        logits for the next position.
+        """
+        hashes = self._prefix_hashes(token_ids, len(token_ids) - 1)
+        with self._lock:
+            for length, prefix_hash in reversed(hashes):
+                holders = self._boundaries.get(prefix_hash)
+                if not holders:
+                    continue
+                key = next(reversed(holders))
+                entry = self._entries[key]
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.reused_tokens += length
+                past = entry['past']
+                if length < entry['length']:
+                    past = tuple((k[:, :, :length, :], v[:, :, :length, :]) for k, v in past)
+                return length, past
+            self.misses += 1
+            return 0, None
+
+    def put(self, token_ids: List[int], past: tuple, cached_len: int = 0):
+        """Cache the longest block-aligned prefix of token_ids covered by past.
+
+        Nothing is stored when it would not extend the cached_len the
+        caller already resumed from.
+        """
+        kv_len = past[0][0].shape[2]
+        length = min(kv_len, len(token_ids) - 1) // self.block_tokens * self.block_tokens
+        if length <= cached_len:
+            return
+        hashes = self._prefix_hashes(token_ids, length)
+        key = hashes[-1][1]
+        # Clone the slice so the entry does not pin the full prompt's tensors
+        stored = tuple((k[:, :, :length, :].clone(), v[:, :, :length, :].clone()) for k, v in past)
+        size = _kv_bytes(stored)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = {'past': stored, 'length': length, 'boundaries': hashes, 'bytes': size}
+            for _, prefix_hash in hashes:
+                self._boundaries.setdefault(prefix_hash, {})[key] = None
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                self._evict_oldest()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._boundaries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'reused_tokens': self.reused_tokens,
+                'evictions': self.evictions,
+            }
+
+    def _evict_oldest(self):
+        key, entry = self._entries.popitem(last=False)
+        self._bytes -= entry['bytes']
+        self.evictions += 1
+        for _, prefix_hash in entry['boundaries']:
+            holders = self._boundaries.get(prefix_hash)
+            if holders is not None:
+                holders.pop(key, None)
+                if not holders:
+                    del self._boundaries[prefix_hash]
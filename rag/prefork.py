@@ -0,0 +1,186 @@
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+def limit_threads(num_threads: int):
+    """Cap the native thread pools of libraries this worker has already imported."""
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(num_threads)
+    faiss = sys.modules.get('faiss')
+    if faiss is not None and hasattr(faiss, 'omp_set_num_threads'):
+        faiss.omp_set_num_threads(num_threads)
+
+
+class WorkerSupervisor:
+    """Coordinator side of prefork serving.
+
+    Forks `workers` serving processes, each running target(worker_id, conn)
+    with a duplex pipe back to the coordinator. Fork them after models are
+    preloaded (weights are then shared copy-on-write) but before starting
+    gRPC or other threads, which do not survive a fork.
+
+    The coordinator keeps a small state dict (leadership, running flag,
+    current snapshot) and broadcasts it to every worker whenever it
+    changes. Workers send control actions back, e.g. a /stop received by
+    one worker, and these are handed to on_control.
+    """
+
+    def __init__(self, workers: int, target: Callable[[int, Any], None]):
+        self.workers = workers
+        self.target = target
+        self.on_control: Optional[Callable[[str], None]] = None
+        self.state: Dict[str, Any] = {}
+        self._context = multiprocessing.get_context('fork')
+        self._processes: List[Any] = []
+        self._conns: List[Any] = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start(self):
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        for worker_id in range(self.workers):
+            parent_conn, child_conn = self._context.Pipe()
+            process = self._context.Process(target=self._run_worker, args=(worker_id, child_conn, threads),
+                                            name=f"rag-worker-{worker_id}")
+            process.start()
+            child_conn.close()
+            self._processes.append(process)
+            self._conns.append(parent_conn)
+            threading.Thread(target=self._listen, args=(worker_id, parent_conn),
+                             name=f"rag-worker-{worker_id}-control", daemon=True).start()
+        print(f"Started {self.workers} serving workers: {[p.pid for p in self._processes]}")
+
+    def _run_worker(self, worker_id: int, conn, threads: int):
+        limit_threads(threads)
+        self.target(worker_id, conn)
+
+    def update(self, **changes):
+        """Merge changes into the shared state and broadcast it if anything changed."""
+        with self._lock:
+            if all(self.state.get(k) == v for k, v in changes.items()):
+                return
+            self.state.update(changes)
+            message = {'type': 'state', 'state': dict(self.state)}
+            for worker_id, conn in enumerate(self._conns):
+                try:
+                    conn.send(message)
+                except (BrokenPipeError, OSError) as e:
+                    print(f"Worker {worker_id} unreachable: {e}")
+
+    def watch(self, state_fn: Callable[[], Dict[str, Any]], interval: float = 0.5):
+        """Poll state_fn() in the background and broadcast changes."""
+        def poll():
+            while not self._stopping.wait(interval):
+                try:
+                    self.update(**state_fn())
+                except Exception as e:
+                    print(f"Error polling coordinator state: {e}")
+        self.update(**state_fn())
+        threading.Thread(target=poll, name="rag-worker-state", daemon=True).start()
+
+    def join(self):
+        """Block until every worker has exited."""
+        try:
+            while any(p.is_alive() for p in self._processes):
+                for worker_id, process in enumerate(self._processes):
+                    process.join(timeout=1.0)
+                    if process.exitcode not in (None, 0) and not self._stopping.is_set():
+                        print(f"Worker {worker_id} (pid {process.pid}) exited with code {process.exitcode}")
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping.set()
+        with self._lock:
+            for conn in self._conns:
+                try:
+                    conn.send({'type': 'shutdown'})
+                except (BrokenPipeError, OSError):
+                    pass
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(timeout=max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'workers': [{'pid': p.pid, 'alive': p.is_alive()} for p in self._processes],
+            'state': dict(self.state),
+        }
+
+    def _listen(self, worker_id: int, conn):
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            if message.get('type') == 'control' and self.on_control is not None:
+                try:
+                    self.on_control(message['action'])
+                except Exception as e:
+                    print(f"Error handling {message['action']} from worker {worker_id}: {e}")
+
+
+class CoordinatorLink:
+    """Worker side of prefork serving.
+
+    Mirrors the coordinator's state and stands in for the Raft node in the
+    worker's Pipeline: is_leader() reports the coordinator's leadership.
+    on_state callbacks run on every broadcast. on_shutdown runs when the
+    coordinator asks the worker to exit or goes away; wait_for() then
+    raises ConnectionError.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._send_lock = threading.Lock()
+        self._changed = threading.Condition()
+        self.state: Dict[str, Any] = {}
+        self.closed = False
+        self.on_state: List[Callable[[Dict[str, Any]], None]] = []
+        self.on_shutdown: List[Callable[[], None]] = []
+        threading.Thread(target=self._listen, name="coordinator-link", daemon=True).start()
+
+    def is_leader(self) -> bool:
+        return bool(self.state.get('is_leader'))
+
+    def request(self, action: str):
+        with self._send_lock:
+            self._conn.send({'type': 'control', 'action': action})
+
+    def wait_for(self, key: str, timeout: Optional[float] = None) -> Any:
+        """Block until the coordinator has published key; returns its value."""
+        with self._changed:
+            if not self._changed.wait_for(lambda: key in self.state or self.closed, timeout=timeout):
+                raise TimeoutError(f"Coordinator did not publish {key} within {timeout}s")
+            if key not in self.state:
+                raise ConnectionError(f"Coordinator shut down before publishing {key}")
+            return self.state[key]
+
+    def _listen(self):
+        while True:
+            try:
+                message = self._conn.recv()
+            except (EOFError, OSError):
+                message = {'type': 'shutdown'}
+            if message['type'] == 'shutdown':
+                with self._changed:
+                    self.closed = True
+                    self._changed.notify_all()
+                for callback in self.on_shutdown:
+                    callback()
+                return
+            with self._changed:
+                self.state = message['state']
+                self._changed.notify_all()
+            for callback in self.on_state:
+                try:
+                    callback(self.state)
+                except Exception as e:
+                    print(f"Error applying coordinator state: {e}")
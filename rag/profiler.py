@@ -0,0 +1,224 @@
+import cProfile
+import io
+import linecache
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, Optional
+
+# Leaf frames of threads parked on a lock, queue, socket or selector; dropped
+# from samples unless include_idle is set, so flame graphs show work
+IDLE_LEAVES = {
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'),
+    ('selectors.py', 'select'),
+    ('socket.py', 'accept'),
+    ('connection.py', '_recv'),
+    ('connection.py', 'poll'),
+    ('base_events.py', '_run_once'),
+    ('thread.py', '_worker'),
+}
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Wall-clock stack sampler for every thread in the process.
+
+    A daemon thread reads all stacks through sys._current_frames() every
+    interval seconds and counts each distinct stack. Nothing is installed
+    in the profiled threads, so the cost is the sampler thread alone and
+    nothing at all when it is not running. collapsed() returns the counts
+    in the "frame;frame;frame count" format that flamegraph.pl and
+    speedscope read.
+    """
+
+    def __init__(self, interval: float = 0.005, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.samples = 0
+        self._stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                code = frame.f_code
+                if not self.include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                self._stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+
+class CProfileSession:
+    """Deterministic cProfile of the whole process for a window.
+
+    From Python 3.12 cProfile is built on sys.monitoring and one enabled
+    Profile sees every thread; before that it would only see the thread
+    that started it, which here is never the one doing the work.
+    """
+
+    def __init__(self):
+        if not hasattr(sys, 'monitoring'):
+            raise RuntimeError("cProfile across threads needs Python 3.12+; use the sampling profiler instead")
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def report(self, sort: str = 'cumulative', limit: int = 60) -> str:
+        out = io.StringIO()
+        try:
+            pstats.Stats(self._profile, stream=out).sort_stats(sort).print_stats(limit)
+        except TypeError:
+            return "No calls profiled\n"
+        return out.getvalue()
+
+
+class ProfilerBusyError(RuntimeError):
+    """Raised when a profiling window is requested while another is running."""
+
+
+class ProfilerControl:
+    """One profiling window at a time, stopped after its duration or on request.
+
+    mode is "sample" (collapsed stacks) or "cprofile" (pstats report). The
+    last finished window's output is kept until the next one starts.
+    """
+
+    MODES = ('sample', 'cprofile')
+
+    def __init__(self, max_duration: float = 300.0):
+        self.max_duration = max_duration
+        self._lock = threading.Lock()
+        self._session = None
+        self._timer: Optional[threading.Timer] = None
+        self._info: Dict[str, Any] = {}
+        self._result: Optional[str] = None
+
+    def start(self, mode: str = 'sample', duration: float = 30.0, interval_ms: float = 5.0,
+              include_idle: bool = False) -> Dict[str, Any]:
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown profiler mode: {mode}")
+        if not 0 < duration <= self.max_duration:
+            raise ValueError(f"duration must be in (0, {self.max_duration}] seconds")
+        with self._lock:
+            if self._session is not None:
+                raise ProfilerBusyError(f"A {self._info['mode']} profile is already running")
+            session = SamplingProfiler(interval_ms / 1000.0, include_idle) if mode == 'sample' else CProfileSession()
+            session.start()
+            self._session, self._result = session, None
+            self._info = {'mode': mode, 'started_at': time.time(), 'duration': duration}
+            self._timer = threading.Timer(duration, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+            return self.status()
+
+    def stop(self) -> Optional[str]:
+        """End the running window, if any, and return the latest result."""
+        with self._lock:
+            session, self._session = self._session, None
+            if session is None:
+                return self._result
+            if self._timer is not None:
+                self._timer.cancel()
+            session.stop()
+            self._info['stopped_at'] = time.time()
+            if isinstance(session, SamplingProfiler):
+                self._info['samples'] = session.samples
+                self._result = session.collapsed()
+            else:
+                self._result = session.report()
+            return self._result
+
+    def result(self) -> Optional[str]:
+        with self._lock:
+            return self._result
+
+    def status(self) -> Dict[str, Any]:
+        return {**self._info, 'running': self._session is not None, 'has_result': self._result is not None}
+
+
+class MemoryTracker:
+    """tracemalloc snapshots, each compared with the previous one.
+
+    Tracing slows every allocation, so it only runs between start() and
+    stop(). snapshot() reports the top allocation sites and, from the
+    second call on, the sites that grew most since the previous snapshot.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._previous: Optional[tracemalloc.Snapshot] = None
+
+    def start(self, frames: int = 1):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self._previous = None
+
+    def stop(self):
+        with self._lock:
+            tracemalloc.stop()
+            self._previous = None
+
+    def snapshot(self, limit: int = 25, key: str = 'lineno') -> Dict[str, Any]:
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("Memory tracing is not running")
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, linecache.__file__),
+            ])
+            previous, self._previous = self._previous, snapshot
+        current, peak = tracemalloc.get_traced_memory()
+        report = {
+            'traced_bytes': current,
+            'peak_bytes': peak,
+            'top': [self._stat(stat) for stat in snapshot.statistics(key)[:limit]],
+        }
+        if previous is not None:
+            report['growth'] = [self._stat(stat) for stat in snapshot.compare_to(previous, key)[:limit]
+                                if stat.size_diff > 0]
+        return report
+
+    @staticmethod
+    def _stat(stat) -> Dict[str, Any]:
+        frame = stat.traceback[0]
+        entry = {'location': f"{frame.filename}:{frame.lineno}", 'bytes': stat.size, 'count': stat.count}
+        if hasattr(stat, 'size_diff'):
+            entry['bytes_diff'] = stat.size_diff
+            entry['count_diff'] = stat.count_diff
+        return entry
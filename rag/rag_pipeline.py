@@ -1,5 +1,8 @@
 import sys
 import os
+import json
+import asyncio
+import tempfile
 import logging
 import threading
 import time
@@ -7,21 +10,38 @@ import time
 # Add the project root to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Request, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 import uvicorn
-from typing import List, Optional, Dict
+from typing import Any, List, Optional, Dict
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
 import grpc
 
+from bounded_executor import BoundedExecutor, ExecutorBusyError
 from context_fetcher import ContextFetcher
 from faiss_indexer import FaissIndexer
+from embedding_cache import EmbeddingCache
 from llm_interface import LlmInterface
+from metadata_store import validate_filters
+from metrics import observe_stage, registry as metrics
+from model_registry import registry as model_registry
+from semantic_cache import SemanticCache
+from generation_engine import get_generation_engine
+from index_snapshot import SnapshotPublisher
+from prefork import CoordinatorLink, WorkerSupervisor
+from profiler import MemoryTracker, ProfilerBusyError, ProfilerControl
+from single_flight import SingleFlight
+from tracing import TRACEPARENT, tracer
+from ttl_cache import make_cache_key
 from raft.raft_server import RaftNode
-from raft.raft_server import start_server
+from raft.raft_server import GRPC_OPTIONS, start_server
+import raft.service_pb2 as service_pb2
+import raft.service_pb2_grpc as service_pb2_grpc
 
 # Configure logging
 logging.basicConfig(
@@ -30,13 +50,32 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+http_request_seconds = metrics.histogram('rag_http_request_seconds', 'HTTP request latency until the response starts',
+                                         ['method', 'path', 'status'])
+not_leader_rejections = metrics.counter('rag_not_leader_rejections_total',
+                                        'Queries rejected because this node is not the leader')
+
 class QueryRequest(BaseModel):
     query: str = Field(..., description="The query string to process")
+    filters: Optional[Dict[str, Any]] = Field(
+        default=None,
+        description="Metadata filters on source, tenant or date, e.g. {\"tenant\": \"acme\", \"date\": {\"from\": \"2024-01-01\"}}"
+    )
+    route: str = Field(default="default", description="Traffic route; selects the semantic cache threshold")
 
 class QueryResponse(BaseModel):
     response: str
     status: str = Field(default="success")
 
+class BatchQueryRequest(BaseModel):
+    queries: List[QueryRequest] = Field(..., description="Queries to answer; results stream back in this order")
+
+class ProfileRequest(BaseModel):
+    mode: str = Field(default="sample", description="sample (collapsed stacks for flame graphs) or cprofile (pstats report)")
+    duration: float = Field(default=30.0, description="Seconds to profile before stopping automatically")
+    interval_ms: float = Field(default=5.0, description="Sampling interval")
+    include_idle: bool = Field(default=False, description="Keep samples of threads parked on locks, queues and sockets")
+
 class NodeConfig(BaseModel):
     node_id: int = Field(..., description="Unique identifier for the node")
     port: int = Field(..., description="Port number for the service")
@@ -44,47 +83,361 @@ class NodeConfig(BaseModel):
     embedding_model: str = Field(..., description="Name of the embedding model to use")
     doc_path: str = Field(..., description="Path to the document directory")
     llm_model: str = Field(..., description="Name of the language model to use")
+    index_dir: Optional[str] = Field(default=None, description="Directory to persist the index and its manifest")
+    watch_interval: Optional[float] = Field(default=None, description="Seconds between document directory polls")
+    embedding_cache_dir: Optional[str] = Field(default=None, description="Directory for the persistent embedding cache")
+    index_quantization: str = Field(default="none", description="FAISS scalar quantization: none, fp16 or int8")
+    store_dtype: str = Field(default="float32", description="Precision of the stored embeddings: float32, float16 or int8")
+    quantizer_train_size: int = Field(default=1024, description="Vectors to collect before int8 ranges are fitted; search is exact until then")
+    encoder_backend: str = Field(default="torch", description="Embedding backend: torch, torch-int8, onnx or onnx-int8")
+    semantic_cache_threshold: Optional[float] = Field(default=None, description="Cosine similarity at which a previous answer is reused; unset disables the semantic cache")
+    semantic_route_thresholds: Dict[str, float] = Field(default_factory=dict, description="Per-route overrides of the semantic cache threshold")
+    semantic_cache_audit_rate: float = Field(default=0.01, description="Fraction of semantic cache hits re-retrieved to check the cached context still matches")
+    context_token_budget: int = Field(default=1024, description="Maximum prompt tokens spent on retrieved context")
+    generation_model: Optional[str] = Field(default=None, description="Local Hugging Face causal LM to generate answers with; unset uses llm_model, which must then be one")
+    draft_model: Optional[str] = Field(default=None, description="Small causal LM proposing tokens for generation_model to verify; unset disables assisted decoding")
+    draft_tokens: int = Field(default=4, description="Tokens the draft model proposes per verification step")
+    search_workers: int = Field(default_factory=lambda: os.cpu_count() or 4, description="Threads for query embedding and index search")
+    search_queue: int = Field(default=64, description="Search requests allowed to wait for a thread before new ones are rejected")
+    generation_workers: int = Field(default=8, description="Threads waiting on generation; keep at least the engine's batch size")
+    generation_queue: int = Field(default=64, description="Generation requests allowed to wait for a thread before new ones are rejected")
+    batch_chunk_size: int = Field(default=64, description="Queries of a batch request retrieved and generated together")
+    max_batch_queries: int = Field(default=1024, description="Most queries accepted in one batch request")
+    query_grpc_port: Optional[int] = Field(default=None, description="Port of the gRPC QueryService; defaults to the HTTP port + 2000")
+    query_grpc_workers: int = Field(default=8, description="Threads answering QueryService RPCs, separate from the Raft server's")
+    query_grpc_queue: int = Field(default=32, description="QueryService RPCs allowed to wait for a thread before new ones are rejected")
+    serve_workers: int = Field(default=1, description="Serving processes; above 1, workers share memory-mapped index snapshots published by this process")
+    worker_snapshot_timeout: float = Field(default=600.0, description="Seconds a prefork worker waits for the coordinator's first snapshot before exiting")
+    trace_sample_rate: float = Field(default=0.01, description="Fraction of requests without a sampled traceparent that start a trace")
+    trace_buffer_spans: int = Field(default=10000, description="Finished spans kept in memory for /traces")
+    trace_file: Optional[str] = Field(default=None, description="JSON-lines file every finished span is also appended to; shared by prefork workers")
+
+def configure_tracing(config: NodeConfig, service: str):
+    tracer.configure(service, config.trace_sample_rate, config.trace_buffer_spans, config.trace_file)
+
+def load_generation_model(model_name: str):
+    """Load the causal LM answers are generated with, failing clearly if it is not one."""
+    try:
+        model_registry.get_causal_lm(model_name)
+    except Exception as e:
+        raise ValueError(f"Cannot generate answers with {model_name}: it does not load as a Hugging Face "
+                         f"causal LM. Set RAG_GENERATION_MODEL to one ({e})") from e
 
 
 class Pipeline:
-    def __init__(self, embedding_model_name, doc_path, model, raft):
-        self.llm = LlmInterface(model)
-        self.faiss = FaissIndexer(embedding_model_name, doc_path, raft)
-        self.faiss.create_faiss_index()
-        self.context_engine = ContextFetcher(self.faiss)
+    def __init__(self, embedding_model_name, doc_path, model, raft,
+                 index_dir=None, watch_interval=None, embedding_cache_dir=None,
+                 index_quantization='none', store_dtype='float32', quantizer_train_size=1024, encoder_backend='torch',
+                 semantic_cache_threshold=None, semantic_route_thresholds=None, semantic_cache_audit_rate=0.01,
+                 context_token_budget=1024,
+                 generation_model=None, draft_model=None, draft_tokens=4,
+                 search_workers=None, search_queue=64, generation_workers=8, generation_queue=64,
+                 batch_chunk_size=64, max_batch_queries=1024, snapshot=None):
+        # Answers come from a local engine, running llm_model unless another model is named
+        generation_model = generation_model or model
+        load_generation_model(generation_model)
+        drafting = {'draft_model': draft_model, 'draft_tokens': draft_tokens} if draft_model else {}
+        engine = get_generation_engine(generation_model, **drafting)
+        self.llm = LlmInterface(model, engine=engine)
+        embedding_cache = None
+        if embedding_cache_dir:
+            # Quantized backends produce slightly different vectors, so they get their own cache
+            cache_name = embedding_model_name if encoder_backend == 'torch' else f"{embedding_model_name}@{encoder_backend}"
+            embedding_cache = EmbeddingCache(embedding_cache_dir, cache_name)
+        self.faiss = FaissIndexer(embedding_model_name, doc_path, raft, index_dir=index_dir,
+                                  embedding_cache=embedding_cache,
+                                  index_quantization=index_quantization, store_dtype=store_dtype,
+                                  quantizer_train_size=quantizer_train_size, encoder_backend=encoder_backend)
+        if snapshot:
+            # Prefork worker: serve a read-only snapshot; the coordinator owns updates
+            self.faiss.open_snapshot(snapshot)
+        else:
+            self.faiss.create_faiss_index()
+            if watch_interval:
+                self.faiss.start_watcher(watch_interval)
+        model_context = self.llm.max_context_tokens()
+        if model_context is not None and model_context < context_token_budget:
+            # The query takes its share of this too; LlmInterface cuts the context further if needed
+            logger.info(f"Limiting the context to {model_context} tokens to fit {generation_model}")
+            context_token_budget = model_context
+        self.context_engine = ContextFetcher(self.faiss, token_budget=context_token_budget)
+        if self.llm.tokenizer is not None:
+            self.context_engine.set_tokenizer(self.llm.tokenizer)
         self.raft = raft
+        # CoordinatorLink when running as a prefork worker
+        self.coordinator = raft if isinstance(raft, CoordinatorLink) else None
         self.is_running = True
         self._lock = threading.Lock()
         self._query_history = []
+        self.semantic_cache_threshold = semantic_cache_threshold
+        self.semantic_route_thresholds = semantic_route_thresholds
+        self.semantic_cache_audit_rate = semantic_cache_audit_rate
+        self.semantic_cache = None
+        self._flight = SingleFlight()
+        self.query_timeout = 120.0
+        self.batch_chunk_size = batch_chunk_size
+        self.max_batch_queries = max_batch_queries
+        # Async handlers run blocking stages here, so the event loop stays free
+        self.search_pool = BoundedExecutor("search", search_workers or os.cpu_count() or 4, search_queue)
+        self.generation_pool = BoundedExecutor("generation", generation_workers, generation_queue)
 
     def refresh_rag(self, doc_path):
         if not self.is_running:
             raise Exception("Pipeline is not running")
-        self.faiss.add_documents_to_index(doc_path)
+        return self.faiss.add_documents_to_index(doc_path)
 
-    def query(self, query):
+    def _ensure_serving(self):
         if not self.is_running:
             raise Exception("Pipeline is not running")
 
         leader = self.raft.is_leader()
         if not leader:
+            not_leader_rejections.inc()
             if leader:
                 raise Exception(f"Not the leader. Forward request to {leader}")
             raise Exception("No leader available")
 
+    def query(self, query, filters=None, route="default"):
+        self._ensure_serving()
+
         self._query_history.append({
             'query': query,
             'timestamp': time.time()
         })
 
-        context = self.context_engine.retrieve(query=query)
-        return self.llm.query(query, context)
+        # Identical queries in flight share one retrieval, generation and cache fill
+        flight_key = make_cache_key(query, filters, route, self.faiss.index_version)
+        return self._flight.do(flight_key, lambda: self._answer(query, filters, route),
+                               timeout=self.query_timeout)
+
+    async def aquery(self, query, filters=None, route="default"):
+        """query() for async callers.
+
+        Embedding and search run on search_pool and generation on
+        generation_pool, so concurrent requests overlap and the event loop
+        stays free. Raises ExecutorBusyError when a pool's queue is full.
+        Identical queries share one flight with each other and with query().
+        """
+        self._ensure_serving()
+
+        self._query_history.append({
+            'query': query,
+            'timestamp': time.time()
+        })
+
+        flight_key = make_cache_key(query, filters, route, self.faiss.index_version)
+        return await self._flight.do_async(flight_key, lambda: self._aanswer(query, filters, route),
+                                           timeout=self.query_timeout)
+
+    async def _aanswer(self, query, filters, route):
+        retrieval = await self.search_pool.run(self._retrieve, query, filters, route)
+        if 'answer' in retrieval:
+            return retrieval['answer']
+        answer = await self.generation_pool.run(self.llm.query, query, retrieval['context'])
+        self._remember(query, route, retrieval, answer)
+        return answer
+
+    def _answer(self, query, filters, route):
+        retrieval = self._retrieve(query, filters, route)
+        if 'answer' in retrieval:
+            return retrieval['answer']
+        answer = self.llm.query(query, retrieval['context'])
+        self._remember(query, route, retrieval, answer)
+        return answer
+
+    def _retrieve(self, query, filters, route):
+        """Embedding and search stage.
+
+        Returns {'answer'} for a semantic cache hit, otherwise
+        {'context', 'sources', 'hit', 'query_vector', 'scope'} for generation.
+        """
+        # Paraphrases of a recent question reuse its context and answer
+        hit, query_vector = None, None
+        scope = make_cache_key(filters) if filters else ""
+        if self.semantic_cache_threshold is not None:
+            try:
+                query_vector = self.faiss.embed_queries([query])[0]
+                hit = self._get_semantic_cache(len(query_vector)).lookup(
+                    query_vector, route, scope, self.faiss.index_version)
+            except Exception as e:
+                logger.warning(f"Semantic cache lookup failed: {e}")
+            if hit is not None and not hit['audit']:
+                return {'answer': hit['answer']}
+
+        try:
+            result = self.context_engine.retrieve_context(query, filters=filters)
+            context, sources = result['text'] or "No relevant context found", result['chunks']
+        except Exception as e:
+            logger.warning(f"Error in context retrieval: {e}")
+            context, sources = f"Error retrieving context: {str(e)}", []
+        if hit is not None:
+            # Sampled hit: the fresh context shows whether the cached one was still right
+            self.semantic_cache.record_audit(context == hit['context'])
+        return {'context': context, 'sources': sources, 'hit': hit, 'query_vector': query_vector, 'scope': scope}
+
+    def _remember(self, query, route, retrieval, answer):
+        """Offer a fresh answer to the semantic cache."""
+        context, query_vector = retrieval['context'], retrieval['query_vector']
+        if retrieval['hit'] is None and query_vector is not None and not (
+                context.startswith("Error retrieving context") or answer.startswith("Error processing query")):
+            self.semantic_cache.put(query_vector, query, context, answer, route, retrieval['scope'],
+                                    self.faiss.index_version)
+
+    def query_batch(self, items, chunk_size=None):
+        """Answer many (query, filters, route) items, yielding (index, answer) in input order.
+
+        Items are handled in chunks of batch_chunk_size. Each chunk is embedded
+        in one encoder call and searched with one matrix index.search, then
+        all of its prompts go to the generation engine together. The next
+        chunk is retrieved while the previous one generates. Closing the
+        generator early cancels outstanding generation.
+        """
+        self._ensure_serving()
+
+        now = time.time()
+        self._query_history.extend({'query': query, 'timestamp': now} for query, _, _ in items)
+
+        chunk_size = chunk_size or self.batch_chunk_size
+        pending = []
+        try:
+            for start in range(0, len(items), chunk_size):
+                chunk = items[start:start + chunk_size]
+                retrievals = self._retrieve_batch(chunk)
+                pending.append((start, chunk, retrievals, self._generate_batch(chunk, retrievals)))
+                if len(pending) > 1:
+                    yield from self._collect_batch(*pending.pop(0))
+            while pending:
+                yield from self._collect_batch(*pending.pop(0))
+        finally:
+            for _, _, _, futures in pending:
+                for future in futures:
+                    if future is not None:
+                        future.cancel()
+
+    def _retrieve_batch(self, chunk):
+        """_retrieve() for a list of (query, filters, route) items."""
+        queries = [query for query, _, _ in chunk]
+        scopes = [make_cache_key(filters) if filters else "" for _, filters, _ in chunk]
+        hits, query_vectors = [None] * len(chunk), [None] * len(chunk)
+        if self.semantic_cache_threshold is not None:
+            try:
+                query_vectors = list(self.faiss.embed_queries(queries))
+                cache = self._get_semantic_cache(len(query_vectors[0]))
+                hits = [cache.lookup(vector, route, scope, self.faiss.index_version)
+                        for vector, (_, _, route), scope in zip(query_vectors, chunk, scopes)]
+            except Exception as e:
+                logger.warning(f"Semantic cache lookup failed: {e}")
+
+        retrievals = [{'answer': hit['answer']} if hit is not None and not hit['audit'] else None for hit in hits]
+        misses = [i for i, retrieval in enumerate(retrievals) if retrieval is None]
+        try:
+            results = self.context_engine.retrieve_context_batch(
+                [queries[i] for i in misses], filters=[chunk[i][1] for i in misses])
+            contexts = [result['text'] or "No relevant context found" for result in results]
+            sources = [result['chunks'] for result in results]
+        except Exception as e:
+            # One bad item must not fail the rest; retrieve them one by one
+            logger.warning(f"Batched context retrieval failed, retrying per query: {e}")
+            contexts = [self.context_engine.retrieve(query=queries[i], filters=chunk[i][1]) for i in misses]
+            sources = [[] for _ in misses]
+        for i, context, chunk_sources in zip(misses, contexts, sources):
+            if hits[i] is not None:
+                self.semantic_cache.record_audit(context == hits[i]['context'])
+            retrievals[i] = {'context': context, 'sources': chunk_sources, 'hit': hits[i],
+                             'query_vector': query_vectors[i], 'scope': scopes[i]}
+        return retrievals
+
+    def _generate_batch(self, chunk, retrievals):
+        """Generation futures for the items that still need an answer, None for the others."""
+        rows = [i for i, retrieval in enumerate(retrievals) if 'answer' not in retrieval]
+        submitted = self.llm.submit_batch([chunk[i][0] for i in rows], [retrievals[i]['context'] for i in rows])
+        futures = [None] * len(chunk)
+        for i, future in zip(rows, submitted):
+            futures[i] = future
+        return futures
+
+    def _collect_batch(self, start, chunk, retrievals, futures):
+        for offset, ((query, _, route), retrieval, future) in enumerate(zip(chunk, retrievals, futures)):
+            if future is None:
+                yield start + offset, retrieval['answer']
+                continue
+            answer = future.result(timeout=self.query_timeout)
+            self._remember(query, route, retrieval, answer)
+            yield start + offset, answer
+
+    def stream_query(self, query, filters=None, route="default"):
+        """Answer a query incrementally, as (event, payload) pairs.
+
+        ('sources', {'sources', 'cached'}) comes first, as soon as retrieval is
+        done. It is followed by ('token', text) pieces of the answer. Closing
+        the generator early cancels generation.
+        """
+        self._ensure_serving()
+
+        self._query_history.append({
+            'query': query,
+            'timestamp': time.time()
+        })
+
+        retrieval = self._retrieve(query, filters, route)
+        if 'answer' in retrieval:
+            yield 'sources', {'sources': [], 'cached': True}
+            yield 'token', retrieval['answer']
+            return
+        yield 'sources', {'sources': retrieval['sources'], 'cached': False}
+
+        pieces = []
+        for piece in self.llm.stream(query, retrieval['context']):
+            pieces.append(piece)
+            yield 'token', piece
+        self._remember(query, route, retrieval, "".join(pieces))
+
+    def _get_semantic_cache(self, dimension):
+        with self._lock:
+            if self.semantic_cache is None:
+                self.semantic_cache = SemanticCache(dimension, threshold=self.semantic_cache_threshold,
+                                                    route_thresholds=self.semantic_route_thresholds,
+                                                    audit_rate=self.semantic_cache_audit_rate)
+            return self.semantic_cache
 
     def stop(self):
         self.is_running = False
+        if self.coordinator is not None:
+            # The coordinator stops the node and tells every worker
+            self.coordinator.request('stop')
+            return
+        self.faiss.stop_watcher()
+        if self.faiss.embedding_cache is not None:
+            self.faiss.embedding_cache.flush()
+
+    def get_executor_stats(self):
+        return {'search': self.search_pool.get_stats(), 'generation': self.generation_pool.get_stats()}
 
     def start(self):
         self.is_running = True
+        if self.coordinator is not None:
+            self.coordinator.request('start')
+
+    def apply_coordinator_state(self, state):
+        """Follow the coordinator: its running flag and its latest index snapshot."""
+        self.is_running = state.get('is_running', self.is_running)
+        snapshot = state.get('snapshot')
+        if snapshot and snapshot != self.faiss.snapshot_dir:
+            self.faiss.open_snapshot(snapshot)
+            logger.info(f"Switched to index snapshot v{self.faiss.index_version}")
+
+    def get_container_sizes(self):
+        """Entry counts of the long-lived in-memory collections, for spotting unbounded growth."""
+        engine_stats = self.llm.get_engine_stats()
+        return {
+            'query_history': len(self._query_history),
+            'retrieval_cache': self.context_engine.get_cache_stats()['size'],
+            'llm_cache': self.llm.get_cache_stats()['size'],
+            'semantic_cache': self.semantic_cache.get_stats()['size'] if self.semantic_cache is not None else 0,
+            'query_vectors': self.faiss._query_vectors.get_stats()['size'],
+            'prefix_kv_cache': (engine_stats.get('prefix_cache') or {}).get('size', 0) if engine_stats else 0,
+            'documents': len(self.faiss.documents),
+        }
 
     def get_query_history(self):
         return self._query_history.copy()
@@ -107,7 +460,8 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown
     logger.info("Shutting down RAG pipeline service")
-    if pipeline:
+    # A worker exiting must not stop the whole node
+    if pipeline and pipeline.coordinator is None:
         pipeline.stop()
     # Cleanup ports on shutdown
     if node_config:
@@ -131,10 +485,144 @@ app.add_middleware(
 
 pipeline = None
 node_config = None
+# Idle until an admin endpoint starts them
+profiler = ProfilerControl()
+memory_tracker = MemoryTracker()
+
+class RequestLatencyMiddleware:
+    """Records time to response start per route, without buffering streamed bodies."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                # The route template, not the raw path, keeps label cardinality bounded
+                route = scope.get("route")
+                http_request_seconds.observe(time.perf_counter() - start, method=scope["method"],
+                                             path=route.path if route is not None else "other",
+                                             status=message["status"])
+            await send(message)
+
+        await self.app(scope, receive, send_and_record)
+
+app.add_middleware(RequestLatencyMiddleware)
+
+class TracingMiddleware:
+    """Root span per request, continuing the caller's trace from its traceparent header.
+
+    Sampled responses carry a traceparent header naming the trace, so a
+    slow request can be looked up in /traces on every node it touched.
+    """
+
+    UNTRACED = ("/metrics", "/health", "/traces")
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.UNTRACED):
+            return await self.app(scope, receive, send)
+        traceparent = dict(scope["headers"]).get(TRACEPARENT.encode())
+        with tracer.start_trace(f"{scope['method']} {scope['path']}",
+                                traceparent.decode("latin-1") if traceparent else None) as span:
+            async def send_with_trace(message):
+                if message["type"] == "http.response.start" and span.sampled:
+                    route = scope.get("route")
+                    if route is not None:
+                        span.name = f"{scope['method']} {route.path}"
+                    span.set("status", message["status"])
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (TRACEPARENT.encode(), span.traceparent().encode())]
+                await send(message)
+
+            await self.app(scope, receive, send_with_trace)
+
+app.add_middleware(TracingMiddleware)
+
+def _stats_samples(stats_by_label, label, key):
+    return [({label: name}, stats.get(key)) for name, stats in stats_by_label.items() if stats]
+
+def collect_pipeline_metrics():
+    """Scrape-time view of cache hit ratios and queue depths."""
+    if pipeline is None:
+        return
+    engine_stats = pipeline.llm.get_engine_stats()
+    caches = {
+        'retrieval': pipeline.context_engine.get_cache_stats(),
+        'llm': pipeline.llm.get_cache_stats(),
+        'embedding': pipeline.faiss.embedding_cache.get_stats() if pipeline.faiss.embedding_cache is not None else None,
+        'semantic': pipeline.semantic_cache.get_stats() if pipeline.semantic_cache is not None else None,
+        'prefix_kv': engine_stats.get('prefix_cache') if engine_stats else None,
+    }
+    yield 'rag_cache_hits_total', 'counter', 'Cache hits', _stats_samples(caches, 'cache', 'hits')
+    yield 'rag_cache_misses_total', 'counter', 'Cache misses', _stats_samples(caches, 'cache', 'misses')
+    yield 'rag_cache_hit_ratio', 'gauge', 'Cache hits over lookups', _stats_samples(caches, 'cache', 'hit_rate')
+    yield 'rag_cache_entries', 'gauge', 'Entries held by each cache', _stats_samples(caches, 'cache', 'size')
+
+    pools = pipeline.get_executor_stats()
+    queues = {name: {'queued': stats['queued']} for name, stats in pools.items()}
+    queues['search_batcher'] = {'queued': pipeline.faiss._search_batcher.get_stats()['queue_depth']}
+    if engine_stats:
+        queues['generation_engine'] = {'queued': engine_stats['queued']}
+    yield 'rag_queue_depth', 'gauge', 'Work waiting for a thread, batch or decode slot', _stats_samples(queues, 'queue', 'queued')
+    yield 'rag_executor_running', 'gauge', 'Calls running on each executor', _stats_samples(pools, 'pool', 'running')
+    yield 'rag_executor_rejected_total', 'counter', 'Calls rejected by a full executor', _stats_samples(pools, 'pool', 'rejected')
+    if engine_stats:
+        yield 'rag_generation_active', 'gauge', 'Sequences in the decode batch', [({}, engine_stats['active'])]
+        yield 'rag_generation_tokens_total', 'counter', 'Tokens generated', [({}, engine_stats['tokens_generated'])]
+    yield 'rag_index_version', 'gauge', 'Index version being served', [({}, pipeline.faiss.index_version)]
+    yield 'rag_running', 'gauge', '1 while the pipeline accepts queries', [({}, int(pipeline.is_running))]
+
+def collect_raft_metrics():
+    """Scrape-time view of term, log and replication progress."""
+    if pipeline is None:
+        return
+    raft_node = pipeline.raft
+    yield 'raft_is_leader', 'gauge', '1 on the current leader', [({}, int(raft_node.is_leader()))]
+    if not isinstance(raft_node, RaftNode):
+        return
+    with raft_node.lock:
+        last_index = raft_node._last_index()
+        lag = {peer: last_index - match for peer, match in raft_node.match_index.items()} \
+            if raft_node.state == "leader" else {}
+        values = {
+            'raft_term': ('gauge', 'Current term', raft_node.current_term),
+            'raft_term_changes_total': ('counter', 'Times the term advanced', raft_node.term_changes),
+            'raft_elections_started_total': ('counter', 'Elections started by this node', raft_node.elections_started),
+            'raft_log_entries': ('gauge', 'Entries kept in the local log since its last compaction', len(raft_node.log)),
+            'raft_snapshot_index': ('gauge', 'Last log index compacted into the saved index', raft_node.snapshot_index),
+            'raft_commit_index': ('gauge', 'Highest committed log index', raft_node.commit_index),
+            'raft_last_applied': ('gauge', 'Highest applied log index', raft_node.last_applied),
+            'raft_apply_lag_entries': ('gauge', 'Committed entries not yet applied', raft_node.commit_index - raft_node.last_applied),
+            'raft_pending_proposals': ('gauge', 'Local proposals waiting to commit', len(raft_node._pending)),
+            'raft_apply_halted': ('gauge', '1 once an entry failed to apply and this node stopped applying', int(raft_node.apply_error is not None)),
+        }
+    for name, (kind, help, value) in values.items():
+        yield name, kind, help, [({}, value)]
+    yield 'raft_replication_lag_entries', 'gauge', 'Leader log entries not yet on each follower', \
+        [({'peer': peer}, entries) for peer, entries in lag.items()]
+
+metrics.add_collector(collect_pipeline_metrics)
+metrics.add_collector(collect_raft_metrics)
+
+def _check_filters(*requests: QueryRequest):
+    """Reject malformed filters with a 400 before any work is queued."""
+    for request in requests:
+        try:
+            validate_filters(request.filters)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid filters: {e}")
 
 @app.post("/query", response_model=QueryResponse,
          description="Process a query using the RAG pipeline")
 async def handle_query(request: QueryRequest):
+    _check_filters(request)
     try:
         if not pipeline:
             logger.error("Pipeline not initialized")
@@ -151,9 +639,15 @@ async def handle_query(request: QueryRequest):
             )
 
         logger.info(f"Processing query: {request.query}")
-        response = pipeline.query(request.query)
+        response = await pipeline.aquery(request.query, filters=request.filters, route=request.route)
         return QueryResponse(response=response, status="success")
 
+    except ExecutorBusyError as e:
+        logger.warning(f"Rejecting query: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
     except Exception as e:
         logger.error(f"Error processing query: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -161,6 +655,119 @@ async def handle_query(request: QueryRequest):
             detail=str(e)
         )
 
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _sse_event(item) -> str:
+    event, payload = item
+    return _sse(event, payload if event == "sources" else {"text": payload})
+
+
+def _ndjson_result(item) -> str:
+    index, answer = item
+    return json.dumps({"index": index, "response": answer, "status": "success"}) + "\n"
+
+
+def _stream_events(http_request: Request, events):
+    """Relay (event, payload) pairs from a blocking generator as Server-Sent Events."""
+    return _relay(http_request, events, _sse_event,
+                  done=_sse("done", {"status": "success"}),
+                  error=lambda detail: _sse("error", {"detail": detail}))
+
+
+async def _relay(http_request: Request, events, render, done="", error=None):
+    """Relay items from a blocking generator to a streaming response.
+
+    Each item is pulled on the generation pool and written as render(item),
+    followed by done at the end, or error(detail) if the generator raises.
+    The generator is closed, which cancels generation, once the client
+    disconnects.
+    """
+    pending = None
+    try:
+        while True:
+            if await http_request.is_disconnected():
+                logger.info("Client disconnected; cancelling streamed query")
+                return
+            pending = asyncio.wrap_future(pipeline.generation_pool.submit(next, events, None))
+            # Shielded so that if the client goes away, the pull finishes before the generator is closed
+            item = await asyncio.shield(pending)
+            pending = None
+            if item is None:
+                if done:
+                    yield done
+                return
+            yield render(item)
+    except Exception as e:
+        logger.error(f"Error streaming query: {str(e)}", exc_info=True)
+        if error is not None:
+            yield error(str(e))
+    finally:
+        if pending is not None and not pending.done():
+            pending.add_done_callback(lambda _: events.close())
+        else:
+            events.close()
+
+@app.post("/query/stream",
+         description="Process a query, streaming sources and then answer tokens as Server-Sent Events")
+async def handle_query_stream(request: QueryRequest, http_request: Request):
+    _check_filters(request)
+    if not pipeline:
+        logger.error("Pipeline not initialized")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service not initialized"
+        )
+
+    if not pipeline.is_running:
+        logger.error("Pipeline is not running")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service is not running"
+        )
+
+    logger.info(f"Streaming query: {request.query}")
+    events = pipeline.stream_query(request.query, filters=request.filters, route=request.route)
+    return StreamingResponse(
+        _stream_events(http_request, events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/query/batch",
+         description="Process many queries in one request, streaming one JSON result per line in request order")
+async def handle_query_batch(request: BatchQueryRequest, http_request: Request):
+    _check_filters(*request.queries)
+    if not pipeline:
+        logger.error("Pipeline not initialized")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service not initialized"
+        )
+
+    if not pipeline.is_running:
+        logger.error("Pipeline is not running")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service is not running"
+        )
+
+    if len(request.queries) > pipeline.max_batch_queries:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Batch of {len(request.queries)} queries exceeds the limit of {pipeline.max_batch_queries}"
+        )
+
+    logger.info(f"Processing batch of {len(request.queries)} queries")
+    results = pipeline.query_batch([(q.query, q.filters, q.route) for q in request.queries])
+    return StreamingResponse(
+        _relay(http_request, results, _ndjson_result,
+               error=lambda detail: json.dumps({"status": "error", "detail": detail}) + "\n"),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/start",
          description="Start the RAG pipeline service")
 async def start_node():
@@ -222,6 +829,26 @@ async def get_status():
             "node_id": node_config.node_id if node_config else None,
             "embedding_model": node_config.embedding_model if node_config else None
         }
+        if pipeline.faiss.embedding_cache is not None:
+            status_info["embedding_cache"] = pipeline.faiss.embedding_cache.get_stats()
+        status_info["retrieval_cache"] = pipeline.context_engine.get_cache_stats()
+        status_info["llm_cache"] = pipeline.llm.get_cache_stats()
+        if pipeline.semantic_cache is not None:
+            status_info["semantic_cache"] = pipeline.semantic_cache.get_stats()
+        status_info["single_flight"] = pipeline._flight.get_stats()
+        if pipeline.llm.engine is not None:
+            status_info["generation"] = pipeline.llm.get_engine_stats()
+        status_info["executors"] = pipeline.get_executor_stats()
+        if getattr(pipeline.raft, 'apply_error', None):
+            status_info["status"] = "apply_halted"
+            status_info["apply_error"] = pipeline.raft.apply_error
+        if pipeline.coordinator is not None:
+            status_info["worker"] = {
+                "pid": os.getpid(),
+                "index_version": pipeline.faiss.index_version,
+                "snapshot": pipeline.faiss.snapshot_dir,
+            }
+        status_info["models"] = model_registry.get_stats()
 
         return status_info
 
@@ -232,11 +859,150 @@ async def get_status():
             detail=str(e)
         )
 
+@app.get("/metrics",
+         description="Prometheus metrics: stage latency histograms, cache hit ratios, queue depths and Raft progress",
+         response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/traces",
+        description="Traces recorded by this process, newest or slowest first")
+async def list_traces(limit: int = 20, min_duration_ms: float = 0.0, name: Optional[str] = None,
+                      sort: str = "recent"):
+    if sort not in ("recent", "duration"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown sort: {sort}")
+    return {"tracer": tracer.get_stats(),
+            "traces": tracer.list_traces(limit, min_duration_ms, name, sort)}
+
+@app.get("/traces/{trace_id}",
+        description="Spans of one trace recorded by this process, with each span's time outside its children")
+async def get_trace(trace_id: str):
+    spans = tracer.get_trace(trace_id.lower())
+    if not spans:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No spans for trace {trace_id}")
+    return {"trace_id": trace_id.lower(), "service": tracer.service, "spans": spans}
+
+@app.post("/admin/profile/start",
+         description="Profile the whole process for a fixed window; fetch the output from /admin/profile/result")
+async def start_profile(request: ProfileRequest):
+    try:
+        return profiler.start(request.mode, request.duration, request.interval_ms, request.include_idle)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except (ValueError, RuntimeError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@app.post("/admin/profile/stop",
+         description="End the profiling window early and return its output",
+         response_class=PlainTextResponse)
+async def stop_profile():
+    result = await asyncio.to_thread(profiler.stop)
+    if result is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No profile has been taken")
+    return PlainTextResponse(result)
+
+@app.get("/admin/profile",
+        description="State of the current or last profiling window")
+async def get_profile_status():
+    return profiler.status()
+
+@app.get("/admin/profile/result",
+        description="Output of the last finished profiling window: collapsed stacks or a pstats report",
+        response_class=PlainTextResponse)
+async def get_profile_result():
+    result = profiler.result()
+    if result is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No finished profile")
+    return PlainTextResponse(result)
+
+@app.post("/admin/memory/start",
+         description="Start tracing allocations with tracemalloc; slows allocation until stopped")
+async def start_memory_tracing(frames: int = 1):
+    memory_tracker.start(frames)
+    return {"status": "tracing", "frames": frames}
+
+@app.get("/admin/memory/snapshot",
+        description="Top allocation sites, growth since the previous snapshot, and collection sizes")
+async def get_memory_snapshot(limit: int = 25, key: str = "lineno"):
+    if key not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown grouping: {key}")
+    try:
+        report = await asyncio.to_thread(memory_tracker.snapshot, limit, key)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    if pipeline:
+        report["containers"] = pipeline.get_container_sizes()
+    return report
+
+@app.post("/admin/memory/stop",
+         description="Stop tracing allocations and drop the stored snapshot")
+async def stop_memory_tracing():
+    memory_tracker.stop()
+    return {"status": "stopped"}
+
 @app.get("/health",
          description="Health check endpoint")
 async def health_check():
     return {"status": "healthy"}
 
+class QueryServicer(service_pb2_grpc.QueryServiceServicer):
+    """QueryService RPCs, answered by this node's pipeline on its own gRPC server (see start_query_server)."""
+
+    def _items(self, requests, context):
+        if not pipeline:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "Service not initialized")
+        if not pipeline.is_running:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "Service is not running")
+        if len(requests) > pipeline.max_batch_queries:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                          f"Batch of {len(requests)} queries exceeds the limit of {pipeline.max_batch_queries}")
+        try:
+            items = [(r.query, json.loads(r.filters) if r.filters else None, r.route or "default") for r in requests]
+            for _, filters, _ in items:
+                validate_filters(filters)
+            return items
+        except ValueError as e:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, f"Invalid filters: {e}")
+
+    @staticmethod
+    def _trace(name, context):
+        """Root span continuing the caller's trace from the traceparent metadata key."""
+        span = tracer.start_trace(name, dict(context.invocation_metadata()).get(TRACEPARENT))
+        if span.sampled:
+            context.set_trailing_metadata(((TRACEPARENT, span.traceparent()),))
+        return span
+
+    def Query(self, request, context):
+        (query, filters, route), = self._items([request], context)
+        with self._trace("QueryService/Query", context):
+            try:
+                return service_pb2.QueryResponse(response=pipeline.query(query, filters=filters, route=route))
+            except ExecutorBusyError as e:
+                context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+            except Exception as e:
+                logger.error(f"Error processing gRPC query: {str(e)}", exc_info=True)
+                context.abort(grpc.StatusCode.INTERNAL, str(e))
+
+    def QueryBatch(self, request, context):
+        items = self._items(request.queries, context)
+        logger.info(f"Processing gRPC batch of {len(items)} queries")
+        with self._trace("QueryService/QueryBatch", context) as span:
+            span.set("queries", len(items))
+            results = pipeline.query_batch(items)
+            try:
+                for index, answer in results:
+                    if not context.is_active():
+                        logger.info("gRPC client went away; cancelling batch")
+                        return
+                    yield service_pb2.QueryBatchResult(index=index, response=answer)
+            except ExecutorBusyError as e:
+                context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+            except Exception as e:
+                logger.error(f"Error processing gRPC batch: {str(e)}", exc_info=True)
+                context.abort(grpc.StatusCode.INTERNAL, str(e))
+            finally:
+                results.close()
+
 def start_raft_server(node_config: NodeConfig):
     try:
         import socket
@@ -249,7 +1015,9 @@ def start_raft_server(node_config: NodeConfig):
             raise Exception(f"Port {node_config.port} is already in use")
 
         logger.info(f"Starting RAFT server with node_id={node_config.node_id}")
-        raft_node = RaftNode(node_config.node_id, node_config.peers)
+        raft_node = RaftNode(node_config.node_id, node_config.peers,
+                             state_dir=os.path.join(node_config.index_dir, 'raft') if node_config.index_dir else None)
+        raft_node.on_timing = observe_stage
         raft_thread = threading.Thread(
             target=start_server,
             args=(node_config.node_id, node_config.port + 1000, node_config.peers, raft_node),
@@ -257,11 +1025,132 @@ def start_raft_server(node_config: NodeConfig):
         )
         logger.info(f"Starting thread for raft on node {node_config.node_id}")
         raft_thread.start()
+        start_query_server(node_config)
         return raft_node
     except Exception as e:
         logger.error(f"Failed to start RAFT server: {str(e)}", exc_info=True)
         raise
 
+def start_query_server(node_config: NodeConfig):
+    """Serve QueryService on its own gRPC server.
+
+    Query RPCs can run for as long as generation takes. On the Raft
+    server they could take every thread and delay heartbeats into
+    elections. Here they get query_grpc_workers threads of their own, and
+    gRPC rejects RPCs beyond query_grpc_queue waiting ones with
+    RESOURCE_EXHAUSTED.
+    """
+    port = node_config.query_grpc_port or node_config.port + 2000
+    server = grpc.server(
+        ThreadPoolExecutor(max_workers=node_config.query_grpc_workers, thread_name_prefix="grpc-query"),
+        maximum_concurrent_rpcs=node_config.query_grpc_workers + node_config.query_grpc_queue,
+        options=GRPC_OPTIONS)
+    service_pb2_grpc.add_QueryServiceServicer_to_server(QueryServicer(), server)
+    server.add_insecure_port(f"[::]:{port}")
+    server.start()
+    logger.info(f"QueryService listening on port {port}")
+    return server
+
+def build_pipeline(config: NodeConfig, raft, snapshot=None):
+    return Pipeline(
+        config.embedding_model,
+        config.doc_path,
+        config.llm_model,
+        raft,
+        index_dir=config.index_dir,
+        watch_interval=config.watch_interval,
+        embedding_cache_dir=config.embedding_cache_dir,
+        index_quantization=config.index_quantization,
+        store_dtype=config.store_dtype,
+        quantizer_train_size=config.quantizer_train_size,
+        encoder_backend=config.encoder_backend,
+        semantic_cache_threshold=config.semantic_cache_threshold,
+        semantic_route_thresholds=config.semantic_route_thresholds,
+        semantic_cache_audit_rate=config.semantic_cache_audit_rate,
+        context_token_budget=config.context_token_budget,
+        generation_model=config.generation_model,
+        draft_model=config.draft_model,
+        draft_tokens=config.draft_tokens,
+        search_workers=config.search_workers,
+        search_queue=config.search_queue,
+        generation_workers=config.generation_workers,
+        generation_queue=config.generation_queue,
+        batch_chunk_size=config.batch_chunk_size,
+        max_batch_queries=config.max_batch_queries,
+        snapshot=snapshot
+    )
+
+def bind_server_socket(host: str, port: int):
+    """Listening socket shared by every prefork worker; the kernel hands each connection to one of them."""
+    import socket
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def serve_worker(worker_id: int, conn, sock, config: NodeConfig):
+    """Body of a prefork worker: serve HTTP on the shared socket from the coordinator's snapshots."""
+    global pipeline, node_config
+    node_config = config
+    configure_tracing(config, f"rag-node-{config.node_id}/worker-{worker_id}")
+    link = CoordinatorLink(conn)
+    try:
+        snapshot = link.wait_for('snapshot', timeout=config.worker_snapshot_timeout)
+    except (TimeoutError, ConnectionError) as e:
+        logger.error(f"Worker {worker_id} has no index snapshot to serve: {e}")
+        sys.exit(1)
+    pipeline = build_pipeline(config, link, snapshot=snapshot)
+    link.on_state.append(pipeline.apply_coordinator_state)
+    pipeline.apply_coordinator_state(link.state)
+
+    server = uvicorn.Server(uvicorn.Config(app, log_level="info", access_log=True))
+    link.on_shutdown.append(lambda: setattr(server, 'should_exit', True))
+    logger.info(f"Worker {worker_id} (pid {os.getpid()}) serving index snapshot v{pipeline.faiss.index_version}")
+    server.run(sockets=[sock])
+
+def run_prefork(config: NodeConfig, host: str = "0.0.0.0"):
+    """Serve with config.serve_workers processes.
+
+    This process stays the coordinator. It runs Raft and owns the writable
+    index, publishes a memory-mapped snapshot after every index change, and
+    broadcasts leadership, the running flag and the current snapshot to the
+    workers. The workers serve HTTP on one shared socket.
+    """
+    global pipeline
+    sock = bind_server_socket(host, config.port)
+    # Fork before Raft starts its gRPC threads; preloaded models are shared copy-on-write
+    supervisor = WorkerSupervisor(config.serve_workers, lambda worker_id, conn: serve_worker(worker_id, conn, sock, config))
+    supervisor.start()
+    sock.close()
+
+    try:
+        raft_node = start_raft_server(config)
+        pipeline = build_pipeline(config, raft_node)
+        supervisor.on_control = lambda action: pipeline.start() if action == 'start' else pipeline.stop()
+
+        snapshot_root = os.path.join(config.index_dir, 'snapshots') if config.index_dir else \
+            tempfile.mkdtemp(prefix=f"rag-snapshots-{config.node_id}-")
+        publisher = SnapshotPublisher(pipeline.faiss, snapshot_root,
+                                      on_publish=lambda path, version: supervisor.update(snapshot=path, index_version=version))
+        pipeline.faiss.add_version_listener(publisher.notify)
+        # Raises without a real FAISS index to snapshot
+        publisher.start()
+    except Exception:
+        # The workers would otherwise wait for a first snapshot that never comes
+        logger.error("Coordinator failed to start; stopping workers", exc_info=True)
+        supervisor.stop()
+        raise
+    supervisor.watch(lambda: {'is_leader': raft_node.is_leader(), 'is_running': pipeline.is_running})
+
+    logger.info(f"Coordinator serving {config.serve_workers} workers on {host}:{config.port}")
+    try:
+        supervisor.join()
+    finally:
+        publisher.stop()
+        pipeline.stop()
+
 def run_server(host: str, port: int):
     try:
         import socket
@@ -298,24 +1187,61 @@ if __name__ == '__main__':
             peers=sys.argv[3:5],
             embedding_model=sys.argv[5],
             doc_path=sys.argv[6],
-            llm_model=sys.argv[7]
+            llm_model=sys.argv[7],
+            index_dir=os.environ.get("RAG_INDEX_DIR"),
+            watch_interval=float(os.environ["RAG_WATCH_INTERVAL"]) if os.environ.get("RAG_WATCH_INTERVAL") else None,
+            embedding_cache_dir=os.environ.get("RAG_EMBEDDING_CACHE_DIR"),
+            index_quantization=os.environ.get("RAG_INDEX_QUANTIZATION", "none"),
+            store_dtype=os.environ.get("RAG_STORE_DTYPE", "float32"),
+            quantizer_train_size=int(os.environ.get("RAG_QUANTIZER_TRAIN_SIZE", "1024")),
+            encoder_backend=os.environ.get("RAG_ENCODER_BACKEND", "torch"),
+            semantic_cache_threshold=float(os.environ["RAG_SEMANTIC_CACHE_THRESHOLD"]) if os.environ.get("RAG_SEMANTIC_CACHE_THRESHOLD") else None,
+            semantic_route_thresholds=json.loads(os.environ.get("RAG_SEMANTIC_ROUTE_THRESHOLDS", "{}")),
+            semantic_cache_audit_rate=float(os.environ.get("RAG_SEMANTIC_CACHE_AUDIT_RATE", "0.01")),
+            context_token_budget=int(os.environ.get("RAG_CONTEXT_TOKENS", "1024")),
+            generation_model=os.environ.get("RAG_GENERATION_MODEL"),
+            draft_model=os.environ.get("RAG_DRAFT_MODEL"),
+            draft_tokens=int(os.environ.get("RAG_DRAFT_TOKENS", "4")),
+            search_workers=int(os.environ.get("RAG_SEARCH_WORKERS", str(os.cpu_count() or 4))),
+            search_queue=int(os.environ.get("RAG_SEARCH_QUEUE", "64")),
+            generation_workers=int(os.environ.get("RAG_GENERATION_WORKERS", "8")),
+            generation_queue=int(os.environ.get("RAG_GENERATION_QUEUE", "64")),
+            batch_chunk_size=int(os.environ.get("RAG_BATCH_CHUNK_SIZE", "64")),
+            max_batch_queries=int(os.environ.get("RAG_MAX_BATCH_QUERIES", "1024")),
+            query_grpc_port=int(os.environ["RAG_QUERY_GRPC_PORT"]) if os.environ.get("RAG_QUERY_GRPC_PORT") else None,
+            query_grpc_workers=int(os.environ.get("RAG_QUERY_GRPC_WORKERS", "8")),
+            query_grpc_queue=int(os.environ.get("RAG_QUERY_GRPC_QUEUE", "32")),
+            serve_workers=int(os.environ.get("RAG_SERVE_WORKERS", "1")),
+            worker_snapshot_timeout=float(os.environ.get("RAG_WORKER_SNAPSHOT_TIMEOUT", "600")),
+            trace_sample_rate=float(os.environ.get("RAG_TRACE_SAMPLE_RATE", "0.01")),
+            trace_buffer_spans=int(os.environ.get("RAG_TRACE_BUFFER_SPANS", "10000")),
+            trace_file=os.environ.get("RAG_TRACE_FILE")
         )
+        configure_tracing(node_config, f"rag-node-{node_config.node_id}")
 
         logger.info(f"Initializing node with config: {node_config.dict()}")
 
         # Clean up ports before starting
         cleanup_ports([node_config.port])
 
+        # Load models once, before any worker could be forked, so their
+        # weights are shared rather than loaded per component or process
+        generation_model = node_config.generation_model or node_config.llm_model
+        load_generation_model(generation_model)
+        model_registry.preload(
+            encoders=[(node_config.embedding_model, node_config.encoder_backend)],
+            causal_lms=[m for m in (generation_model, node_config.draft_model) if m]
+        )
+
+        if node_config.serve_workers > 1:
+            run_prefork(node_config)
+            sys.exit(0)
+
         # Start RAFT in a separate thread
         raft_node = start_raft_server(node_config)
 
         # Initialize pipeline
-        pipeline = Pipeline(
-            node_config.embedding_model,
-            node_config.doc_path,
-            node_config.llm_model,
-            raft_node
-        )
+        pipeline = build_pipeline(node_config, raft_node)
 
         # Run FastAPI server
         run_server("0.0.0.0", node_config.port)
@@ -0,0 +1,172 @@
+import itertools
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.ascontiguousarray(vectors / np.maximum(norms, 1e-12))
+
+
+def cosine_similarity_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """All-pairs cosine similarity between the rows of a and b in one matrix product."""
+    return normalize_rows(a) @ normalize_rows(b).T
+
+
+class SemanticCache:
+    """Answer cache keyed by query-embedding similarity.
+
+    Recent query embeddings live in a small inner-product FAISS index over
+    unit vectors, so a lookup is one nearest-neighbour search. A new query
+    within the cosine threshold of a cached query (same route, same scope
+    and same index version) reuses that query's context and answer.
+
+    Each route may have its own threshold. Entries expire after ttl seconds
+    and the least recently hit entries are evicted beyond max_entries.
+
+    Hit quality is tracked in two ways. Similarity statistics cover hits and
+    near misses. Sampled audits re-run audit_rate of the hits and record
+    whether the cached context still matches.
+    """
+
+    def __init__(self, dimension: int, threshold: float = 0.92,
+                 route_thresholds: Optional[Dict[str, float]] = None,
+                 max_entries: int = 10_000, ttl: Optional[float] = 3600.0,
+                 audit_rate: float = 0.01, candidates: int = 8):
+        import faiss
+
+        self.dimension = dimension
+        self.threshold = threshold
+        self.route_thresholds = dict(route_thresholds or {})
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.audit_rate = audit_rate
+        self.candidates = candidates
+        self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()  # least recently hit first
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.near_misses = 0
+        self.audits = 0
+        self.audit_mismatches = 0
+        self._hit_similarity_sum = 0.0
+        self._hit_similarity_min = 1.0
+
+    def threshold_for(self, route: str) -> float:
+        return self.route_thresholds.get(route, self.threshold)
+
+    def lookup(self, query_vector: np.ndarray, route: str = "default", scope: str = "",
+               index_version: int = 0) -> Optional[Dict[str, Any]]:
+        """Closest cached entry for this route and scope, or None.
+
+        The returned dict holds query, context, answer and similarity, plus
+        an 'audit' flag when this hit was sampled for re-verification.
+        """
+        threshold = self.threshold_for(route)
+        vector = normalize_rows(query_vector)
+        with self._lock:
+            if not self._entries:
+                self.misses += 1
+                return None
+            similarities, ids = self._index.search(vector, min(self.candidates, len(self._entries)))
+            now = time.monotonic()
+            best_rejected = -1.0
+            for similarity, entry_id in zip(similarities[0], ids[0]):
+                entry = self._entries.get(int(entry_id))
+                if entry is None:
+                    continue
+                if entry['expires_at'] is not None and entry['expires_at'] <= now:
+                    self._remove([int(entry_id)])
+                    continue
+                if (entry['route'], entry['scope'], entry['index_version']) != (route, scope, index_version):
+                    continue
+                if similarity < threshold:
+                    best_rejected = max(best_rejected, float(similarity))
+                    break
+                self._entries.move_to_end(int(entry_id))
+                entry['hits'] += 1
+                self.hits += 1
+                self._hit_similarity_sum += float(similarity)
+                self._hit_similarity_min = min(self._hit_similarity_min, float(similarity))
+                return {
+                    'query': entry['query'],
+                    'context': entry['context'],
+                    'answer': entry['answer'],
+                    'similarity': float(similarity),
+                    'audit': self.audit_rate > 0 and random.random() < self.audit_rate,
+                }
+            self.misses += 1
+            # Close calls are the ones a slightly lower threshold would have served
+            if best_rejected >= threshold - 0.05:
+                self.near_misses += 1
+            return None
+
+    def put(self, query_vector: np.ndarray, query: str, context: str, answer: Any,
+            route: str = "default", scope: str = "", index_version: int = 0):
+        vector = normalize_rows(query_vector)
+        with self._lock:
+            entry_id = next(self._ids)
+            self._index.add_with_ids(vector, np.asarray([entry_id], dtype=np.int64))
+            self._entries[entry_id] = {
+                'query': query,
+                'context': context,
+                'answer': answer,
+                'route': route,
+                'scope': scope,
+                'index_version': index_version,
+                'expires_at': time.monotonic() + self.ttl if self.ttl is not None else None,
+                'hits': 0,
+            }
+            if len(self._entries) > self.max_entries:
+                overflow = len(self._entries) - self.max_entries
+                stale = list(itertools.islice(self._entries, overflow))
+                self.evictions += len(stale)
+                self._remove(stale)
+
+    def record_audit(self, matched: bool):
+        """Outcome of re-running a sampled hit: did the fresh context match the cached one?"""
+        with self._lock:
+            self.audits += 1
+            if not matched:
+                self.audit_mismatches += 1
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._entries)
+            self._remove(list(self._entries))
+            return count
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'threshold': self.threshold,
+                'route_thresholds': dict(self.route_thresholds),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'near_misses': self.near_misses,
+                'mean_hit_similarity': self._hit_similarity_sum / self.hits if self.hits else None,
+                'min_hit_similarity': self._hit_similarity_min if self.hits else None,
+                'audits': self.audits,
+                'audit_agreement': 1.0 - self.audit_mismatches / self.audits if self.audits else None,
+            }
+
+    def _remove(self, entry_ids: List[int]):
+        """Drop entries from the table and the index; caller must hold the lock."""
+        for entry_id in entry_ids:
+            self._entries.pop(entry_id, None)
+        if entry_ids:
+            self._index.remove_ids(np.asarray(entry_ids, dtype=np.int64))
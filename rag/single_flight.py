@@ -0,0 +1,104 @@
+import asyncio
+import threading
+from concurrent.futures import CancelledError, Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution.
+
+    The first caller for a key (the leader) runs fn itself, on the calling
+    thread; callers arriving while it runs wait on the leader's Future and
+    get the same result or exception. The key is released as soon as the call finishes, so the
+    next request goes through the caller's cache rather than a stale flight.
+
+    Only followers are bounded by timeout: one that times out raises
+    concurrent.futures.TimeoutError without affecting the leader or other
+    followers. The leader runs fn to completion, so fn must bound its own
+    work if the leader needs a deadline. A leader interrupted by a
+    BaseException (e.g. KeyboardInterrupt) cancels the flight, and waiting
+    followers receive CancelledError.
+
+    do_async() is the same for coroutines and shares the flights with do(),
+    so sync and async callers of one key coalesce; async followers await
+    the leader without holding a thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, Future] = {}
+        self.leaders = 0
+        self.shared = 0
+        self.errors = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """fn() for the leader, or the leader's outcome for a follower waiting at most timeout seconds."""
+        future, leader = self._join(key)
+        if not leader:
+            return future.result(timeout=timeout)
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._succeed(key, future, result)
+        return result
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]],
+                       timeout: Optional[float] = None) -> Any:
+        """await fn() for the leader, or the leader's outcome for a follower waiting at most timeout seconds."""
+        future, leader = self._join(key)
+        if not leader:
+            # Cancelling the wrapper leaves the running flight alone
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._succeed(key, future, result)
+        return result
+
+    def _join(self, key: Hashable) -> Tuple[Future, bool]:
+        """The flight for key and whether the caller leads it."""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.shared += 1
+                return future, False
+            future = Future()
+            future.set_running_or_notify_cancel()
+            self._flights[key] = future
+            self.leaders += 1
+            return future, True
+
+    def _succeed(self, key: Hashable, future: Future, result: Any):
+        with self._lock:
+            self._flights.pop(key, None)
+        future.set_result(result)
+
+    def _fail(self, key: Hashable, future: Future, error: BaseException):
+        with self._lock:
+            self._flights.pop(key, None)
+            if isinstance(error, Exception):
+                self.errors += 1
+        if isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            # A running Future cannot be cancelled, so followers get CancelledError raised instead
+            future.set_exception(CancelledError())
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'shared': self.shared,
+                'errors': self.errors,
+            }
@@ -0,0 +1,232 @@
+import contextvars
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+# W3C trace context: version-traceid-parentid-flags
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+TRACEPARENT = 'traceparent'
+
+_current: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('rag_current_span', default=None)
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """(trace_id, parent_span_id, sampled) from a traceparent header, or None if absent or malformed."""
+    match = _TRACEPARENT_RE.match(value.strip().lower()) if value else None
+    if match is None or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+class _NoopSpan:
+    """Stands in for spans that are not sampled; every operation is free."""
+    sampled = False
+    trace_id = None
+    span_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, key: str, value: Any):
+        pass
+
+    def traceparent(self) -> Optional[str]:
+        return None
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ('tracer', 'trace_id', 'span_id', 'parent_id', 'name', 'attributes',
+                 'start', '_start_perf', 'duration_ms', 'error', '_token')
+    sampled = True
+
+    def __init__(self, tracer: 'Tracer', name: str, trace_id: str, parent_id: Optional[str],
+                 attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self._start_perf = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_ms = (time.perf_counter() - self._start_perf) * 1000
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # A generator holding the span was closed from another context
+            pass
+        self.tracer._export(self)
+        return False
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'service': self.tracer.service,
+            'start': self.start,
+            'duration_ms': self.duration_ms,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class Tracer:
+    """Minimal distributed tracer with an in-process exporter.
+
+    Entry points (HTTP requests, gRPC calls, replicated log entries) call
+    start_trace() with the caller's traceparent. A sampled caller is
+    always followed; a new trace is sampled with probability sample_rate.
+    Inside a sampled trace, span() opens a child of the current span; with
+    no sampled trace in progress it returns a shared no-op span, so
+    unsampled requests cost one context-variable read per stage.
+
+    The current span lives in a contextvars.ContextVar, so it follows
+    asyncio tasks. Work handed to other threads must run in a copied
+    context; see BoundedExecutor.submit.
+
+    Finished spans go to a ring buffer that /traces reads, and optionally
+    to a JSON-lines file. No external collector is involved.
+    """
+
+    def __init__(self, service: str = 'rag', sample_rate: float = 0.01, buffer_spans: int = 10000,
+                 file: Optional[str] = None):
+        self._lock = threading.Lock()
+        self._file = None
+        self.configure(service, sample_rate, buffer_spans, file)
+
+    def configure(self, service: str, sample_rate: float, buffer_spans: int = 10000, file: Optional[str] = None):
+        with self._lock:
+            self.service = service
+            self.sample_rate = sample_rate
+            self._spans: deque = deque(maxlen=buffer_spans)
+            if self._file is not None:
+                self._file.close()
+            self._file = open(file, 'a', buffering=1, encoding='utf-8') if file else None
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, **attributes):
+        """Root span for a request entering this process."""
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled:
+            return NOOP_SPAN
+        return Span(self, name, trace_id, parent_id, attributes)
+
+    def continue_trace(self, name: str, traceparent: Optional[str], **attributes):
+        """Like start_trace(), but only records when the caller's trace is sampled."""
+        parent = parse_traceparent(traceparent)
+        if parent is None or not parent[2]:
+            return NOOP_SPAN
+        return Span(self, name, parent[0], parent[1], attributes)
+
+    def span(self, name: str, **attributes):
+        """Child of the current span, or a no-op outside a sampled trace."""
+        parent = _current.get()
+        if parent is None:
+            return NOOP_SPAN
+        return Span(self, name, parent.trace_id, parent.span_id, attributes)
+
+    @staticmethod
+    def current_traceparent() -> Optional[str]:
+        """traceparent to send with an outgoing call, or None outside a sampled trace."""
+        span = _current.get()
+        return span.traceparent() if span is not None else None
+
+    def inject(self, carrier: Dict[str, str]) -> Dict[str, str]:
+        traceparent = self.current_traceparent()
+        if traceparent:
+            carrier[TRACEPARENT] = traceparent
+        return carrier
+
+    def _export(self, span: Span):
+        record = span.to_dict()
+        with self._lock:
+            self._spans.append(record)
+            if self._file is not None:
+                try:
+                    self._file.write(json.dumps(record, default=str) + '\n')
+                except (OSError, ValueError) as e:
+                    print(f"Error writing trace span: {e}")
+
+    def get_trace(self, trace_id: str) -> List[Dict[str, Any]]:
+        """Spans of one trace, oldest first, each with self_ms: its duration less its children's."""
+        with self._lock:
+            spans = [dict(s) for s in self._spans if s['trace_id'] == trace_id]
+        children: Dict[str, float] = {}
+        for span in spans:
+            children[span['parent_id']] = children.get(span['parent_id'], 0.0) + span['duration_ms']
+        for span in spans:
+            # Children running in parallel can add up to more than their parent
+            span['self_ms'] = max(0.0, span['duration_ms'] - children.get(span['span_id'], 0.0))
+        return sorted(spans, key=lambda s: s['start'])
+
+    def list_traces(self, limit: int = 20, min_duration_ms: float = 0.0, name: Optional[str] = None,
+                    sort: str = 'recent') -> List[Dict[str, Any]]:
+        """One summary per trace in the buffer: its local root, duration and span count."""
+        with self._lock:
+            spans = list(self._spans)
+        by_trace: Dict[str, List[Dict[str, Any]]] = {}
+        for span in spans:
+            by_trace.setdefault(span['trace_id'], []).append(span)
+        summaries = []
+        for trace_id, trace_spans in by_trace.items():
+            # The local root is the earliest span whose parent is not in this buffer
+            local_ids = {span['span_id'] for span in trace_spans}
+            roots = [span for span in trace_spans if span['parent_id'] not in local_ids]
+            if not roots:
+                continue
+            root = min(roots, key=lambda s: s['start'])
+            if root['duration_ms'] < min_duration_ms or (name and name not in root['name']):
+                continue
+            summaries.append({
+                'trace_id': trace_id,
+                'name': root['name'],
+                'start': root['start'],
+                'duration_ms': root['duration_ms'],
+                'spans': len(trace_spans),
+                'remote_parent': root['parent_id'],
+                'error': root['error'],
+            })
+        key = (lambda t: t['duration_ms']) if sort == 'duration' else (lambda t: t['start'])
+        return sorted(summaries, key=key, reverse=True)[:limit]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'service': self.service, 'sample_rate': self.sample_rate,
+                    'buffered_spans': len(self._spans), 'buffer_spans': self._spans.maxlen}
+
+
+tracer = Tracer()
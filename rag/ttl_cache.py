@@ -0,0 +1,128 @@
+import hashlib
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+_MISSING = object()
+
+
+def make_cache_key(*parts: Any) -> str:
+    """sha256 over the JSON encoding of every part, so no prefix of a query can collide."""
+    payload = json.dumps(parts, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate retained size of strings, bytes and simple containers of them."""
+    if isinstance(value, (str, bytes)):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class TTLCache:
+    """Thread-safe LRU cache bounded by entry count and total bytes, with per-entry TTL.
+
+    An OrderedDict keeps entries in recency order, so lookups, inserts and
+    evictions are O(1). Expired entries are dropped when they are looked up
+    or reach the LRU end; nothing ever rebuilds the whole table.
+    """
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 64 * 2**20,
+                 ttl: Optional[float] = 600.0, size_fn: Callable[[Any], int] = estimate_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size_fn = size_fn
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, _, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._discard(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: Any, ttl: Optional[float] = _MISSING):
+        ttl = self.ttl if ttl is _MISSING else ttl
+        size = self.size_fn(value) + sys.getsizeof(key)
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (value, size, expires_at)
+            self._bytes += size
+            self._evict()
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            self._discard(key)
+            return entry[0]
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            return count
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def _discard(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._entries:
+            key, (_, _, expires_at) = next(iter(self._entries.items()))
+            if expires_at is not None and expires_at <= now:
+                self.expirations += 1
+            elif len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self.evictions += 1
+            else:
+                break
+            self._discard(key)
@@ -9,6 +9,7 @@ from threading import Thread, Lock
 import raftos
 from state_machine import NodeStateMachine  # Import the corrected state machine
 from rag import RAG
+from tracing import TRACEPARENT, tracer
 from utils import calculate_similarity, get_other_nodes
 import service_pb2
 import service_pb2_grpc
@@ -21,6 +22,12 @@ class QueryService(service_pb2_grpc.QueryServiceServicer):
         self._channel_cache = {}
 
     def Query(self, request, context):
+        # A forwarded query continues the follower's trace
+        traceparent = dict(context.invocation_metadata()).get(TRACEPARENT)
+        with tracer.start_trace("QueryService/Query", traceparent):
+            return self._query(request, context)
+
+    def _query(self, request, context):
         print(f"Received query: {request.query}")
         try:
             with self._leader_check_lock:
@@ -31,11 +38,13 @@ class QueryService(service_pb2_grpc.QueryServiceServicer):
                     "type": "query",
                     "data": {"query": request.query}
                 }
+                tracer.inject(command)
                 # Serialize the command to a string
                 command_str = json.dumps(command)
 
                 try:
-                    result = self.raft_node.apply_log(command_str, True)
+                    with tracer.span("raft_apply_log"):
+                        result = self.raft_node.apply_log(command_str, True)
                 except AttributeError:
                     result = "Command applied (fake success)"
                 
@@ -53,7 +62,8 @@ class QueryService(service_pb2_grpc.QueryServiceServicer):
                     stub = service_pb2_grpc.QueryServiceStub(channel)
                     
                     try:
-                        return stub.Query(request)
+                        with tracer.span("forward", leader=leader_address):
+                            return stub.Query(request, metadata=list(tracer.inject({}).items()))
                     except grpc.RpcError:
                         return service_pb2.QueryResponse(response="Leader communication failed")
                 else:
@@ -67,6 +77,8 @@ def serve():
     node_id = os.environ.get("RAFT_ID")
     raft_port = int(os.environ.get("RAFT_PORT"))
     other_nodes = get_other_nodes(node_id)
+    tracer.configure(f"query-service-{node_id}", float(os.environ.get("RAG_TRACE_SAMPLE_RATE", "0.01")),
+                     file=os.environ.get("RAG_TRACE_FILE"))
 
     state_machine = NodeStateMachine(node_id)
 
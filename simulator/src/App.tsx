@@ -1,9 +1,11 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Card, CardHeader, CardTitle, CardContent } from './components/ui/card';
 import { Button } from './components/ui/button';
 import { Input } from './components/ui/input';
 import { Power, Send, Sun , Moon } from 'lucide-react';
 
+type Source = { id: number; source: string | null; tokens: number };
+
 const App = () => {
   const [nodes, setNodes] = useState([
     { id: 1, port: 50051, status: 'unknown', isLeader: false },
@@ -13,13 +15,19 @@ const App = () => {
   
   const [query, setQuery] = useState('');
   const [response, setResponse] = useState('');
+  const [sources, setSources] = useState<Source[]>([]);
   const [loading, setLoading] = useState(false);
+  const streamRef = useRef<AbortController | null>(null);
   const [isDarkMode, setIsDarkMode] = useState(true);
 
   useEffect(() => {
     // Poll node status every 5 seconds
     const interval = setInterval(refreshNodeStatus, 5000);
-    return () => clearInterval(interval);
+    return () => {
+      clearInterval(interval);
+      // Disconnecting cancels generation on the server
+      streamRef.current?.abort();
+    };
   }, []);
 
   const refreshNodeStatus = async () => {
@@ -62,7 +70,13 @@ const App = () => {
   const sendQuery = async () => {
     if (!query.trim()) return;
     
+    streamRef.current?.abort();
+    const controller = new AbortController();
+    streamRef.current = controller;
+
     setLoading(true);
+    setResponse('');
+    setSources([]);
     try {
       // Find the leader node
       const leaderNode = nodes.find(node => node.isLeader);
@@ -71,21 +85,45 @@ const App = () => {
         return;
       }
       
-      const response = await fetch(`http://localhost:${leaderNode.port}/query`, {
+      // Sources arrive as soon as retrieval is done, then the answer token by token
+      const response = await fetch(`http://localhost:${leaderNode.port}/query/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ query })
+        body: JSON.stringify({ query }),
+        signal: controller.signal
       });
-      
-      const data = await response.json();
-      setResponse(data.response);
+      if (!response.ok || !response.body) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.detail || `HTTP ${response.status}`);
+      }
+
+      const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+      let buffer = '';
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += value;
+        const events = buffer.split('\n\n');
+        buffer = events.pop() ?? '';
+        for (const raw of events) {
+          const event = raw.match(/^event: (.*)$/m)?.[1];
+          const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] ?? '{}');
+          if (event === 'sources') setSources(data.sources);
+          else if (event === 'token') setResponse(prev => prev + data.text);
+          else if (event === 'error') throw new Error(data.detail);
+        }
+      }
     } catch (error) {
+      if (controller.signal.aborted) return;
       const errorMessage = (error as { message?: string })?.message;
       setResponse(errorMessage ? 'Error: ' + errorMessage : 'An unknown error occurred.');
     } finally {
-      setLoading(false);
+      if (streamRef.current === controller) {
+        streamRef.current = null;
+        setLoading(false);
+      }
     }
   };
 
@@ -189,8 +227,13 @@ const App = () => {
             </CardHeader>
             <CardContent>
               <div className="font-mono text-sm text-green-400 overflow-y-auto max-h-96">
-                {response || '> Awaiting command input...'}
+                {response || (loading ? '> ...' : '> Awaiting command input...')}
               </div>
+              {sources.length > 0 && (
+                <div className="mt-4 text-xs text-slate-400">
+                  SOURCES: {sources.map((s, i) => `[${i + 1}] ${s.source ?? 'unknown'}`).join('  ')}
+                </div>
+              )}
             </CardContent>
           </Card>
         </div>
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The rag modules import each other by bare name, as they do when run from rag/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'rag')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+
+import pytest
+
+from bounded_executor import BoundedExecutor, ExecutorBusyError
+
+
+def test_rejects_beyond_workers_plus_queue():
+    pool = BoundedExecutor('test', max_workers=1, max_queue=1)
+    release = threading.Event()
+    try:
+        running = pool.submit(release.wait, 5)
+        queued = pool.submit(lambda: 'queued')
+        with pytest.raises(ExecutorBusyError):
+            pool.submit(lambda: 'rejected')
+        assert pool.get_stats()['rejected'] == 1
+        release.set()
+        assert running.result(5) is True
+        assert queued.result(5) == 'queued'
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_slots_are_released_after_completion():
+    pool = BoundedExecutor('test', max_workers=1, max_queue=0)
+    try:
+        for i in range(5):
+            assert pool.submit(lambda i=i: i).result(5) == i
+        stats = pool.get_stats()
+        assert stats['completed'] == 5 and stats['rejected'] == 0 and stats['queued'] == 0
+    finally:
+        pool.shutdown()
+
+
+def test_failed_calls_release_their_slot():
+    pool = BoundedExecutor('test', max_workers=1, max_queue=0)
+
+    def fail():
+        raise ValueError('boom')
+
+    try:
+        with pytest.raises(ValueError):
+            pool.submit(fail).result(5)
+        assert pool.submit(lambda: 'next').result(5) == 'next'
+    finally:
+        pool.shutdown()
+
+
+def test_run_awaits_the_call():
+    pool = BoundedExecutor('test', max_workers=2, max_queue=0)
+    try:
+        assert asyncio.run(pool.run(sum, [1, 2, 3])) == 6
+    finally:
+        pool.shutdown()
@@ -0,0 +1,39 @@
+import random
+
+import pytest
+
+from document_loader import TextFile, chunk_text
+
+
+def _text(words=400, seed=1):
+    rng = random.Random(seed)
+    parts = []
+    for _ in range(words):
+        word = ''.join(rng.choice('abcdefgh') for _ in range(rng.randint(1, 9)))
+        parts.append(word + rng.choice([' ', '  ', '\n', ' \n\n']))
+    return ''.join(parts)
+
+
+def _chunks(source, overlap):
+    return [(c.text, c.start, c.end) for c in chunk_text(source, 'doc.txt', None, 8, overlap)]
+
+
+@pytest.mark.parametrize('overlap', [0, 2, 4])
+def test_block_streaming_matches_whole_text(tmp_path, overlap):
+    text = _text()
+    path = tmp_path / 'doc.txt'
+    path.write_text(text, encoding='utf-8')
+    expected = _chunks(text, overlap)
+    for block_chars in range(1, 300, 7):
+        assert _chunks(TextFile(str(path), block_chars=block_chars), overlap) == expected
+
+
+def test_chunks_are_verbatim_slices():
+    text = _text(words=50, seed=2)
+    for chunk in chunk_text(text, 'doc.txt', None, 8, 0):
+        assert text[chunk.start:chunk.end].strip() == chunk.text
+
+
+def test_overlap_must_be_smaller_than_window():
+    with pytest.raises(ValueError):
+        list(chunk_text('a b c', 'doc.txt', None, 4, 4))
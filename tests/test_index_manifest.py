@@ -0,0 +1,108 @@
+import hashlib
+import os
+
+import numpy as np
+import pytest
+
+from index_manifest import IndexManifest, content_hash
+
+
+def test_stat_check_and_touch(tmp_path):
+    manifest = IndexManifest()
+    path = str(tmp_path / 'a.txt')
+    assert not manifest.is_unchanged(path, 1.0, 10)
+    manifest.update(path, 1.0, 10, content_hash('text'), [('h1', 0), ('h2', 1)])
+    assert manifest.is_unchanged(path, 1.0, 10)
+    assert not manifest.is_unchanged(path, 2.0, 10)
+    manifest.touch(path, 2.0, 10)
+    assert manifest.is_unchanged(path, 2.0, 10)
+
+
+def test_paths_under_and_remove(tmp_path):
+    manifest = IndexManifest()
+    inside = [str(tmp_path / 'docs' / 'a.txt'), str(tmp_path / 'docs' / 'sub' / 'b.txt')]
+    outside = str(tmp_path / 'docs2' / 'c.txt')
+    for chunk_id, path in enumerate(inside + [outside]):
+        manifest.update(path, 1.0, 1, 'digest', [('h', chunk_id)])
+    assert sorted(manifest.paths_under(str(tmp_path / 'docs'))) == inside
+    (tmp_path / 'docs').mkdir()
+    (tmp_path / 'docs' / 'a.txt').write_text('a')
+    assert manifest.paths_under(inside[0]) == [inside[0]]
+    assert manifest.max_id() == 2
+    assert manifest.remove(outside) == [2]
+    assert manifest.remove(outside) == []
+    assert manifest.max_id() == 1
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'manifest.json')
+    manifest = IndexManifest(path)
+    manifest.update('/docs/a.txt', 1.5, 3, 'digest', [('h', 7)])
+    manifest.save()
+    copy = str(tmp_path / 'copy.json')
+    manifest.save(copy)
+    for loaded in (IndexManifest(path), IndexManifest(copy)):
+        assert loaded.get('/docs/a.txt') == {'mtime': 1.5, 'size': 3, 'sha256': 'digest', 'chunks': [['h', 7]]}
+
+
+class _Encoder:
+    """Deterministic stand-in for the embedding model that counts encoded texts."""
+
+    def __init__(self):
+        self.encoded = 0
+
+    def encode(self, texts, **kwargs):
+        self.encoded += len(texts)
+        return np.stack([np.random.default_rng(int(hashlib.md5(t.encode()).hexdigest()[:8], 16)).random(768)
+                         for t in texts]).astype(np.float32)
+
+
+@pytest.fixture
+def indexer(tmp_path, monkeypatch):
+    pytest.importorskip('faiss')
+    import faiss_indexer
+    encoder = _Encoder()
+    monkeypatch.setattr(faiss_indexer, 'get_encoder', lambda *args, **kwargs: encoder)
+    docs = tmp_path / 'docs'
+    docs.mkdir()
+    indexer = faiss_indexer.FaissIndexer('test-model', str(docs), None, chunk_tokens=8, chunk_overlap=0)
+    indexer.create_faiss_index()
+    return indexer, encoder, docs
+
+
+def _paragraphs(name, count):
+    return '\n\n'.join(f"{name} paragraph {i} with exactly eight words" for i in range(count))
+
+
+def _manifest_ids(indexer):
+    return sorted(chunk_id for path in indexer.manifest.paths_under(indexer.doc_path)
+                  for _, chunk_id in indexer.manifest.get(path)['chunks'])
+
+
+def test_refresh_only_embeds_what_changed(indexer):
+    indexer, encoder, docs = indexer
+    (docs / 'a.txt').write_text(_paragraphs('alpha', 6))
+    (docs / 'b.txt').write_text(_paragraphs('beta', 4))
+    stats = indexer.add_documents_to_index(str(docs))
+    assert stats['changed_files'] == 2 and stats['added'] == encoder.encoded == 10
+
+    encoder.encoded = 0
+    stats = indexer.add_documents_to_index(str(docs))
+    assert stats['unchanged_files'] == 2 and encoder.encoded == 0
+
+    # New mtime, same content: nothing is re-embedded
+    os.utime(docs / 'a.txt', (1, 1))
+    stats = indexer.add_documents_to_index(str(docs))
+    assert stats['unchanged_files'] == 2 and stats['changed_files'] == 0 and encoder.encoded == 0
+
+    # One edited paragraph: only its chunk is replaced
+    (docs / 'a.txt').write_text(_paragraphs('alpha', 6).replace('paragraph 3', 'section 3'))
+    stats = indexer.add_documents_to_index(str(docs))
+    assert stats['changed_files'] == 1
+    assert stats['added'] == stats['removed'] == encoder.encoded == 1
+
+    os.remove(docs / 'b.txt')
+    stats = indexer.add_documents_to_index(str(docs))
+    assert stats['deleted_files'] == 1 and stats['removed'] == 4
+    assert indexer.index.ntotal == len(indexer.documents) == 6
+    assert sorted(indexer.documents) == _manifest_ids(indexer)
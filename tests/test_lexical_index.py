@@ -0,0 +1,96 @@
+import math
+
+import numpy as np
+import pytest
+
+from lexical_index import LexicalIndex, tokenize
+
+DOCS = {
+    0: "The ARS-2 pump failed at v1.2",
+    1: "pump maintenance schedule for the pump room",
+    2: "co2 sensor calibration",
+    3: "sensor readings drift after calibration of the sensor",
+}
+
+
+def _bm25(docs, query, k1=1.2, b=0.75):
+    """Reference BM25 over tokenized docs, same idf as LexicalIndex."""
+    tokens = {doc_id: tokenize(text) for doc_id, text in docs.items()}
+    avg_len = sum(len(t) for t in tokens.values()) / len(tokens)
+    scores = {}
+    for term in set(tokenize(query)):
+        df = sum(term in t for t in tokens.values())
+        if not df:
+            continue
+        idf = math.log(1.0 + (len(tokens) - df + 0.5) / (df + 0.5))
+        for doc_id, t in tokens.items():
+            tf = t.count(term)
+            if tf:
+                norm = k1 * (1.0 - b + b * len(t) / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1.0) / (tf + norm)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+def _assert_ranked(results, expected):
+    assert [doc_id for doc_id, _ in results] == [doc_id for doc_id, _ in expected]
+    assert [score for _, score in results] == pytest.approx([score for _, score in expected], rel=1e-5)
+
+
+def _index(docs=DOCS):
+    index = LexicalIndex()
+    index.add_many(docs.items())
+    return index
+
+
+def test_tokenize_keeps_identifiers_whole():
+    assert tokenize("The ARS-2 pump, v1.2 and co2!") == ['the', 'ars-2', 'pump', 'v1.2', 'and', 'co2']
+
+
+@pytest.mark.parametrize('query', ['pump', 'sensor calibration', 'ars-2', 'the pump sensor'])
+def test_scores_match_reference_bm25(query):
+    _assert_ranked(_index().search(query, top_k=10), _bm25(DOCS, query))
+
+
+def test_top_k_and_unknown_terms():
+    index = _index()
+    assert len(index.search('the pump sensor', top_k=2)) == 2
+    assert index.search('nothing matches') == []
+
+
+def test_allowed_mask_restricts_results():
+    allowed = np.zeros(4, dtype=bool)
+    allowed[3] = True
+    assert [doc_id for doc_id, _ in _index().search('sensor', allowed=allowed)] == [3]
+
+
+def test_removed_and_replaced_text_no_longer_matches():
+    index = _index()
+    index.remove([1])
+    index.add(2, "pump spare parts")
+    docs = {0: DOCS[0], 2: "pump spare parts", 3: DOCS[3]}
+    assert len(index) == 3
+    _assert_ranked(index.search('pump', top_k=10), _bm25(docs, 'pump'))
+    assert index.search('co2') == []
+
+
+def test_compaction_keeps_results():
+    index = _index()
+    # Too few dead postings to compact automatically
+    index.remove([2])
+    docs = {doc_id: text for doc_id, text in DOCS.items() if doc_id != 2}
+    _assert_ranked(index.search('pump sensor calibration', top_k=10), _bm25(docs, 'pump sensor calibration'))
+    memory = index.memory_bytes()
+    index.compact()
+    assert index.memory_bytes() < memory
+    _assert_ranked(index.search('pump sensor calibration', top_k=10), _bm25(docs, 'pump sensor calibration'))
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = _index()
+    index.remove([2])
+    index.save(str(tmp_path))
+    for mmap in (True, False):
+        loaded = LexicalIndex.load(str(tmp_path), mmap=mmap)
+        assert len(loaded) == 3
+        for query in ('pump', 'sensor calibration', 'co2'):
+            _assert_ranked(loaded.search(query, top_k=10), index.search(query, top_k=10))
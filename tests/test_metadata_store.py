@@ -0,0 +1,62 @@
+import pytest
+
+from metadata_store import MetadataStore, validate_filters
+
+
+def _store():
+    store = MetadataStore()
+    store.add(0, {'tenant': 'acme', 'source': 'a.txt', 'date': '2024-01-05'})
+    store.add(1, {'tenant': 'acme', 'source': 'b.txt', 'date': '2024-02-10'})
+    store.add(9, {'tenant': 'globex', 'source': 'c.txt', 'date': '2024-03-01'})
+    store.add(2000, {'tenant': 'initech', 'source': 'd.txt'})
+    return store
+
+
+def _ids(store, filters):
+    return sorted(int(i) for i in MetadataStore.to_mask(store.filter_bitmap(filters)).nonzero()[0])
+
+
+def test_value_and_any_of_filters():
+    store = _store()
+    assert _ids(store, {'tenant': 'acme'}) == [0, 1]
+    assert _ids(store, {'tenant': ['globex', 'initech', 'missing']}) == [9, 2000]
+    assert _ids(store, {'tenant': 'missing'}) == []
+
+
+def test_filters_combine_with_and():
+    assert _ids(_store(), {'tenant': 'acme', 'source': 'b.txt'}) == [1]
+
+
+def test_date_range_is_inclusive_and_skips_undated_chunks():
+    store = _store()
+    assert _ids(store, {'date': {'from': '2024-02-10'}}) == [1, 9]
+    assert _ids(store, {'date': {'from': '2024-01-01', 'to': '2024-02-10'}}) == [0, 1]
+
+
+def test_remove_and_replace_clear_old_bits():
+    store = _store()
+    store.remove([0])
+    store.add(1, {'tenant': 'globex', 'source': 'b.txt'})
+    assert _ids(store, {'tenant': 'acme'}) == []
+    assert _ids(store, {'tenant': 'globex'}) == [1, 9]
+    assert store.values('tenant') == ['globex', 'initech']
+    assert len(store) == 3
+
+
+def test_bitmaps_grow_past_the_initial_capacity():
+    store = _store()
+    store.add(50000, {'tenant': 'acme'})
+    assert _ids(store, {'tenant': 'acme'}) == [0, 1, 50000]
+
+
+@pytest.mark.parametrize('filters', [
+    ['tenant'],
+    {'owner': 'x'},
+    {'tenant': {'from': 'a'}},
+    {'date': {'after': '2024-01-01'}},
+    {'date': {'from': 20240101}},
+    {'tenant': [{'nested': 1}]},
+])
+def test_invalid_filters_are_rejected(filters):
+    with pytest.raises(ValueError):
+        validate_filters(filters)
@@ -0,0 +1,77 @@
+import pytest
+
+from metrics import MetricsRegistry
+
+
+def test_counter_and_gauge_lines():
+    registry = MetricsRegistry()
+    requests = registry.counter('requests_total', 'Requests served', ['route'])
+    requests.inc(route='/query')
+    requests.inc(2, route='/query')
+    registry.gauge('queue_depth', 'Queued items').set(3)
+    assert registry.render() == (
+        '# HELP requests_total Requests served\n'
+        '# TYPE requests_total counter\n'
+        'requests_total{route="/query"} 3.0\n'
+        '# HELP queue_depth Queued items\n'
+        '# TYPE queue_depth gauge\n'
+        'queue_depth 3.0\n'
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram('latency_seconds', 'Latency', ['stage'], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        latency.observe(value, stage='search')
+    lines = registry.render().splitlines()
+    assert lines[:2] == ['# HELP latency_seconds Latency', '# TYPE latency_seconds histogram']
+    assert lines[2:] == [
+        'latency_seconds_bucket{stage="search",le="0.1"} 2.0',
+        'latency_seconds_bucket{stage="search",le="1.0"} 3.0',
+        'latency_seconds_bucket{stage="search",le="+Inf"} 4.0',
+        'latency_seconds_sum{stage="search"} 2.65',
+        'latency_seconds_count{stage="search"} 4.0',
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.counter('errors_total', 'Errors', ['reason']).inc(reason='bad "quote"\\\n')
+    assert 'errors_total{reason="bad \\"quote\\"\\\\\\n"} 1.0' in registry.render().splitlines()
+
+
+def test_collectors_merge_families_and_skip_failures():
+    registry = MetricsRegistry()
+
+    def first():
+        yield 'lag_entries', 'gauge', 'Lag', [({'peer': 'a'}, 1)]
+
+    def second():
+        yield 'lag_entries', 'gauge', 'Lag', [({'peer': 'b'}, 2), ({'peer': 'c'}, None)]
+
+    def broken():
+        raise RuntimeError('scrape failed')
+        yield
+
+    for collector in (first, broken, second):
+        registry.add_collector(collector)
+    assert registry.render() == (
+        '# HELP lag_entries Lag\n'
+        '# TYPE lag_entries gauge\n'
+        'lag_entries{peer="a"} 1.0\n'
+        'lag_entries{peer="b"} 2.0\n'
+    )
+
+
+def test_unused_metrics_are_not_rendered():
+    registry = MetricsRegistry()
+    registry.counter('idle_total', 'Never incremented')
+    assert registry.render() == '\n'
+
+
+def test_reregistering_returns_the_same_metric():
+    registry = MetricsRegistry()
+    assert registry.counter('hits_total', 'Hits') is registry.counter('hits_total', 'Hits')
+    with pytest.raises(ValueError):
+        registry.gauge('hits_total', 'Hits')
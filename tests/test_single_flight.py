@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def _start_leader(flight, key, release, result='value'):
+    """Run a leader for key on a thread, blocked until release is set."""
+    started = threading.Event()
+
+    def fn():
+        started.set()
+        release.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    future = pool.submit(flight.do, key, fn)
+    started.wait(5)
+    pool.shutdown(wait=False)
+    return future
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    leader = _start_leader(flight, 'k', release)
+    calls = []
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        followers = [pool.submit(flight.do, 'k', lambda: calls.append(1)) for _ in range(4)]
+        _wait_for(lambda: flight.get_stats()['shared'] == 4)
+        release.set()
+        assert [f.result(5) for f in followers] == ['value'] * 4
+    assert leader.result(5) == 'value'
+    assert calls == []
+    assert flight.get_stats() == {'in_flight': 0, 'leaders': 1, 'shared': 4, 'errors': 0}
+
+
+def test_followers_get_the_leaders_exception():
+    flight = SingleFlight()
+    release = threading.Event()
+    leader = _start_leader(flight, 'k', release, result=ValueError('boom'))
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        follower = pool.submit(flight.do, 'k', lambda: 'unused')
+        _wait_for(lambda: flight.get_stats()['shared'] == 1)
+        release.set()
+        with pytest.raises(ValueError):
+            follower.result(5)
+    with pytest.raises(ValueError):
+        leader.result(5)
+    assert flight.get_stats()['errors'] == 1
+
+
+def test_follower_timeout_leaves_the_leader_running():
+    flight = SingleFlight()
+    release = threading.Event()
+    leader = _start_leader(flight, 'k', release)
+    with pytest.raises(TimeoutError):
+        flight.do('k', lambda: 'unused', timeout=0.01)
+    release.set()
+    assert leader.result(5) == 'value'
+
+
+def test_key_is_released_after_the_call():
+    flight = SingleFlight()
+    assert flight.do('k', lambda: 1) == 1
+    assert flight.do('k', lambda: 2) == 2
+    assert flight.in_flight() == 0
+
+
+def test_async_callers_share_a_flight_with_sync_callers():
+    flight = SingleFlight()
+    calls = []
+
+    async def answer():
+        calls.append(1)
+        await asyncio.sleep(0.2)
+        return 'value'
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        leader = asyncio.ensure_future(flight.do_async('k', answer))
+        await asyncio.sleep(0.01)
+        sync_follower = loop.run_in_executor(None, flight.do, 'k', lambda: 'unused')
+        followers = [flight.do_async('k', answer) for _ in range(3)]
+        return await asyncio.gather(leader, sync_follower, *followers)
+
+    assert asyncio.run(main()) == ['value'] * 5
+    assert calls == [1]
+    assert flight.get_stats()['shared'] == 4
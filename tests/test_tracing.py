@@ -0,0 +1,49 @@
+import pytest
+
+from tracing import NOOP_SPAN, Tracer, parse_traceparent
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+
+def test_parse_traceparent():
+    assert parse_traceparent(f'00-{TRACE_ID}-{PARENT_ID}-01') == (TRACE_ID, PARENT_ID, True)
+    assert parse_traceparent(f'00-{TRACE_ID}-{PARENT_ID}-00') == (TRACE_ID, PARENT_ID, False)
+    # Only the sampled bit of the flags counts
+    assert parse_traceparent(f'00-{TRACE_ID}-{PARENT_ID}-03')[2] is True
+    assert parse_traceparent(f' 00-{TRACE_ID.upper()}-{PARENT_ID}-01 ') == (TRACE_ID, PARENT_ID, True)
+
+
+@pytest.mark.parametrize('value', [
+    None,
+    '',
+    'garbage',
+    f'01-{TRACE_ID}-{PARENT_ID}-01',
+    f'00-{TRACE_ID[:-1]}-{PARENT_ID}-01',
+    f'00-{TRACE_ID}-{PARENT_ID}-1',
+    f'00-{TRACE_ID}-{PARENT_ID}-01-extra',
+    f'00-{"0" * 32}-{PARENT_ID}-01',
+    f'00-{TRACE_ID}-{"0" * 16}-01',
+    f'00-{TRACE_ID.replace("4", "g")}-{PARENT_ID}-01',
+])
+def test_malformed_traceparent_is_ignored(value):
+    assert parse_traceparent(value) is None
+
+
+def test_sampled_caller_is_followed_and_children_nest():
+    tracer = Tracer(sample_rate=0.0)
+    with tracer.start_trace('request', f'00-{TRACE_ID}-{PARENT_ID}-01') as root:
+        with tracer.span('search') as child:
+            assert tracer.current_traceparent() == f'00-{TRACE_ID}-{child.span_id}-01'
+    spans = {span['name']: span for span in tracer.get_trace(TRACE_ID)}
+    assert spans['request']['parent_id'] == PARENT_ID
+    assert spans['search']['parent_id'] == root.span_id
+
+
+def test_unsampled_requests_record_nothing():
+    tracer = Tracer(sample_rate=0.0)
+    assert tracer.start_trace('request', f'00-{TRACE_ID}-{PARENT_ID}-00') is NOOP_SPAN
+    assert tracer.start_trace('request') is NOOP_SPAN
+    assert tracer.continue_trace('apply', 'garbage') is NOOP_SPAN
+    assert tracer.span('search') is NOOP_SPAN
+    assert tracer.get_trace(TRACE_ID) == []
@@ -0,0 +1,63 @@
+import ttl_cache
+from ttl_cache import TTLCache, make_cache_key
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_evicts_least_recently_used():
+    cache = TTLCache(max_entries=2, ttl=None)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.get_stats()['evictions'] == 1
+
+
+def test_bounded_by_bytes():
+    cache = TTLCache(max_entries=100, max_bytes=1000, ttl=None, size_fn=lambda v: v)
+    cache.put('a', 400)
+    cache.put('b', 400)
+    cache.put('c', 400)
+    assert cache.get('a') is None
+    assert cache.get_stats()['bytes'] <= 1000
+    # Larger than the whole cache: never stored
+    cache.put('huge', 2000)
+    assert cache.get('huge') is None and cache.get('c') == 400
+
+
+def test_entries_expire(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(ttl_cache.time, 'monotonic', clock)
+    cache = TTLCache(ttl=10.0)
+    cache.put('a', 1)
+    cache.put('b', 2, ttl=None)
+    clock.now += 9
+    assert cache.get('a') == 1
+    clock.now += 2
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    stats = cache.get_stats()
+    assert stats['expirations'] == 1 and stats['size'] == 1
+
+
+def test_put_replaces_and_pop_removes():
+    cache = TTLCache(ttl=None, size_fn=lambda v: len(v))
+    cache.put('a', 'xx')
+    cache.put('a', 'yyyy')
+    assert len(cache) == 1 and cache.get('a') == 'yyyy'
+    assert cache.pop('a') == 'yyyy'
+    assert cache.pop('a', 'gone') == 'gone'
+    assert cache.get_stats()['bytes'] == 0
+
+
+def test_cache_key_separates_parts():
+    assert make_cache_key('ab', 'c') != make_cache_key('a', 'bc')
+    assert make_cache_key({'x': 1, 'y': 2}) == make_cache_key({'y': 2, 'x': 1})
@@ -1,9 +1,12 @@
-from sentence_transformers import SentenceTransformer
 import numpy as np
 import os
+import sys
 import time
 import threading
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "rag"))
+from model_registry import get_encoder
+
 embedding_model = None
 _model_lock = threading.Lock()
 
@@ -12,34 +15,38 @@ def _get_embedding_model():
     if embedding_model is None:
         with _model_lock:
             if embedding_model is None:
-                embedding_model = SentenceTransformer('all-mpnet-base-v2')
+                embedding_model = get_encoder('all-mpnet-base-v2')
     return embedding_model
 
 def calculate_similarity(response1, response2):
     """Calculates the cosine similarity between two response embeddings."""
+    return calculate_similarities([response1], [response2])[0]
+
+def calculate_similarities(responses1, responses2):
+    """Pairwise cosine similarities of two equal-length lists of responses,
+    encoded together in a single model call."""
     try:
+        if len(responses1) != len(responses2):
+            raise ValueError("Response lists must have the same length")
+        similarities = [0.0] * len(responses1)
+        pairs = [i for i, (a, b) in enumerate(zip(responses1, responses2)) if a and b]
+        if not pairs:
+            return similarities
+
         model = _get_embedding_model()
-        
-        if not response1 or not response2:
-            return 0.0
-        
-        embedding1 = model.encode(response1, convert_to_tensor=True)
-        embedding2 = model.encode(response2, convert_to_tensor=True)
-        
-        dot_product = np.dot(embedding1, embedding2)
-        norm1 = np.linalg.norm(embedding1)
-        norm2 = np.linalg.norm(embedding2)
-        
-        if norm1 == 0 or norm2 == 0:
-            return 0.0
-        
-        similarity = dot_product / (norm1 * norm2)
-        
-        return max(-1.0, min(1.0, similarity.item()))
-        
+        texts = [responses1[i] for i in pairs] + [responses2[i] for i in pairs]
+        embeddings = np.asarray(model.encode(texts), dtype=np.float32)
+        left, right = embeddings[:len(pairs)], embeddings[len(pairs):]
+
+        norms = np.linalg.norm(left, axis=1) * np.linalg.norm(right, axis=1)
+        dots = np.sum(left * right, axis=1)
+        for i, dot, norm in zip(pairs, dots, norms):
+            similarities[i] = 0.0 if norm == 0 else max(-1.0, min(1.0, float(dot / norm)))
+        return similarities
+
     except Exception as e:
         print(f"Error calculating similarity: {e}")
-        return 0.0
+        return [0.0] * len(responses1)
 
 def get_other_nodes(node_id):
     """